@@ -1,9 +1,20 @@
 import ROOT
+import numpy as np
 
 class HistoTool:
 
-    def __init__(self):
+    def __init__(self,bufferSize=0):
+
+        """
+        if bufferSize>0 the values passed to fill are buffered (per histogram) in arrays of this size
+        and filled in bulk when the buffer is full or when the histograms are accessed
+        """
+
         self.histos={}
+        self.bufferSize=bufferSize
+        self.buffers={}
+        self.catIdx={}
+        self.catNames=[]
 
     def add(self,h):
 
@@ -12,30 +23,89 @@ class HistoTool:
         self.histos[h.GetName()]={'inc':h}
         h.Sumw2()
         h.SetDirectory(0)
+        if self.bufferSize>0:
+            ndim=h.GetDimension()
+            self.buffers[h.GetName()]={'ndim' : ndim,
+                                       'vals' : np.zeros((self.bufferSize,ndim+1),dtype=np.float64),
+                                       'cats' : np.zeros(self.bufferSize,dtype=np.int32),
+                                       'n'    : 0}
 
     def get(self,k,cat='inc'):
 
         """ returns an histogram """
 
+        if k in self.buffers: self.flush(k)
         return self.histos[k][cat] if k in self.histos and cat in self.histos[k] else None
+
+    def getCategory(self,key,cat):
+
+        """returns the histogram for a category, starting a new one if needed"""
+
+        if not cat in self.histos[key]:
+            self.histos[key][cat]=self.histos[key]['inc'].Clone('%s_%s'%(key,cat))
+            self.histos[key][cat].SetDirectory(0)
+            self.histos[key][cat].Reset('ICE')
+        return self.histos[key][cat]
         
     def fill(self,val,key,cats,pfix=None):
 
         """if available fills the histo, otherwise it starts a new one"""
 
         if not key in self.histos: return
+
+        if self.bufferSize>0:
+            buf=self.buffers[key]
+            if len(val)==buf['ndim']: val=tuple(val)+(1.0,)
+            for cat in cats:
+                if pfix: cat=cat+pfix
+                if not cat in self.catIdx:
+                    self.catIdx[cat]=len(self.catNames)
+                    self.catNames.append(cat)
+                n=buf['n']
+                buf['vals'][n]=val
+                buf['cats'][n]=self.catIdx[cat]
+                buf['n']=n+1
+                if n+1==self.bufferSize: self.flush(key)
+            return
+
         for cat in cats:
             if pfix: cat=cat+pfix
-            if not cat in self.histos[key]:
-                self.histos[key][cat]=self.histos[key]['inc'].Clone('%s_%s'%(key,cat))
-                self.histos[key][cat].SetDirectory(0)
-                self.histos[key][cat].Reset('ICE')
-            self.histos[key][cat].Fill(*val)
+            self.getCategory(key,cat).Fill(*val)
+
+    def flush(self,key=None):
+
+        """fills the buffered values in the histograms (all of them if key is None)"""
+
+        for k in ([key] if key else self.buffers.keys()):
+            buf=self.buffers[k]
+            n=buf['n']
+            if n==0: continue
+            vals=buf['vals'][0:n]
+            cats=buf['cats'][0:n]
+            for icat in np.unique(cats):
+                sel=(cats==icat)
+                cols=[np.ascontiguousarray(vals[sel,i]) for i in range(buf['ndim']+1)]
+                self.getCategory(k,self.catNames[icat]).FillN(len(cols[0]),*cols)
+            buf['n']=0
+
+    def fillN(self,vals,wgts,key,cats,pfix=None):
+
+        """fills the histo in bulk from arrays of values and weights (1D histograms only)"""
+
+        if not key in self.histos: return
+        if len(vals)==0: return
+        vals=np.ascontiguousarray(vals,dtype=np.float64)
+        wgts=np.ascontiguousarray(np.broadcast_to(wgts,vals.shape),dtype=np.float64)
+        for cat in cats:
+            if pfix: cat=cat+pfix
+            self.getCategory(key,cat).FillN(len(vals),vals,wgts)
             
 
     def writeToFile(self,fOut):
 
         """dumps all histograms to a file"""
+
+        self.flush()
         
         if isinstance(fOut,str):
             fOut=ROOT.TFile.Open(fOut,'RECREATE')
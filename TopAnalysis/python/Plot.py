@@ -1,29 +1,102 @@
 import ROOT
 import math
 import os,sys
+import numpy as np
 from collections import OrderedDict
 
 from TopLJets2015.TopAnalysis.rounding import *
 
+#histogram types whose bin contents can be read directly as arrays
+HISTOARRAYTYPES={'TH1D':np.float64,'TH1F':np.float32,'TH2D':np.float64,'TH2F':np.float32}
+
+def getHistoArrays(h):
+
+    """
+    returns numpy views of the bin contents and of the sums of squared weights of a histogram (under/overflows included,
+    indexed by global bin) the latter is None if Sumw2 is not set, None is returned if the type of histogram is not supported
+    """
+
+    dtype=HISTOARRAYTYPES.get(h.ClassName(),None)
+    if dtype is None: return None
+    h.BufferEmpty()
+    ncells=h.GetNcells()
+    buf=h.GetArray()
+    buf.SetSize(ncells)
+    contents=np.frombuffer(buf,dtype=dtype,count=ncells)
+    sumw2=None
+    if h.GetSumw2N()==ncells:
+        buf=h.GetSumw2().GetArray()
+        buf.SetSize(ncells)
+        sumw2=np.frombuffer(buf,dtype=np.float64,count=ncells)
+    return contents,sumw2
+
+def getHistoContents(h):
+
+    """returns copies of the bin contents and of the squared bin errors of a histogram (under/overflows included)"""
+
+    arrays=getHistoArrays(h)
+    if arrays is None:
+        ncells=h.GetNcells()
+        return np.array([h.GetBinContent(xbin) for xbin in xrange(ncells)]),np.array([h.GetBinError(xbin)**2 for xbin in xrange(ncells)])
+    contents,sumw2=arrays
+    contents=np.array(contents,dtype=np.float64)
+    sumw2=np.array(sumw2) if sumw2 is not None else np.abs(contents)
+    return contents,sumw2
+
+def setHistoContents(h,contents,sumw2):
+
+    """writes back at once the bin contents and the squared bin errors of a histogram (the number of entries is kept)"""
+
+    entries=h.GetEntries()
+    ncells=h.GetNcells()
+    if h.ClassName() in HISTOARRAYTYPES:
+        h.SetContent(np.ascontiguousarray(contents,dtype=np.float64))
+        if h.GetSumw2N()!=ncells: h.Sumw2()
+        h.GetSumw2().Set(ncells,np.ascontiguousarray(sumw2,dtype=np.float64))
+    else:
+        for xbin in xrange(ncells):
+            h.SetBinContent(xbin,contents[xbin])
+            h.SetBinError(xbin,math.sqrt(sumw2[xbin]))
+    h.SetEntries(entries)
+
+def resetNaNBins(h):
+
+    """sets to 0 the contents and errors of the bins of a histogram which are NaN"""
+
+    contents,sumw2=getHistoContents(h)
+    nans=np.isnan(contents)
+    if not nans.any(): return
+    contents[nans], sumw2[nans] = 0., 0.
+    setHistoContents(h,contents,sumw2)
+
+def getBinWidths(h):
+
+    """returns the widths of the bins of a 1D histogram (under/overflows excluded)"""
+
+    axis=h.GetXaxis()
+    nbins=axis.GetNbins()
+    xbins=axis.GetXbins()
+    if xbins.GetSize()==nbins+1:
+        buf=xbins.GetArray()
+        buf.SetSize(nbins+1)
+        return np.diff(np.frombuffer(buf,dtype=np.float64,count=nbins+1))
+    return np.full(nbins,(axis.GetXmax()-axis.GetXmin())/nbins)
+
 def fixExtremities(h,addOverflow=True,addUnderflow=True):
 
     """increments the first and the last bin to show the under- and over-flows"""
 
+    contents,sumw2=getHistoContents(h)
     if addUnderflow :
-        fbin  = h.GetBinContent(0) + h.GetBinContent(1)
-	fbine = ROOT.TMath.Sqrt(h.GetBinError(0)*h.GetBinError(0) + h.GetBinError(1)*h.GetBinError(1))
-	h.SetBinContent(1,fbin)
-	h.SetBinError(1,fbine)
-	h.SetBinContent(0,0)
-	h.SetBinError(0,0)
+        contents[1] += contents[0]
+        sumw2[1]    += sumw2[0]
+        contents[0], sumw2[0] = 0., 0.
     if addOverflow:
-        nbins = h.GetNbinsX();
-	fbin  = h.GetBinContent(nbins) + h.GetBinContent(nbins+1)
-	fbine = ROOT.TMath.Sqrt(h.GetBinError(nbins)*h.GetBinError(nbins)  + h.GetBinError(nbins+1)*h.GetBinError(nbins+1))
-	h.SetBinContent(nbins,fbin)
-	h.SetBinError(nbins,fbine)
-	h.SetBinContent(nbins+1,0)
-	h.SetBinError(nbins+1,0)
+        nbins = h.GetNbinsX()
+        contents[nbins] += contents[nbins+1]
+        sumw2[nbins]    += sumw2[nbins+1]
+        contents[nbins+1], sumw2[nbins+1] = 0., 0.
+    setHistoContents(h,contents,sumw2)
 
 def scaleTo(h,val):
     """ scale histogram integral to a given value """
@@ -32,13 +105,83 @@ def scaleTo(h,val):
     h.Scale(val/total)
 
 def divideByBinWidth(h):
-    """ loop over the bins and divide contents by its width"""
-    for xbin in xrange(1,h.GetNbinsX()+1):
-        wid=h.GetXaxis().GetBinWidth(xbin)
-        val=h.GetBinContent(xbin)
-        unc=h.GetBinError(xbin)
-        h.SetBinContent(xbin,val/wid)
-        h.SetBinError(xbin,unc/wid)
+    """ divide the contents (and errors) of the bins by their width"""
+    contents,sumw2=getHistoContents(h)
+    wid=getBinWidths(h)
+    contents[1:-1] /= wid
+    sumw2[1:-1]    /= wid**2
+    setHistoContents(h,contents,sumw2)
+
+def getSystEnvelope(nominal,systs):
+
+    """
+    returns the quadrature sums of the positive and of the negative differences of a set of
+    systematic variations (nsyst x nbins) with respect to the nominal (nbins)
+    """
+
+    diff=np.atleast_2d(systs)-nominal
+    up=np.sqrt(np.where(diff>0,diff**2,0.).sum(axis=0))
+    down=np.sqrt(np.where(diff>0,0.,diff**2).sum(axis=0))
+    return up,down
+
+def getSystUncertainties(nominal,systs):
+
+    """
+    computes the uncertainties from a set of systematic variations (nsyst x nbins) of a nominal distribution (nbins),
+    the first and last bins are the under/overflows which are excluded from the integrals
+    returns the up/down envelopes for the variations as they are and for the variations normalized
+    to the integral of the nominal (shape only)
+    """
+
+    systs=np.atleast_2d(systs)
+    up,down=getSystEnvelope(nominal,systs)
+    integrals=systs[:,1:-1].sum(axis=1)
+    sf=np.ones_like(integrals)
+    sf[integrals>0]=nominal[1:-1].sum()/integrals[integrals>0]
+    upShape,downShape=getSystEnvelope(nominal,systs*sf[:,np.newaxis])
+    return up,down,upShape,downShape
+
+def getHistoState(h):
+    """ converts a 1D histogram to a dict with its binning, contents and style (can be pickled and sent to other processes) """
+    axis=h.GetXaxis()
+    nbins=h.GetNbinsX()
+    return {'class'    : h.ClassName(),
+            'name'     : h.GetName(),
+            'title'    : h.GetTitle(),
+            'edges'    : [axis.GetBinLowEdge(xbin) for xbin in xrange(1,nbins+2)],
+            'labels'   : dict([(xbin,axis.GetBinLabel(xbin)) for xbin in xrange(1,nbins+1) if axis.GetBinLabel(xbin)]),
+            'axisTitles' : (axis.GetTitle(),h.GetYaxis().GetTitle()),
+            'contents' : [h.GetBinContent(xbin) for xbin in xrange(0,nbins+2)],
+            'errors'   : [h.GetBinError(xbin) for xbin in xrange(0,nbins+2)],
+            'entries'  : h.GetEntries(),
+            'line'     : (h.GetLineColor(),h.GetLineWidth(),h.GetLineStyle()),
+            'fill'     : (h.GetFillColor(),h.GetFillStyle()),
+            'marker'   : (h.GetMarkerColor(),h.GetMarkerStyle(),h.GetMarkerSize()),
+    }
+
+def buildHistoFromState(state):
+    """ inverse of getHistoState """
+    import array
+    edges=array.array('d',state['edges'])
+    h=getattr(ROOT,state['class'])(state['name'],state['title'],len(edges)-1,edges)
+    h.SetDirectory(0)
+    h.Sumw2()
+    for xbin,label in state['labels'].items(): h.GetXaxis().SetBinLabel(xbin,label)
+    h.GetXaxis().SetTitle(state['axisTitles'][0])
+    h.GetYaxis().SetTitle(state['axisTitles'][1])
+    for xbin in xrange(0,len(edges)+1):
+        h.SetBinContent(xbin,state['contents'][xbin])
+        h.SetBinError(xbin,state['errors'][xbin])
+    h.SetEntries(state['entries'])
+    h.SetLineColor(state['line'][0])
+    h.SetLineWidth(state['line'][1])
+    h.SetLineStyle(state['line'][2])
+    h.SetFillColor(state['fill'][0])
+    h.SetFillStyle(state['fill'][1])
+    h.SetMarkerColor(state['marker'][0])
+    h.SetMarkerStyle(state['marker'][1])
+    h.SetMarkerSize(state['marker'][2])
+    return h
 
 
 
@@ -56,6 +199,7 @@ class Plot(object):
         self.doPoissonErrorBars=True
         self.mc = OrderedDict()
         self.mcsyst = {}
+        self.mcsystMatrix = OrderedDict()
         self.totalMCUnc = None
         self.spimpose={}
         self.spimposeWithErrors=False
@@ -130,6 +274,11 @@ class Plot(object):
 
         h.SetTitle(title)
 
+        #systematic variations stored as the Y bins of a TH2
+        if isSyst and h.InheritsFrom('TH2'):
+            self.addSystMatrix(h,title,doDivideByBinWidth)
+            return
+
         #add overflows
         if not 'ratevsrun' in self.name:
             try:
@@ -205,17 +354,99 @@ class Plot(object):
                     self.mc[title]=h
                 self._garbageList.append(h)
 
+    def addSystMatrix(self, h, title, doDivideByBinWidth=False):
+
+        """
+        adds a set of systematic variations stored in a TH2 (one per Y bin, e.g. the generator weights)
+        the variations are kept as a (nsyst x nbins) matrix, empty variations are ignored
+        """
+
+        nx,ny=h.GetNbinsX(),h.GetNbinsY()
+        contents=getHistoContents(h)[0].reshape(ny+2,nx+2)[1:-1]
+        contents[np.isnan(contents)]=0.
+        used=(contents[:,1:-1].sum(axis=1)>0)
+        contents[~used]=0.
+
+        #add overflows
+        contents[:,1]  += contents[:,0]
+        contents[:,-2] += contents[:,-1]
+        contents[:,0], contents[:,-1] = 0., 0.
+        if doDivideByBinWidth:
+            contents[:,1:-1] /= getBinWidths(h)
+
+        if title in self.mcsystMatrix:
+            prevContents,prevUsed=self.mcsystMatrix[title]
+            if prevContents.shape!=contents.shape:
+                raise ValueError('%s: the systematic variations of %s have %d weights x %d bins in %s, expected %d x %d'
+                                 %(self.name,title,contents.shape[0],nx,h.GetName(),prevContents.shape[0],prevContents.shape[1]-2))
+            contents,used=prevContents+contents,prevUsed|used
+        self.mcsystMatrix[title]=(contents,used)
+
+    def getSystMatrix(self):
+
+        """returns the contents of all the systematic variations as a (nsyst x nbins) matrix"""
+
+        systs=[getHistoContents(self.mcsyst[title])[0] for title in self.mcsyst]
+        for contents,used in self.mcsystMatrix.values():
+            systs += list(contents[used])
+        return np.array(systs)
+
     def finalize(self):
         if self.doPoissonErrorBars:
             self.data = convertToPoissonErrorGr(self.dataH)
         else:
             self.data=ROOT.TGraphErrors(self.dataH)
 
+    def getState(self):
+
+        """
+        returns the plot as plain python objects (histogram contents and plot attributes) which can be pickled
+        external graphs (normUncGr, relShapeGr) are not included
+        """
+
+        state={'attrs':{}}
+        for key,val in self.__dict__.items():
+            if key in ['mc','mcsyst','spimpose','dataH','data','totalMCUnc','_garbageList','normUncGr','relShapeGr']: continue
+            state['attrs'][key]=val
+        state['mc']       = [(title,getHistoState(self.mc[title])) for title in self.mc]
+        state['mcsyst']   = [(title,getHistoState(self.mcsyst[title])) for title in self.mcsyst]
+        state['spimpose'] = [(title,getHistoState(self.spimpose[title])) for title in self.spimpose]
+        state['dataH']      = getHistoState(self.dataH)      if self.dataH      else None
+        state['totalMCUnc'] = getHistoState(self.totalMCUnc) if self.totalMCUnc else None
+        return state
+
+    @staticmethod
+    def fromState(state):
+
+        """builds a plot from the output of getState"""
+
+        plot=Plot(state['attrs']['name'])
+        plot.__dict__.update(state['attrs'])
+        for title,hstate in state['mc']:
+            plot.mc[title]=buildHistoFromState(hstate)
+        for title,hstate in state['mcsyst']:
+            plot.mcsyst[title]=buildHistoFromState(hstate)
+        for title,hstate in state['spimpose']:
+            plot.spimpose[title]=buildHistoFromState(hstate)
+        if state['dataH']:
+            plot.dataH=buildHistoFromState(state['dataH'])
+        if state['totalMCUnc']:
+            plot.totalMCUnc=buildHistoFromState(state['totalMCUnc'])
+        plot._garbageList += plot.mc.values()+plot.mcsyst.values()+plot.spimpose.values()+[x for x in [plot.dataH,plot.totalMCUnc] if x]
+        return plot
+
     def appendTo(self,outUrl):
         
         outF = ROOT.TFile.Open(outUrl,'UPDATE')
         if not outF:
             print "OutFile pointer is null!!"
+        self.writeTo(outF)
+        outF.Close()
+
+    def writeTo(self,outF):
+
+        """writes the histograms to a directory named after the plot in an open file"""
+
         if not outF.cd(self.name):
             outDir = outF.mkdir(self.name)
             outDir.cd()
@@ -229,7 +460,7 @@ class Plot(object):
             self.dataH.Write(self.dataH.GetName(), ROOT.TObject.kOverwrite)
         if self.data :
             self.data.Write(self.data.GetName(), ROOT.TObject.kOverwrite)
-        outF.Close()
+        ROOT.gROOT.cd()
 
     def reset(self):
         for o in self._garbageList:
@@ -353,51 +584,32 @@ class Plot(object):
                 nominalDistForSysts.SetDirectory(0)
 
         #systematics
-        if (totalMC and nominalDistForSysts and len(self.mcsyst)>0):
+        systs=self.getSystMatrix()
+        hasSyst=(len(systs)>0)
+        if (totalMC and nominalDistForSysts and hasSyst):
             # complete
-            systUp=[0.]
-            systDown=[0.]
-            for xbin in xrange(1,nominalDistForSysts.GetNbinsX()+1):
-                systUp.append(0.)
-                systDown.append(0.)
-                for hname in self.mcsyst:
-                    diff = self.mcsyst[hname].GetBinContent(xbin) - nominalDistForSysts.GetBinContent(xbin)
-                    if (diff > 0):
-                        systUp[xbin] = math.sqrt(systUp[xbin]**2 + diff**2)
-                    else:
-                        systDown[xbin] = math.sqrt(systDown[xbin]**2 + diff**2)
+            nominal=getHistoContents(nominalDistForSysts)[0]
+            systUp,systDown,systUpShape,systDownShape=getSystUncertainties(nominal,systs)
             totalMCUnc = totalMC.Clone('totalmcunc')
             self._garbageList.append(totalMCUnc)
             totalMCUnc.SetDirectory(0)
             totalMCUnc.SetFillColor(1) #ROOT.TColor.GetColor('#99d8c9'))
             ROOT.gStyle.SetHatchesLineWidth(1)
             totalMCUnc.SetFillStyle(3344) #3254)
-            for xbin in xrange(1,nominalDistForSysts.GetNbinsX()+1):
-                totalMCUnc.SetBinContent(xbin, totalMCUnc.GetBinContent(xbin) + (systUp[xbin]-systDown[xbin])/2.)
-                totalMCUnc.SetBinError(xbin, math.sqrt(totalMCUnc.GetBinError(xbin)**2 + ((systUp[xbin]+systDown[xbin])/2.)**2))
+            contents,sumw2=getHistoContents(totalMCUnc)
+            contents[1:-1] += ((systUp-systDown)/2.)[1:-1]
+            sumw2[1:-1]    += (((systUp+systDown)/2.)**2)[1:-1]
+            setHistoContents(totalMCUnc,contents,sumw2)
             # shape
-            nominalIntegral = nominalDistForSysts.Integral()
-            for hname,h in self.mcsyst.iteritems():
-                if (h.Integral()>0.): h.Scale(nominalIntegral/h.Integral())
-            systUpShape=[0.]
-            systDownShape=[0.]
-            for xbin in xrange(1,nominalDistForSysts.GetNbinsX()+1):
-                systUpShape.append(0.)
-                systDownShape.append(0.)
-                for hname in self.mcsyst:
-                    diff = self.mcsyst[hname].GetBinContent(xbin) - nominalDistForSysts.GetBinContent(xbin)
-                    if (diff > 0):
-                        systUpShape[xbin] = math.sqrt(systUpShape[xbin]**2 + diff**2)
-                    else:
-                        systDownShape[xbin] = math.sqrt(systDownShape[xbin]**2 + diff**2)
             totalMCUncShape = totalMC.Clone('totalmcuncshape')
             self._garbageList.append(totalMCUncShape)
             totalMCUncShape.SetDirectory(0)
             totalMCUncShape.SetFillColor(ROOT.TColor.GetColor('#d73027'))
             totalMCUncShape.SetFillStyle(3254)
-            for xbin in xrange(1,nominalDistForSysts.GetNbinsX()+1):
-                totalMCUncShape.SetBinContent(xbin, totalMCUncShape.GetBinContent(xbin) + (systUpShape[xbin]-systDownShape[xbin])/2.)
-                totalMCUncShape.SetBinError(xbin, math.sqrt(totalMCUncShape.GetBinError(xbin)**2 + ((systUpShape[xbin]+systDownShape[xbin])/2.)**2))
+            contents,sumw2=getHistoContents(totalMCUncShape)
+            contents[1:-1] += ((systUpShape-systDownShape)/2.)[1:-1]
+            sumw2[1:-1]    += (((systUpShape+systDownShape)/2.)**2)[1:-1]
+            setHistoContents(totalMCUncShape,contents,sumw2)
             self.totalMCUnc = totalMCUnc
 
         #test for null plots
@@ -471,7 +683,7 @@ class Plot(object):
             if noStack: stack.Draw('nostack same')
             else:
                 stack.Draw('hist same')
-                if (len(self.mcsyst)>0):
+                if hasSyst:
                     totalMCUnc.Draw('e2 same')
                     totalMCUncShape.Draw('e2 same')
                 elif self.normUncGr:
@@ -617,7 +829,7 @@ class Plot(object):
             else:
                 if self.relShapeGr:
                     self.relShapeGr.Draw('20')
-                elif (len(self.mcsyst)>0):
+                elif hasSyst:
                     ratioframeshape=ratioframe.Clone('ratioframeshape')
                     self._garbageList.append(ratioframeshape)
                     ratioframeshape.SetFillColor(ROOT.TColor.GetColor('#d73027'))            
@@ -625,22 +837,27 @@ class Plot(object):
 
                 totalMCnoUnc=totalMC.Clone('totalMCnounc')
                 self._garbageList.append(totalMCnoUnc)
-                for xbin in xrange(1,totalMC.GetNbinsX()+1):
-                    ratioframe.SetBinContent(xbin,1)
-                    val=totalMC.GetBinContent(xbin)
-                    totalMCnoUnc.SetBinError(xbin,0.)
-                    if val==0 : continue
-                    if (len(self.mcsyst)>0):
-                        totalUnc=ROOT.TMath.Sqrt((totalMCUnc.GetBinError(xbin)/val)**2+self.mcUnc**2)
-                        totalUncShape=ROOT.TMath.Sqrt((totalMCUncShape.GetBinError(xbin)/val)**2+self.mcUnc**2)
-                        ratioframeshape.SetBinContent(xbin,totalMCUncShape.GetBinContent(xbin)/val)
-                        ratioframeshape.SetBinError(xbin,totalUncShape)
-                    else: totalUnc=ROOT.TMath.Sqrt((totalMC.GetBinError(xbin)/val)**2+self.mcUnc**2)
-                    ratioframe.SetBinContent(xbin,totalMCnoUnc.GetBinContent(xbin)/val)
-                    ratioframe.SetBinError(xbin,totalUnc)
+                val,totalUnc2=getHistoContents(totalMC)
+                nonZero=(val!=0)
+                nonZero[0]=nonZero[-1]=False
+                if hasSyst:
+                    totalUnc2=getHistoContents(totalMCUnc)[1]
+                    shape,shapeUnc2=getHistoContents(totalMCUncShape)
+                    rshape,rshapeUnc2=getHistoContents(ratioframeshape)
+                    rshape[nonZero]=shape[nonZero]/val[nonZero]
+                    rshapeUnc2[nonZero]=shapeUnc2[nonZero]/val[nonZero]**2+self.mcUnc**2
+                    setHistoContents(ratioframeshape,rshape,rshapeUnc2)
+                noUnc,noUnc2=getHistoContents(totalMCnoUnc)
+                noUnc2[1:-1]=0.
+                setHistoContents(totalMCnoUnc,noUnc,noUnc2)
+                ratio,ratioUnc2=getHistoContents(ratioframe)
+                ratio[1:-1]=1.
+                ratio[nonZero]=noUnc[nonZero]/val[nonZero]
+                ratioUnc2[nonZero]=totalUnc2[nonZero]/val[nonZero]**2+self.mcUnc**2
+                setHistoContents(ratioframe,ratio,ratioUnc2)
                 ratioframe.Draw('e2')
 
-                if (len(self.mcsyst)>0): 
+                if hasSyst: 
                     ratioframeshape.Draw('e2 same')
                 try:
                     ratio=self.dataH.Clone('ratio')
@@ -711,9 +928,10 @@ class Plot(object):
             h = self.mc[pname]
             f.write(pname.ljust(20),)
 
+            contents,sumw2=[x.tolist() for x in getHistoContents(h)]
             for xbin in xrange(1,h.GetXaxis().GetNbins()+1):
-                itot=h.GetBinContent(xbin)
-                ierr=h.GetBinError(xbin)
+                itot=contents[xbin]
+                ierr=math.sqrt(sumw2[xbin])
                 pval=' & %s'%toLatexRounded(itot,ierr)
                 f.write(pval.ljust(40),)
                 tot[xbin] = tot[xbin]+itot
@@ -730,8 +948,9 @@ class Plot(object):
         if self.dataH :
             f.write('------------------------------------------\n')
             f.write('Data'.ljust(20),)
+            contents=getHistoContents(self.dataH)[0].tolist()
             for xbin in xrange(1,self.dataH.GetXaxis().GetNbins()+1):
-                itot=self.dataH.GetBinContent(xbin)
+                itot=contents[xbin]
                 pval=' & %d'%itot
                 f.write(pval.ljust(40))
             f.write('\n')
@@ -741,9 +960,10 @@ class Plot(object):
             h = self.spimpose[pname]
             f.write(pname.ljust(20),)
 
+            contents,sumw2=[x.tolist() for x in getHistoContents(h)]
             for xbin in xrange(1,h.GetXaxis().GetNbins()+1):
-                itot=h.GetBinContent(xbin)
-                ierr=h.GetBinError(xbin)
+                itot=contents[xbin]
+                ierr=math.sqrt(sumw2[xbin])
                 pval=' & %s'%toLatexRounded(itot,ierr)
                 f.write(pval.ljust(40),)
                 tot[xbin] = tot[xbin]+itot
@@ -756,6 +976,50 @@ class Plot(object):
 
 
 
+"""
+Keeps the summary ROOT file(s) open while the plots are written
+(appendTo re-opens the file for every plot)
+"""
+class PlotWriter(object):
+
+    def __init__(self,outUrl,groupBy=None,mode='UPDATE'):
+
+        """if groupBy is given, the plots are written to one file per group, named after outUrl and groupBy(plot name)"""
+
+        self.outUrl=outUrl
+        self.groupBy=groupBy
+        self.mode=mode
+        self.files=OrderedDict()
+
+    def getFileName(self,group=None):
+        if group is None: return self.outUrl
+        base,ext=os.path.splitext(self.outUrl)
+        return '%s_%s%s'%(base,group,ext)
+
+    def getFile(self,group=None):
+        if not group in self.files:
+            url=self.getFileName(group)
+            outF=ROOT.TFile.Open(url,self.mode)
+            if not outF or outF.IsZombie():
+                raise IOError('Unable to open %s'%url)
+            self.files[group]=outF
+        return self.files[group]
+
+    def write(self,plot):
+        group=self.groupBy(plot.name) if self.groupBy else None
+        plot.writeTo(self.getFile(group))
+
+    def writeAll(self,plots):
+        for p in plots:
+            self.write(p)
+
+    def close(self):
+        for group in self.files:
+            self.files[group].Close()
+        self.files=OrderedDict()
+
+
+
 """
 converts a histogram to a graph with Poisson error bars
 """
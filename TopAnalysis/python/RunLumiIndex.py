@@ -0,0 +1,112 @@
+import os
+import json
+import bisect
+import numpy as np
+
+class RunLumiIndex:
+
+    """
+    run/lumi sections listed in a json file as {"run" : [[first,last],...]} (e.g. the golden json)
+    the (run,lumi) pairs are encoded as run<<32|lumi and the ranges are stored as sorted and merged intervals,
+    so that a lookup is a binary search for single events or a searchsorted for arrays of events
+    """
+
+    def __init__(self,runLumi={}):
+
+        """runLumi is a dict run : [[first lumi, last lumi],...]"""
+
+        intervals=sorted([ (self.getKey(run,lran[0]),self.getKey(run,lran[1]))
+                           for run in runLumi for lran in runLumi[run] ])
+
+        #merge overlapping or contiguous ranges
+        merged=[]
+        for start,end in intervals:
+            if len(merged) and start<=merged[-1][1]+1:
+                merged[-1][1]=max(merged[-1][1],end)
+            else:
+                merged.append([start,end])
+
+        self.starts=np.array([x[0] for x in merged],dtype=np.int64)
+        self.ends=np.array([x[1] for x in merged],dtype=np.int64)
+        self.startList=self.starts.tolist()
+        self.runs=set([int(run) for run in runLumi])
+
+    @staticmethod
+    def getKey(run,lumi):
+        return (int(run)<<32)|int(lumi)
+
+    def __len__(self):
+        return len(self.startList)
+
+    def __contains__(self,runLumi):
+        return self.contains(*runLumi)
+
+    def hasRun(self,run):
+        return int(run) in self.runs
+
+    def contains(self,run,lumi):
+
+        """checks if a single run/lumi section is in the list"""
+
+        key=self.getKey(run,lumi)
+        i=bisect.bisect_right(self.startList,key)-1
+        return i>=0 and key<=self.ends[i]
+
+    def mask(self,runs,lumis):
+
+        """returns a boolean array flagging the run/lumi sections which are in the list"""
+
+        keys=(np.asarray(runs).astype(np.int64)<<32)|np.asarray(lumis).astype(np.int64)
+        idx=np.searchsorted(self.starts,keys,side='right')-1
+        inList=(idx>=0)
+        inList[inList]=(keys[inList]<=self.ends[idx[inList]])
+        return inList
+
+    def save(self,url,tag=''):
+
+        """stores the index in a numpy file"""
+
+        with open(url,'wb') as cache:
+            np.savez(cache,starts=self.starts,ends=self.ends,runs=np.array(sorted(self.runs),dtype=np.int64),tag=np.array(tag))
+
+    @staticmethod
+    def load(url,tag=None):
+
+        """reads an index stored with save, returns None if the tag doesn't match"""
+
+        data=np.load(url)
+        if tag is not None and str(data['tag'])!=tag: return None
+        index=RunLumiIndex()
+        index.starts=data['starts']
+        index.ends=data['ends']
+        index.startList=index.starts.tolist()
+        index.runs=set(data['runs'].tolist())
+        return index
+
+
+def getRunLumiIndex(url,cacheUrl=None):
+
+    """
+    builds the index from a json file with run/lumi sections
+    if cacheUrl is given the index is stored there and re-used while the json file is unchanged
+    """
+
+    tag='%s:%d:%d'%(os.path.abspath(url),os.path.getmtime(url),os.path.getsize(url))
+    if cacheUrl and os.path.isfile(cacheUrl):
+        try:
+            index=RunLumiIndex.load(cacheUrl,tag)
+            if index is not None: return index
+        except (IOError,ValueError,KeyError):
+            pass
+
+    with open(url,'r') as cachefile:
+        runLumi=json.load(cachefile)
+    index=RunLumiIndex(runLumi)
+
+    if cacheUrl:
+        try:
+            index.save(cacheUrl,tag)
+        except (IOError,OSError):
+            print 'Unable to write run/lumi index cache to',cacheUrl
+
+    return index
@@ -1,3 +1,5 @@
+import os
+import sys
 import commands
 from time import sleep
 
@@ -18,3 +20,76 @@ def babySitBatchJobs(jobNumbers,waitTime=10):
         else:
             print 'Querying batch in %ds (%d jobs missing)'%(waitTime,nJobsPending)
             sleep(waitTime)
+
+"""
+chains a list of commands in a single shell command: all the commands are run even if one of them fails and the exit code
+is non-zero if any failed; each command which succeeds creates its marker file and is not run again when the task is retried
+"""
+def getSequentialCommand(cmds,markers):
+    chain=['rc=0']
+    for cmd,marker in zip(cmds,markers):
+        chain.append('if [ ! -e {1} ]; then ({0}) && touch {1} || rc=1; fi'.format(cmd,marker))
+    chain.append('exit $rc')
+    return '; '.join(chain)
+
+"""
+runs a list of (name,cmd,cost) tasks in local subprocesses, keeping njobs of them running at any time
+tasks are started by decreasing cost (e.g. the size of the input) so that the longest ones don't end up running alone at the end,
+the output of each task is written to logDir/name.log and failed tasks (non-zero exit code) are retried up to maxRetries times
+returns a dict name : exit code for the tasks which failed in all the attempts
+if timings is a dict it is filled with the running time (in seconds) of the tasks which succeeded
+"""
+def runLocalTasks(tasks,njobs,logDir,maxRetries=1,pollTime=1,timings=None):
+
+    import subprocess
+    import time
+
+    os.system('mkdir -p %s'%logDir)
+    pending=[(cost,name,cmd,0) for name,cmd,cost in sorted(tasks,key=lambda x:-x[2])]
+    totalCost=float(sum([x[0] for x in pending])) or 1.
+    doneCost=0.
+    running={}
+    failed={}
+    nDone=0
+    startTime=time.time()
+    while len(pending)>0 or len(running)>0:
+
+        #start new tasks
+        while len(pending)>0 and len(running)<max(njobs,1):
+            cost,name,cmd,attempt=pending.pop(0)
+            log=open(os.path.join(logDir,'%s.log'%name),'a' if attempt>0 else 'w')
+            log.write('#attempt %d: %s\n'%(attempt+1,cmd))
+            log.flush()
+            p=subprocess.Popen(cmd,shell=True,stdout=log,stderr=subprocess.STDOUT)
+            running[p]=(cost,name,cmd,attempt,log,time.time())
+
+        time.sleep(pollTime)
+
+        #check finished tasks
+        for p in running.keys():
+            code=p.poll()
+            if code is None: continue
+            cost,name,cmd,attempt,log,taskStart=running.pop(p)
+            log.write('#exit code %d\n'%code)
+            log.close()
+            if code!=0 and attempt<maxRetries:
+                pending.insert(0,(cost,name,cmd,attempt+1))
+                continue
+            if code!=0: failed[name]=code
+            elif timings is not None: timings[name]=time.time()-taskStart
+            nDone+=1
+            doneCost+=cost
+
+        #progress
+        elapsed=time.time()-startTime
+        eta=elapsed*(totalCost-doneCost)/doneCost if doneCost>0 else 0.
+        sys.stdout.write('\r[ %d/%d ] done, %d running, %d failed, elapsed %dm%02ds, ETA %dm%02ds '
+                         %(nDone,len(tasks),len(running),len(failed),elapsed/60,elapsed%60,eta/60,eta%60))
+        sys.stdout.flush()
+
+    print ''
+    if len(failed)>0:
+        print '%d tasks failed, check the logs in %s'%(len(failed),logDir)
+        for name in sorted(failed):
+            print '\t %s exit code %d'%(name,failed[name])
+    return failed
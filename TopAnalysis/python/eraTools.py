@@ -0,0 +1,69 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+#node-local shared memory is preferred to stage the corrections, as it is shared by all the jobs running on the node
+DEFAULTERACACHE='/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+#files which are not read by analysisWrapper (conditions databases and sample lists)
+SKIPEXTENSIONS=['.db','.json']
+
+"""
+lists the correction files of an era directory which are read by the analysis
+"""
+def getEraFiles(era):
+    return sorted([f for f in os.listdir(era)
+                   if not f.startswith('.')
+                   and os.path.isfile(os.path.join(era,f))
+                   and not os.path.splitext(f)[1] in SKIPEXTENSIONS])
+
+"""
+checksum of the contents of the correction files of an era directory
+"""
+def getEraChecksum(era,files=None):
+    if files is None: files=getEraFiles(era)
+    md5=hashlib.md5()
+    for f in files:
+        md5.update(f)
+        with open(os.path.join(era,f),'rb') as fIn:
+            for block in iter(lambda : fIn.read(1<<20), b''):
+                md5.update(block)
+    return md5.hexdigest()
+
+"""
+copies the correction files of an era to a read-only directory in cacheDir keyed by the era name and the checksum
+of the files, so that all the jobs of a node read them from memory instead of the shared area;
+the directory is re-used while the files are unchanged and the copies of previous versions are removed, returns its path
+"""
+def stageEra(era,cacheDir=DEFAULTERACACHE):
+    era=os.path.abspath(era).rstrip('/')
+    files=getEraFiles(era)
+    staged=os.path.join(cacheDir,'%s_%s'%(os.path.basename(era),getEraChecksum(era,files)[0:12]))
+    if os.path.isdir(staged): return staged
+
+    #copy to a temporary directory first, so that concurrent calls never see a partial copy
+    tmpDir=tempfile.mkdtemp(dir=cacheDir,prefix='.'+os.path.basename(era))
+    try:
+        for f in files:
+            shutil.copy2(os.path.join(era,f),tmpDir)
+            os.chmod(os.path.join(tmpDir,f),0444)
+        os.chmod(tmpDir,0555)
+        os.rename(tmpDir,staged)
+    except OSError:
+        if os.path.isdir(tmpDir): os.chmod(tmpDir,0755)
+        shutil.rmtree(tmpDir,ignore_errors=True)
+        if not os.path.isdir(staged): raise
+        return staged
+
+    #the copies of previous versions of the corrections are no longer needed
+    prefix=os.path.basename(era)+'_'
+    for d in os.listdir(cacheDir):
+        old=os.path.join(cacheDir,d)
+        if not d.startswith(prefix) or len(d)!=len(prefix)+12 or old==staged or not os.path.isdir(old): continue
+        try:
+            os.chmod(old,0755)
+            shutil.rmtree(old)
+        except OSError:
+            pass
+    return staged
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import ROOT
+import numpy as np
 
 class EventShapeTool:
 
@@ -40,6 +41,11 @@ class EventShapeTool:
                 self.momentumTensor[i][j]=(1./norm)*self.momentumTensor[i][j]
 
     def computeEventShapes(self):
+        #events without a valid momentum tensor (less than 2 particles) have null event shapes
+        self.sphericity=0
+        self.aplanarity=0
+        self.C=0
+        self.D=0
         if not self.momentumTensor.IsSymmetric() : return
         if self.momentumTensor.NonZeros()==0: return
         self.momentumTensor.EigenVectors(self.eigenValues)
@@ -49,3 +55,49 @@ class EventShapeTool:
         self.aplanarity=1.5*lambdas[2]
         self.C=3.*(lambdas[0]*lambdas[1] + lambdas[0]*lambdas[2] + lambdas[1]*lambdas[2])
         self.D=27.*lambdas[0]*lambdas[1]*lambdas[2]
+
+    def analyseEvents(self,p3,offsets,r=2):
+
+        """
+        computes the event shapes for a batch of events given as a jagged array:
+        p3 is the flat (n,3) array with the momenta of the particles of all the events and
+        offsets the (nevents+1) array with the index of the first particle of each event (and the total number of particles at the end)
+        returns the arrays of sphericity, aplanarity, C and D
+        """
+
+        return self.computeEventShapesArrays( self.computeMomentumTensorArrays(p3,offsets,r) )
+
+    def computeMomentumTensorArrays(self,p3,offsets,r=2):
+
+        """returns the (nevents,3,3) momentum tensors, null for the events with less than 2 particles"""
+
+        p3=np.asarray(p3,dtype=np.float64).reshape(-1,3)
+        offsets=np.asarray(offsets,dtype=np.int64)
+        nevents=len(offsets)-1
+        tensors=np.zeros((nevents,3,3))
+        if len(p3)==0 or nevents<=0: return tensors
+
+        pR=np.power(np.sqrt((p3**2).sum(axis=1)),r)
+        pRminus2=np.power(pR,0.5*r-1)
+        prods=pRminus2[:,None,None]*p3[:,:,None]*p3[:,None,:]
+
+        #sum per event: a null particle is appended so that the offsets of the empty events at the end are valid
+        #(reduceat returns a single element for empty events, which are masked anyway)
+        starts=offsets[:-1]
+        sel=(np.diff(offsets)>=2)
+        norm=np.add.reduceat(np.append(pR,0.),starts)
+        sel &= (norm>0)
+        sums=np.add.reduceat(np.concatenate([prods,np.zeros((1,3,3))]),starts,axis=0)
+        tensors[sel]=sums[sel]/norm[sel,None,None]
+        return tensors
+
+    def computeEventShapesArrays(self,tensors):
+
+        """returns the arrays of sphericity, aplanarity, C and D for a set of momentum tensors"""
+
+        lambdas=np.linalg.eigvalsh(tensors)[:,::-1]
+        sphericity=1.5*(lambdas[:,1]+lambdas[:,2])
+        aplanarity=1.5*lambdas[:,2]
+        C=3.*(lambdas[:,0]*lambdas[:,1] + lambdas[:,0]*lambdas[:,2] + lambdas[:,1]*lambdas[:,2])
+        D=27.*lambdas[:,0]*lambdas[:,1]*lambdas[:,2]
+        return sphericity,aplanarity,C,D
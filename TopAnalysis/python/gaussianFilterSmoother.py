@@ -14,77 +14,109 @@ class GFSmoother():
     def generateToys(self,h,ntoys):
 
         """generates n toys taking into account stat unc in bins"""
-        
-        x=[]
-        
-        for i in range(ntoys):
-            ix=[]
-
-            #loop over the histogram bins
-            for xbin in range(h.GetNbinsX()):
-                val=h.GetBinContent(xbin+1)
-                unc=h.GetBinError(xbin+1)
-
-                #sample the mean taking into account stat fluctuation
-                mean=np.random.normal(val,unc)
-
-                #sample this bin
-                rand_val=np.random.normal(mean,unc)
-                ix.append(rand_val)
-            x.append(ix)
-
-        return np.array(x)
+
+        val,unc=getHistoArrays(h)
+        return generateToyArrays(val,unc,ntoys)
     
     def smoothToys(self,x,sigma,truncate,fromCDF):
 
-        """ loops over toys and applies a gaussian filter smooth
+        """ applies a gaussian filter smooth to all the toys at once
             if fromCDF is true, the smoothing is applied on the normalized cumulative
             distribution function """
 
-        nbins=len(x[0])
+        return smoothToyArrays(x,sigma,truncate,fromCDF)
 
-        #transform to normalized CDF if needed (prepend 0, force 1 at the edge)
-        rawx = x
-        if fromCDF: 
-            rawx = x.cumsum(axis=1) / x.sum(axis=1)[:,None]
-            rawx[:,nbins-1] =  1.
-            rawx=np.c_[np.zeros(len(rawx)),rawx]
+    def profiledSmoothedToys(self,h,fromCDF):
+        """ gets a copy of the original histogram where the bins filled with the median obtained
+            with the results of smoothing the toys and the uncertainties correspond to the the 68% quantiles """
 
-        #apply smoothing
-        ntoys = len(rawx)
-        y = np.array( [gaussian_filter1d(rawx[i], sigma=sigma, truncate=truncate,mode='nearest') for i in range(ntoys) ] )
+        yq=np.percentile(toPDF(self.y,fromCDF),[16,50,84],axis=0)
+        fillSmoothed(h,yq)
+        return h
 
-        #force the first and last bins of the CDF smoothing
-        if fromCDF : y[:,0],y[:,-1]=0.,1.
 
-        return y
+def getHistoArrays(h):
 
-    def profiledSmoothedToys(self,h,fromCDF):
-        """ gets a copy of the original histogram where the bins filled with the median obtained
-            with the results of smoothing the toys and the uncertainties correspond to the the 68% quantiles """
+    """returns the contents and uncertainties of the bins of a histogram (excluding under/overflows)"""
 
-        nbins=h.GetNbinsX()
-        norm=h.Integral()
-        
-        #transform back to PDF if needed (ignore extra aux. bin to set CDF=0)
-        smoothedy=self.y
-        if fromCDF:
-            smoothedy=[]
-            ntoys=len(self.y)
-            for i in range(ntoys):
-                iy = [ self.y[i][j]-self.y[i][j-1] for j in xrange(1,nbins+1) ]
-                smoothedy.append(iy)
-            smoothedy=np.array(smoothedy)
-
-        #replace contents of the original histogram
-        h.Reset('ICE')
-        yq=np.percentile(smoothedy,[16,50,84],axis=0)
-        for xbin in range(nbins):
-            h.SetBinContent(xbin+1, yq[1][xbin])
-            h.SetBinError(xbin+1, 0.5*(yq[2][xbin]-yq[0][xbin]))
-        h.Scale(norm/h.Integral())
+    nbins=h.GetNbinsX()
+    val=np.array([h.GetBinContent(xbin+1) for xbin in range(nbins)])
+    unc=np.array([h.GetBinError(xbin+1) for xbin in range(nbins)])
+    return val,unc
 
-        return h
+def generateToyArrays(val,unc,ntoys):
+
+    """
+    generates toys for the bin contents, shape (...,ntoys,nbins) for val/unc with shape (...,nbins):
+    the mean of each bin is sampled taking into account the stat fluctuation and then the bin itself is sampled,
+    which amounts to a single gaussian with a width sqrt(2) times the stat uncertainty
+    """
+
+    val=np.asarray(val,dtype=np.float64)[...,None,:]
+    unc=np.asarray(unc,dtype=np.float64)[...,None,:]
+    shape=val.shape[:-2]+(ntoys,val.shape[-1])
+    return np.random.normal(val,np.sqrt(2.)*unc,size=shape)
+
+def smoothToyArrays(x,sigma,truncate,fromCDF):
+
+    """applies the gaussian filter along the bins (last axis) of the toys, on the normalized CDF if fromCDF is true"""
+
+    #transform to normalized CDF if needed (prepend 0, force 1 at the edge)
+    rawx = x
+    if fromCDF:
+        rawx = x.cumsum(axis=-1) / x.sum(axis=-1)[...,None]
+        rawx[...,-1] = 1.
+        rawx = np.concatenate([np.zeros(rawx.shape[:-1]+(1,)),rawx],axis=-1)
+
+    #apply smoothing
+    y = gaussian_filter1d(rawx, sigma=sigma, truncate=truncate, mode='nearest', axis=-1)
+
+    #force the first and last bins of the CDF smoothing
+    if fromCDF : y[...,0],y[...,-1]=0.,1.
+
+    return y
+
+def toPDF(y,fromCDF):
+
+    """transforms back the smoothed toys to a PDF if needed (the extra aux. bin set to CDF=0 is dropped)"""
+
+    return np.diff(y,axis=-1) if fromCDF else y
+
+def fillSmoothed(h,yq):
+
+    """replaces the contents of the histogram by the median and the uncertainties by the 68% quantiles (keeping the normalization)"""
+
+    norm=h.Integral()
+    h.Reset('ICE')
+    for xbin in range(h.GetNbinsX()):
+        h.SetBinContent(xbin+1, yq[1][xbin])
+        h.SetBinError(xbin+1, 0.5*(yq[2][xbin]-yq[0][xbin]))
+    h.Scale(norm/h.Integral())
+    return h
+
+def smoothHistograms(histos,ntoys=100,sigma=2,truncate=4,fromCDF=True,maxSize=5000000):
+
+    """
+    smooths a list of histograms in place with the same method as GFSmoother: the toys of all the histograms
+    with the same number of bins are generated and smoothed at once in an array of shape (nhistos,ntoys,nbins),
+    in blocks of histograms such that the array has at most maxSize elements
+    """
+
+    byNbins={}
+    for h in histos:
+        byNbins.setdefault(h.GetNbinsX(),[]).append(h)
+
+    for nbins,hlist in byNbins.items():
+        block=max(1,maxSize/(ntoys*(nbins+1)))
+        for i in xrange(0,len(hlist),block):
+            arrays=[getHistoArrays(h) for h in hlist[i:i+block]]
+            x=generateToyArrays(np.array([val for val,_ in arrays]),np.array([unc for _,unc in arrays]),ntoys)
+            y=toPDF(smoothToyArrays(x,sigma,truncate,fromCDF),fromCDF)
+            yq=np.percentile(y,[16,50,84],axis=1)
+            for j,h in enumerate(hlist[i:i+block]):
+                fillSmoothed(h,yq[:,j])
+
+    return histos
 
 def testGFSmoother():
 
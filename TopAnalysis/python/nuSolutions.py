@@ -260,3 +260,272 @@ class doubleNeutrinoSolutions(object):
                  for ss in self.solutionSets]
         return [(K.dot(s), K_.dot(s_))
                 for s, s_ in zip(self.perp, self.perp_)]
+
+
+#
+# event-batched versions: arrays of N events, 4-vectors are given as (N,4) arrays of (px,py,pz,E)
+# and the results are stacked arrays with a mask flagging the valid solutions
+#
+
+def R_batch(axis, angles):
+    '''Rotation matrices about x(0),y(1), or z(2) axis for an array of angles'''
+    c, s = np.cos(angles), np.sin(angles)
+    R = c[:,None,None] * np.eye(3)
+    R[:, axis, axis] = 1
+    R[:, (axis+1) % 3, (axis-1) % 3] = -s
+    R[:, (axis-1) % 3, (axis+1) % 3] = s
+    return R
+
+
+def dot_batch(*mats):
+    '''Product of stacked matrices (and/or vectors as last argument)'''
+    res = mats[-1]
+    for A in reversed(mats[:-1]):
+        res = np.einsum('nij,nj...->ni...', A, res)
+    return res
+
+
+def cofactor_batch(A, (i, j)):
+    '''Cofactor[i,j] of stacked 3x3 matrices A'''
+    rows = [k for k in range(3) if k != i]
+    cols = [k for k in range(3) if k != j]
+    a = A[:, rows][:, :, cols]
+    return (-1)**(i+j) * (a[:,0,0]*a[:,1,1] - a[:,1,0]*a[:,0,1])
+
+
+def safe_inv_batch(A):
+    '''Inverse of stacked matrices, the singular or non-finite ones are flagged and replaced by the identity'''
+    ok = np.isfinite(A).all(axis=(1,2))
+    det = np.zeros(len(A))
+    det[ok] = np.linalg.det(A[ok])
+    ok &= (det != 0) & np.isfinite(det)
+    Ainv = np.tile(np.eye(A.shape[1]), (len(A),1,1))
+    if ok.any(): Ainv[ok] = np.linalg.inv(A[ok])
+    return Ainv, ok
+
+
+def factor_degenerate_batch(G, zero=0):
+    '''Linear factors of degenerate quadratic polynomials: (N,2,3) lines and (N,2) mask'''
+    n = len(G)
+    lines = np.zeros((n,2,3))
+    lines[:,:,2] = 1
+    valid = np.zeros((n,2), dtype=bool)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        degen = (G[:,0,0] == 0) & (G[:,1,1] == 0)
+        lines[degen,0] = np.stack([G[degen,0,1], np.zeros(degen.sum()), G[degen,1,2]], axis=1)
+        lines[degen,1] = np.stack([np.zeros(degen.sum()), G[degen,0,1], G[degen,0,2] - G[degen,1,2]], axis=1)
+        valid[degen] = True
+
+        swapXY = np.abs(G[:,0,0]) > np.abs(G[:,1,1])
+        Q = G.copy()
+        Q[swapXY] = G[swapXY][:,(1,0,2)][:,:,(1,0,2)]
+        Q /= np.where(degen, 1., Q[:,1,1])[:,None,None]
+        q22 = cofactor_batch(Q, (2,2))
+
+        #lines [Q01, Q11, Q12+s] for s in multisqrt(-cofactor(Q,(0,0)))
+        y = -cofactor_batch(Q, (0,0))
+        r = np.sqrt(np.maximum(y, 0))
+        caseA = ~degen & (-q22 <= zero)
+        for k, sgn in enumerate([-1, 1]):
+            sel = caseA & ((y > 0) if k else (y >= 0))
+            lines[sel,k] = np.stack([Q[sel,0,1], Q[sel,1,1], Q[sel,1,2] + sgn*r[sel]], axis=1)
+            valid[sel,k] = True
+
+        #lines [m, Q11, -Q11*y0 - m*x0] for m in [Q01 + s for s in multisqrt(-q22)]
+        caseB = ~degen & ~(-q22 <= zero)
+        x0 = cofactor_batch(Q, (0,2)) / q22
+        y0 = cofactor_batch(Q, (1,2)) / q22
+        r = np.sqrt(np.maximum(-q22, 0))
+        for k, sgn in enumerate([-1, 1]):
+            sel = caseB & ((-q22 > 0) if k else (-q22 >= 0))
+            m = Q[sel,0,1] + sgn*r[sel]
+            lines[sel,k] = np.stack([m, Q[sel,1,1], -Q[sel,1,1]*y0[sel] - m*x0[sel]], axis=1)
+            valid[sel,k] = True
+
+    #swap back x,y
+    toSwap = ~degen & swapXY
+    lines[toSwap] = lines[toSwap][:,:,(1,0,2)]
+
+    valid &= np.isfinite(lines).all(axis=2)
+    lines[~valid] = [0, 0, 1]
+    return lines, valid
+
+
+def intersections_ellipse_line_batch(ellipse, line, zero=1e-12):
+    '''Points of intersection between ellipses and lines: (N,2,3) points and (N,2) mask'''
+    _,V = np.linalg.eig(np.transpose(np.cross(line[:,None,:], ellipse), (0,2,1)))
+    V = V.real
+    k = (np.einsum('ni,nij->nj', line, V)**2 +
+         np.einsum('nij,nik,nkj->nj', V, ellipse, V)**2)
+    order = np.argsort(k, axis=1, kind='mergesort')[:,:2]
+    idx = np.arange(len(line))[:,None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        points = np.transpose(V / V[:,2:3,:], (0,2,1))[idx, order]
+    return points, k[idx, order] < zero
+
+
+def intersections_ellipses_batch(A, B, valid=None):
+    '''Points of intersection between two ellipses: (N,4,3) points and (N,4) mask'''
+    n = len(A)
+    valid = np.ones(n, dtype=bool) if valid is None else valid.copy()
+    valid &= np.isfinite(A).all(axis=(1,2)) & np.isfinite(B).all(axis=(1,2))
+    A = np.where(valid[:,None,None], A, np.eye(3))
+    B = np.where(valid[:,None,None], B, np.eye(3))
+
+    swap = np.abs(np.linalg.det(B)) > np.abs(np.linalg.det(A))
+    A, B = np.where(swap[:,None,None], B, A), np.where(swap[:,None,None], A, B)
+    Ainv, ok = safe_inv_batch(A)
+    valid &= ok
+
+    #first real eigenvalue
+    eigs = np.linalg.eigvals(dot_batch(Ainv, B))
+    isReal = (eigs.imag == 0)
+    valid &= isReal.any(axis=1)
+    e = eigs.real[np.arange(n), np.argmax(isReal, axis=1)]
+
+    lines, lvalid = factor_degenerate_batch(B - e[:,None,None]*A)
+    points, pvalid = [], []
+    for j in range(2):
+        p, pv = intersections_ellipse_line_batch(A, lines[:,j])
+        points.append(p)
+        pvalid.append(pv & lvalid[:,j:j+1] & valid[:,None])
+    return np.concatenate(points, axis=1), np.concatenate(pvalid, axis=1)
+
+
+class nuSolutionSetBatch(object):
+    '''Definitions for nu analytic solution, t->b,mu,nu, for arrays of events'''
+
+    def __init__(self, b, mu,  # (N,4) arrays of px,py,pz,E
+                 mW2=mW**2, mT2=mT**2, mN2=mN**2):
+        b, mu = np.asarray(b, dtype=np.float64), np.asarray(mu, dtype=np.float64)
+        bP, muP = np.linalg.norm(b[:,:3], axis=1), np.linalg.norm(mu[:,:3], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c = np.clip(np.einsum('ni,ni->n', b[:,:3], mu[:,:3]) / (bP*muP), -1, 1)
+            s = np.sqrt(1-c**2)
+
+            x0p = - (mT2 - mW2 - (b[:,3]**2 - bP**2)) / (2*b[:,3])
+            x0 = - (mW2 - (mu[:,3]**2 - muP**2) - mN2) / (2*mu[:,3])
+
+            Bb, Bm = bP / b[:,3], muP / mu[:,3]
+
+            Sx = (x0 * Bm - muP*(1-Bm**2)) / Bm**2
+            Sy = (x0p / Bb - c * Sx) / s
+
+            w = (Bm / Bb - c) / s
+
+            Om2 = w**2 + 1 - Bm**2
+            eps2 = (mW2 - mN2) * (1 - Bm**2)
+            x1 = Sx - (Sx+w*Sy) / Om2
+            y1 = Sy - (Sx+w*Sy) * w / Om2
+            Z2 = x1**2 * Om2 - (Sy-w*Sx)**2 - (mW2-x0**2-eps2)
+            Z = np.sqrt(np.maximum(0, Z2))
+            Om = np.sqrt(Om2)
+
+            #transformation of t=[c,s,1] to p_nu: F coord.
+            zeros = np.zeros(len(b))
+            self.H_tilde = np.stack([np.stack([  Z/Om, zeros, x1-muP], axis=1),
+                                     np.stack([w*Z/Om, zeros,     y1], axis=1),
+                                     np.stack([ zeros,     Z,  zeros], axis=1)], axis=1)
+
+            #rotation from F coord. to laboratory coord.
+            R_z = R_batch(2, -np.arctan2(mu[:,1], mu[:,0]))
+            R_y = R_batch(1, 0.5*math.pi - np.arctan2(np.hypot(mu[:,0], mu[:,1]), mu[:,2]))
+            b_rot = dot_batch(R_y, R_z, b[:,:3])
+            R_x = R_batch(0, -np.arctan2(b_rot[:,2], b_rot[:,1]))
+            self.R_T = dot_batch(np.transpose(R_z, (0,2,1)),
+                                 np.transpose(R_y, (0,2,1)),
+                                 np.transpose(R_x, (0,2,1)))
+
+        self.H = dot_batch(self.R_T, self.H_tilde)
+        self.H_perp = self.H.copy()
+        self.H_perp[:,2] = [0, 0, 1]
+
+        #solution ellipse of pT_nu: lab coord.
+        self.HpInv, self.valid = safe_inv_batch(self.H_perp)
+        self.valid &= np.isfinite(self.H).all(axis=(1,2))
+        self.N = dot_batch(np.transpose(self.HpInv, (0,2,1)), np.broadcast_to(UnitCircle(), self.HpInv.shape), self.HpInv)
+
+
+class singleNeutrinoSolutionBatch(object):
+    '''Most likely neutrino momentum for tt-->lepton+jets, for arrays of events'''
+    def __init__(self, b, mu,   # (N,4) arrays of px,py,pz,E
+                 met,           # (N,2) array of momentum imbalance
+                 sigma2,        # Mo. imbalance unc. matrix, (2,2) or (N,2,2)
+                 mW2=mW**2, mT2=mT**2):
+        self.solutionSet = nuSolutionSetBatch(b, mu, mW2, mT2)
+        n = len(self.solutionSet.H)
+        met = np.asarray(met, dtype=np.float64)
+
+        S2 = np.zeros((n,3,3))
+        S2[:,:2,:2] = np.linalg.inv(np.broadcast_to(sigma2, (n,2,2)))
+        deltaNu = -self.solutionSet.H
+        deltaNu[:,:2,2] += met
+
+        self.X = dot_batch(np.transpose(deltaNu, (0,2,1)), S2, deltaNu)
+        XD = dot_batch(self.X, np.broadcast_to(Derivative(), (n,3,3)))
+        M = XD + np.transpose(XD, (0,2,1))
+
+        solutions, mask = intersections_ellipses_batch(M, np.broadcast_to(UnitCircle(), (n,3,3)), self.solutionSet.valid)
+        with np.errstate(invalid='ignore'):
+            X2 = np.einsum('nsi,nij,nsj->ns', solutions, self.X, solutions)
+        X2 = np.where(mask, X2, np.inf)
+        best = np.argmin(X2, axis=1)
+
+        self.valid = mask.any(axis=1)
+        self.solutions = solutions[np.arange(n), best]
+        self.chi2 = np.where(self.valid, X2[np.arange(n), best], np.nan)
+
+    @property
+    def nu(self):
+        '''Solution for neutrino momentum, (N,3)'''
+        return dot_batch(self.solutionSet.H, self.solutions)
+
+
+class doubleNeutrinoSolutionsBatch(object):
+    '''Solution pairs of neutrino momenta, tt -> leptons, for arrays of events'''
+    def __init__(self, (b, b_), (mu, mu_),  # (N,4) arrays of px,py,pz,E
+                 met,                       # (N,2) array of ETmiss
+                 mW2=mW**2, mT2=mT**2):
+        self.solutionSets = [nuSolutionSetBatch(B, M, mW2, mT2)
+                             for B,M in zip((b,b_),(mu,mu_))]
+        ss, ss_ = self.solutionSets
+        n = len(ss.H)
+        met = np.asarray(met, dtype=np.float64)
+
+        self.S = np.tile(-UnitCircle().astype(np.float64), (n,1,1))
+        self.S[:,:2,2] += met
+        self.n_ = dot_batch(np.transpose(self.S, (0,2,1)), ss_.N, self.S)
+
+        valid = ss.valid & ss_.valid
+        self.perp, self.mask = intersections_ellipses_batch(ss.N, self.n_, valid)
+        self.perp_ = np.einsum('nij,nsj->nsi', self.S, self.perp)
+
+        #numerical minimization of the MET residuals for the events without analytic solution
+        self.fallback = valid & ~self.mask.any(axis=1)
+        if leastsq:
+            for i in np.nonzero(self.fallback)[0]:
+                es = [ss.H_perp[i], ss_.H_perp[i]]
+                metV = np.array([met[i,0], met[i,1], 1])
+
+                def nus(ts):
+                    return tuple(e.dot([math.cos(t), math.sin(t), 1])
+                                 for e, t in zip(es, ts))
+
+                def residuals(params):
+                    return sum(nus(params), -metV)[:2]
+
+                ts,_ = leastsq(residuals, [0, 0],
+                               ftol=5e-5, epsfcn=0.01)
+                self.perp[i,0], self.perp_[i,0] = nus(ts)
+                self.mask[i,0] = True
+        else:
+            self.fallback[:] = False
+
+    @property
+    def nunu_s(self):
+        '''Solution pairs for neutrino momenta, (N,4,2,3) (to be used with mask)'''
+        K, K_ = [dot_batch(ss.H, ss.HpInv) for ss in self.solutionSets]
+        return np.stack([np.einsum('nij,nsj->nsi', K, self.perp),
+                         np.einsum('nij,nsj->nsi', K_, self.perp_)], axis=2)
@@ -0,0 +1,73 @@
+import os
+import json
+
+DEFAULTTHROUGHPUT=1.e+6 #bytes per second assumed for samples which were never timed
+
+#maximum wall time in seconds of the condor job flavours
+JOBFLAVOURS={'espresso'     : 20*60,
+             'microcentury' : 60*60,
+             'longlunch'    : 2*60*60,
+             'workday'      : 8*60*60,
+             'tomorrow'     : 24*60*60,
+             'testmatch'    : 3*24*60*60,
+             'nextweek'     : 7*24*60*60}
+
+"""
+reads the cache with the throughput (bytes processed per second) measured for each sample
+"""
+def readThroughputCache(url):
+    try:
+        with open(url,'r') as cache:
+            return json.load(cache)
+    except (IOError,ValueError):
+        return {}
+
+"""
+updates the throughput of a sample in the cache with a new measurement (running average of the last measurements)
+"""
+def updateThroughputCache(url,measurements,weight=0.5):
+    throughput=readThroughputCache(url)
+    for tag,(nbytes,seconds) in measurements.items():
+        if nbytes<=0 or seconds<=0 : continue
+        newValue=float(nbytes)/float(seconds)
+        throughput[tag]=newValue if not tag in throughput else weight*newValue+(1-weight)*throughput[tag]
+    with open(url,'w') as cache:
+        json.dump(throughput,cache,indent=1,sort_keys=True)
+
+"""
+expected time (in seconds) to process a file of a given size for a sample
+"""
+def getExpectedTime(tag,size,throughput={}):
+    return float(size)/throughput.get(tag,DEFAULTTHROUGHPUT)
+
+"""
+groups items with a given cost so that each group has a total cost close to (and if possible below) maxCost:
+items are sorted by decreasing cost, items with cost above maxCost go alone and the others are added to the first group
+with enough room left (first-fit decreasing); returns a list of groups with the indices of the items
+"""
+def groupByCost(costs,maxCost):
+    if maxCost<=0: return [[i] for i in xrange(len(costs))]
+    groups,groupCosts=[],[]
+    for i in sorted(xrange(len(costs)),key=lambda i:-costs[i]):
+        for ig in xrange(len(groups)):
+            if groupCosts[ig]+costs[i]>maxCost: continue
+            groups[ig].append(i)
+            groupCosts[ig]+=costs[i]
+            break
+        else:
+            groups.append([i])
+            groupCosts.append(costs[i])
+    return groups
+
+"""
+expected time in seconds of the jobs in which the files are grouped (0 means one file per job, the default):
+local jobs are capped so that there are at least as many groups as parallel jobs (given the total expected time),
+condor jobs are capped to a fraction of the wall time of the flavour, as the expected times are only estimates
+"""
+def getJobTimeBudget(queue,taskTime=None,njobs=0,totalCost=0.,wallTimeFraction=0.5):
+    if not taskTime: return 0.
+    if queue=='local':
+        if njobs>0 : taskTime=min(taskTime,float(totalCost)/njobs)
+        return taskTime
+    if not queue in JOBFLAVOURS: return 0.
+    return min(taskTime,wallTimeFraction*JOBFLAVOURS[queue])
@@ -2,31 +2,111 @@ import ROOT
 import pickle
 import os
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir=None
+
+#listings are kept for LISTINGTTL seconds, as long as the modification time of the directory is unchanged
+LISTINGTTL=600
+LISTINGCACHE={}
+
+def listDirectory(directory,ttl=LISTINGTTL):
+
+    """
+    returns the entries of a (locally mounted) directory as a sorted list of (name, isDir, size, mtime),
+    or an empty list if the directory can't be read
+    """
+
+    import time
+
+    try:
+        dirMtime=os.stat(directory).st_mtime
+    except OSError:
+        return []
+
+    key=os.path.normpath(directory)
+    if key in LISTINGCACHE:
+        cacheTime,cacheMtime,entries=LISTINGCACHE[key]
+        if cacheMtime==dirMtime and time.time()-cacheTime<ttl:
+            return entries
+
+    entries=[]
+    try:
+        if scandir:
+            for e in scandir(directory):
+                try:
+                    st=e.stat()
+                    entries.append( (e.name,e.is_dir(),st.st_size,st.st_mtime) )
+                except OSError:
+                    pass
+        else:
+            for name in os.listdir(directory):
+                try:
+                    st=os.stat(os.path.join(directory,name))
+                    entries.append( (name,os.path.isdir(os.path.join(directory,name)),st.st_size,st.st_mtime) )
+                except OSError:
+                    pass
+    except OSError:
+        return []
+
+    entries.sort()
+    LISTINGCACHE[key]=(time.time(),dirMtime,entries)
+    return entries
+
+def listDirectories(directoryList,nThreads=8):
+
+    """lists several directories concurrently, returns a dict directory : entries"""
+
+    if len(directoryList)<2 or nThreads<2:
+        return dict([(d,listDirectory(d)) for d in directoryList])
+    from multiprocessing.pool import ThreadPool
+    pool=ThreadPool(min(nThreads,len(directoryList)))
+    listings=pool.map(listDirectory,directoryList)
+    pool.close()
+    pool.join()
+    return dict(zip(directoryList,listings))
+
+def walkDirectory(directory,nThreads=8):
+
+    """
+    lists recursively a directory, the sub-directories of each level are listed concurrently
+    returns a dict with the path of each file : (size, mtime)
+    """
+
+    files={}
+    toList=[directory]
+    while len(toList)>0:
+        listings=listDirectories(toList,nThreads)
+        toList=[]
+        for d in sorted(listings):
+            for name,isDir,size,mtime in listings[d]:
+                path=os.path.join(d,name)
+                if isDir: toList.append(path)
+                else:     files[path]=(size,mtime)
+    return files
+
 def getEOSlslist(directory, mask='', prepend='root://eoscms//eos/cms/'):
 
     """
     Takes a directory on eos (starting from /store/...) and returns a list of all files with 'prepend' prepended
     """
 
-
-    from subprocess import Popen, PIPE
     print 'looking into: '+directory+'...'
 
     #eos should be mounted
-    data = Popen(['ls', '/eos/cms/%s'%directory],stdout=PIPE)
-    out,err = data.communicate()
-
-    full_list = []
+    localDir='/eos/cms/%s'%directory
 
     ## if input file was single root file:
     if directory.endswith('.root'):
-        if len(out.split('\n')[0]) > 0:
+        if os.path.isfile(localDir):
             return [prepend + directory]
 
     ## instead of only the file name append the string to open the file in ROOT
-    for line in out.split('\n'):
-        if len(line.split()) == 0: continue
-        full_list.append(prepend + directory + '/' + line)
+    full_list = [prepend + directory + '/' + name for name,_,_,_ in listDirectory(localDir) if not name.startswith('.')]
 
     ## strip the list of files if required
     if mask != '':
@@ -36,24 +116,44 @@ def getEOSlslist(directory, mask='', prepend='root://eoscms//eos/cms/'):
     ## return 
     return full_list
 
+def getFileInfo(url):
+
+    """returns the (size in bytes, modification time) of a file (eos urls are resolved to the local mount), None if it can't be found"""
+
+    path=url
+    if url.startswith('root://') and '/eos/cms/' in url: path='/eos/cms/'+url.split('/eos/cms/',1)[1]
+
+    #use the (cached) listing of the directory instead of a stat per file
+    name=os.path.basename(path)
+    for ename,isDir,size,mtime in listDirectory(os.path.dirname(path) or '.'):
+        if ename==name: return size,mtime
+    return None
+
+def getFileSize(url):
+
+    """returns the size of a file in bytes, 0 if it can't be determined"""
+
+    info=getFileInfo(url)
+    return info[0] if info else 0
+
 def getChunksInSizeOf(chunkSize,directoryList,mask='',prepend='root://eoscms//eos/cms/'):
     
-    """groups files in directory in chunks of a given size"""
+    """groups files in directory in chunks of a given size (in Gb)"""
 
-    chunkList=[[]]
-    cursize=0.
-    for directory in directoryList:
+    from TopLJets2015.TopAnalysis.splitTools import groupByCost
 
-        fList=getEOSlslist(directory=directory, mask=mask, prepend='/eos/cms')
+    #list all the directories at once, the sizes come with the listing
+    localDirs=['/eos/cms/%s'%directory for directory in directoryList]
+    listings=listDirectories(localDirs)
 
-        for f in fList:
+    fList,fSizes=[],[]
+    for directory,localDir in zip(directoryList,localDirs):
+        for name,isDir,size,_ in listings[localDir]:
+            f='/eos/cms'+directory+'/'+name
             if not '.root' in f : continue
-            fsize=float(os.path.getsize(f))/(1024.e+6)
-            if cursize+fsize>chunkSize: 
-                chunkList.append([])
-                cursize=fsize
-            else:
-                cursize += fsize
-            chunkList[-1].append(f.replace('/eos/cms/',prepend))
-
-    return chunkList
+            if mask!='' and not mask in f : continue
+            fList.append(f.replace('/eos/cms/',prepend))
+            fSizes.append(float(size)/(1024.e+6))
+
+    chunkList=[[fList[i] for i in sorted(group)] for group in groupByCost(fSizes,chunkSize)]
+    return chunkList if len(chunkList) else [[]]
@@ -1,6 +1,7 @@
 from ROOT import TLorentzVector, TVector2, TVector3
 from math import *
 from copy import copy
+import numpy as np
 
 # parameter used to set lower bounds while searching
 mc=0.0
@@ -240,6 +241,227 @@ def calcMt2(vis1in, vis2in, childin):
 			outputmt2=Mtmin+(Mtmax-Mtmin)*0.5
 	return outputmt2
 
+"""
+Special version of sqrt() to handle extreme inputs, for arrays
+"""
+def mt2SqrtArray(x):
+	x=np.asarray(x,dtype=np.float64)
+	with np.errstate(invalid='ignore'):
+		root=np.where(np.isnan(x) | (x<=0.0), 0.0, x)
+
+		#same Newton iterations as mt2Sqrt, so that the results are identical
+		act=np.nonzero((root>0.0) & ~np.isinf(root))[0]
+		xa=root[act]
+		prev2root=-np.ones_like(xa)
+		prevroot=-np.ones_like(xa)
+		r=np.ones_like(xa)
+		while len(act)>0:
+			prev2root=prevroot
+			prevroot=r
+			r=(r+xa/r)*0.5
+			keep=(r!=prevroot) & (r!=prev2root)
+			if not keep.all():
+				root[act[~keep]]=r[~keep]
+				act,xa,prev2root,prevroot,r=act[keep],xa[keep],prev2root[keep],prevroot[keep],r[keep]
+	return root
+
+"""
+Mass of a TLorentzVector built with SetXYZM(px,py,0,m), as returned by M() (for arrays)
+"""
+def xyzmMassArray(px,py,m):
+	p2=px*px+py*py+0.0*0.0
+	en=np.where(m>=0, np.sqrt(p2+m*m), np.sqrt(np.maximum(p2-m*m,0.)))
+	mm=en*en-p2
+	return np.where(mm<0.0, -np.sqrt(np.abs(mm)), np.sqrt(np.abs(mm)))
+
+"""
+Calculate the M_{T2} variable for arrays of events: the two visible systems and the MET are given as (N,3)
+arrays with columns (m,px,py); the same bisection as in calcMt2 is run for all the events at once,
+the early-exit branches being expressed as masks
+"""
+def calcMt2Arrays(vis1in, vis2in, childin, chunkSize=16384):
+
+	vis1in,vis2in,childin=[np.atleast_2d(np.asarray(x,dtype=np.float64)) for x in (vis1in,vis2in,childin)]
+
+	#process large arrays in chunks which fit in the cache
+	if len(vis1in)>chunkSize:
+		return np.concatenate([calcMt2Arrays(vis1in[i:i+chunkSize],vis2in[i:i+chunkSize],childin[i:i+chunkSize],chunkSize)
+					for i in xrange(0,len(vis1in),chunkSize)])
+
+	swap=vis1in[:,0]>vis2in[:,0]
+	vis1=np.where(swap[:,None],vis2in,vis1in)
+	vis2=np.where(swap[:,None],vis1in,vis2in)
+
+	with np.errstate(divide='ignore',invalid='ignore'):
+
+		ma,pxa,pya=vis1[:,0],vis1[:,1],vis1[:,2]
+		mb,pxb,pyb=vis2[:,0],vis2[:,1],vis2[:,2]
+		mc,pxc,pyc=childin[:,0],childin[:,1],childin[:,2]
+
+		mag=mt2SqrtArray(pxa*pxa+pya*pya)
+		cospart=pxa/mag
+		sinpart=pya/mag
+
+		#rotate to have the first visible system along x
+		vis1Px,vis1Py=mag,np.zeros_like(mag)
+		vis2Px,vis2Py=pxb*cospart+pyb*sinpart, pyb*cospart-pxb*sinpart
+		childPx,childPy=pxc*cospart+pyc*sinpart, pyc*cospart-pxc*sinpart
+		vis1M=xyzmMassArray(vis1Px,vis1Py,ma)
+		vis2M=xyzmMassArray(vis2Px,vis2Py,mb)
+
+		vis1M2=vis1M*vis1M
+		vis2M2=vis2M*vis2M
+		mc2=mc*mc
+		vis1Px2=vis1Px*vis1Px
+		vis2Px2=vis2Px*vis2Px
+		childPx2=childPx*childPx
+		vis2Py2=vis2Py*vis2Py
+		childPy2=childPy*childPy
+		vis1Pt2=vis1Px2
+		vis2Pt2=vis2Px2+vis2Py2
+		childPt2=childPx2+childPy2
+		vis1Et2=vis1M2+vis1Pt2
+		vis2Et2=vis2M2+vis2Pt2
+		childEt2=mc2+childPt2
+		vis1Et=mt2SqrtArray(vis1Et2)
+		vis2Et=mt2SqrtArray(vis2Et2)
+
+		outputmt2=np.zeros_like(mag)
+		solved=np.zeros(len(mag),dtype=bool)
+		Mtmin=np.zeros_like(mag)
+		Mtmax=np.zeros_like(mag)
+
+		bothMassive=~((vis1M<=0.0) | (vis2M<=0.0))
+		secondMassive=~bothMassive & ~(vis2M<=0.0)
+		massless=~bothMassive & ~secondMassive
+
+		#both visible systems are massive
+		xlmin=vis1Px*mc/vis1M
+		xrmin=vis2Px*mc/vis2M
+		yrmin=vis2Py*mc/vis2M
+
+		altxlmin=childPx-xlmin
+		altxrmin=childPx-xrmin
+		altyrmin=childPy-yrmin
+
+		Mtlmin=np.where(bothMassive,vis1M+mc,mc)
+		Mtrmin=vis2M+mc
+
+		Mtratlmin=mt2SqrtArray(vis2M2+mc2+2.0*(vis2Et*mt2SqrtArray(mc2+altxlmin*altxlmin+childPy2)-vis2Px*altxlmin-vis2Py*childPy))
+		Mtlatrmin=mt2SqrtArray(vis1M2+mc2+2.0*(vis1Et*mt2SqrtArray(mc2+altxrmin*altxrmin+altyrmin*altyrmin)-vis1Px*altxrmin))
+
+		solvedl=bothMassive & (Mtlmin>=Mtratlmin)
+		solvedr=(bothMassive | secondMassive) & ~solvedl & (Mtrmin>=Mtlatrmin)
+		outputmt2=np.where(solvedl,Mtlmin,np.where(solvedr,Mtrmin,outputmt2))
+		solved=solvedl | solvedr
+
+		toBound=(bothMassive | secondMassive) & ~solved
+		Mtmin=np.where(toBound,np.where(Mtlmin>Mtrmin,Mtlmin,Mtrmin),Mtmin)
+		Mtmax=np.where(toBound & bothMassive,np.where(Mtlatrmin<Mtratlmin,Mtlatrmin,Mtratlmin),Mtmax)
+		Mtmax=np.where(toBound & secondMassive,Mtlatrmin,Mtmax)
+
+		backupmid=mt2SqrtArray(mc2+(childPx*childPx+childPy*childPy)*0.25)
+		backup1=mt2SqrtArray(vis1M2+mc2+2.0*(vis1Et*backupmid-0.5*vis1Px*childPx))
+		backup2=mt2SqrtArray(vis2M2+mc2+2.0*(vis2Et*backupmid-0.5*(vis2Px*childPx+vis2Py*childPy)))
+		backup=np.where(backup1>backup2,backup1,backup2)
+		Mtmax=np.where((bothMassive | secondMassive) & (backup<Mtmax),backup,Mtmax)
+
+		#both visible systems are massless
+		trialmid=mt2SqrtArray(mc2+0.25*childPt2)
+		trial1=mt2SqrtArray(mc2+2.0*(vis1Et*trialmid-vis1Px*childPx*0.5))
+		trial2=mt2SqrtArray(mc2+2.0*(vis2Et*trialmid-0.5*(vis2Px*childPx+vis2Py*childPy)))
+		Mtmin=np.where(massless,mc,Mtmin)
+		Mtmax=np.where(massless,np.where(trial1>trial2,trial1,trial2),Mtmax)
+
+		#bisection for the events which are not solved yet
+		outputmt2=np.where(solved,outputmt2,Mtmin+(Mtmax-Mtmin)*0.5)
+
+		C1=1.0/vis1Et2
+
+		A2=vis2M2+vis2Py2
+		B2=-2.0*vis2Px*vis2Py
+		C2=1.0/(vis2M2+vis2Px2)
+
+		preF1=vis1Et2*mc2
+
+		preD2=-2.0*childPx*A2-B2*childPy
+		preE2=-2.0*childPy/C2-B2*childPx
+		preF2=vis2Et2*childEt2-childPx2*vis2Px2-childPy2*vis2Py2+B2*childPx*childPy
+
+		G=B2*0.5*C2
+		J1=-vis1M2*C1
+		J2=(B2*B2*0.25*C2-A2)*C2
+
+		alpha=G*G-J1-J2
+		p0_4=alpha*alpha-4.0*J1*J2
+		p0_4nonzero=np.where(np.fabs(p0_4)<1e-9,1e-9,p0_4)
+
+		sign0_4=np.sign(p0_4)
+
+		#per-event constants of the events to bisect (compacted when some of the events converge)
+		act=np.nonzero(~solved & (outputmt2>Mtmin) & (outputmt2<Mtmax))[0]
+		lanes=[x[act] for x in (mc2,vis1M2,vis2M2,vis1Px,vis2Px,vis2Py,childPx,childPy,preF1,preD2,preE2,preF2,C1,C2,B2,G,J1,J2,alpha,sign0_4,p0_4nonzero)]
+		out,tmin,tmax=outputmt2[act],Mtmin[act],Mtmax[act]
+		while len(act)>0:
+			mc2_,vis1M2_,vis2M2_,vis1Px_,vis2Px_,vis2Py_,childPx_,childPy_,preF1_,preD2_,preE2_,preF2_,C1_,C2_,B2_,G_,J1_,J2_,alpha_,sign0_4_,p0_4nonzero_=lanes
+
+			q1=mc2_+vis1M2_-out*out
+			D1=q1*vis1Px_
+			F1=preF1_-q1*q1*0.25
+
+			q2=out*out-mc2_-vis2M2_
+			D2=preD2_+q2*vis2Px_
+			E2=preE2_+q2*vis2Py_
+			F2=preF2_-q2*(q2*0.25+vis2Px_*childPx_+vis2Py_*childPy_)
+
+			H=E2*0.5*C2_
+
+			K1=-D1*C1_
+			L1=-F1*C1_
+
+			K2=(B2_*E2*0.5*C2_-D2)*C2_
+			L2=(E2*E2*0.25*C2_-F2)*C2_
+
+			beta=2.0*G_*H-K1-K2
+			gamma=H*H-L1-L2
+
+			p0_3=(2.0*alpha_*beta-4.0*(J1_*K2+J2_*K1))/p0_4nonzero_
+			p0_2=(2.0*alpha_*gamma+beta*beta-4.0*(J1_*L2+J2_*L1+K1*K2))/p0_4nonzero_
+			p0_1=(2.0*beta*gamma-4.0*(K1*L2+K2*L1))/p0_4nonzero_
+			p0_0=(gamma*gamma-4.0*L1*L2)/p0_4nonzero_
+
+			p2_2=0.1875*p0_3*p0_3-p0_2*0.5
+			p2_1=p0_3*p0_2*0.125-0.75*p0_1
+			p2_0=p0_3*p0_1*0.0625-p0_0
+
+			p2_2nonzero=np.where(np.fabs(p2_2)<1e-9,1e-9,p2_2)
+
+			p3_1=(4.0*p2_0+3.0*p0_3*p2_1)/p2_2nonzero-4.0*p2_1*p2_1/(p2_2nonzero*p2_2nonzero)-2.0*p0_2
+			p3_0=3.0*p0_3*p2_0/p2_2nonzero-4.0*p2_1*p2_0/(p2_2nonzero*p2_2nonzero)-p0_1
+
+			p4_0=np.where(np.fabs(p3_1)<1e-9,
+					np.where(p2_2>0,-1.,np.where(p2_2==0,0.,1.)),
+					p2_1*p3_0/p3_1-p2_2*p3_0*p3_0/(p3_1*p3_1)-p2_0)
+
+			#count the sign changes of the Sturm sequence
+			sign2_2,sign3_1=np.sign(p2_2),np.sign(p3_1)
+			changes=[sign0_4_*sign2_2,sign2_2*sign3_1,sign3_1*np.sign(p4_0)]
+			negroots=1+sum([(x>0.0).astype(int) for x in changes])
+			posroots=sum([(x<0.0).astype(int) for x in changes])
+
+			lower=(posroots==negroots)
+			tmin=np.where(lower,out,tmin)
+			tmax=np.where(lower,tmax,out)
+			out=tmin+(tmax-tmin)*0.5
+
+			keep=(out>tmin) & (out<tmax)
+			if not keep.all():
+				outputmt2[act[~keep]]=out[~keep]
+				act,out,tmin,tmax=act[keep],out[keep],tmin[keep],tmax[keep]
+				lanes=[x[keep] for x in lanes]
+
+	return outputmt2
+
 """
 Special version of sqrt() to handle extreme inputs
 """
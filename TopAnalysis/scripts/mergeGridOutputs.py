@@ -60,6 +60,9 @@ def main():
     condor.write('requirements = (OpSysAndVer =?= "SLCern6")\n') #SLC6
     condor.write('+JobFlavour ="%s"\n'%opt.queue)
 
+    #list the full input tree concurrently, the listings below are then served from the cache
+    walkDirectory('/eos/cms/%s'%opt.inDir)
+
     if not opt.localProd:
         dset_list=getEOSlslist(directory=opt.inDir,prepend='')
         for dset in dset_list:
@@ -1,8 +1,12 @@
 #! /usr/bin/env python
 import os, sys
+import json
+import shutil
+import tempfile
+import optparse
 import ROOT
-counters = {}
-badFiles = []
+
+MANIFEST='.mergeManifest.json'
 
 def isint(string):
     try:
@@ -11,76 +15,191 @@ def isint(string):
     except ValueError:
         return False
 
-def getBaseNames(dirname):
-    names = set()
+def isGoodFile(url):
+    """checks that a chunk can be opened and was properly closed"""
+    goodFile = False
+    try:
+        fIn=ROOT.TFile.Open(url)
+        if fIn and not fIn.IsZombie() and not fIn.TestBit(ROOT.TFile.kRecovered):
+            goodFile = True
+        if fIn: fIn.Close()
+    except:
+        pass
+    return url,goodFile
+
+def getChunks(dirname):
+    """groups the chunks found in a directory by sample, keeping track of their modification times"""
+    counters = {}
     for item in os.listdir(dirname):
         filename, ext = os.path.splitext(item)
         if not ext == '.root': continue
         try:
-            #if not ('MC13TeV' in filename or 'Data13TeV' in filename) : continue
-            fIn=ROOT.TFile.Open(dirname+'/'+item)
-            goodFile = False
-            try:
-                if fIn and not fIn.IsZombie() and not fIn.TestBit(ROOT.TFile.kRecovered):
-                    goodFile = True
-            except:
-                pass
             basename, number = filename.rsplit('_',1)
-            print basename,number,goodFile
-            if (not goodFile):
-                badFiles.append(dirname+'/'+item)
-                continue
             if not number == 'missing' and not isint(number):
                 raise ValueError
-
-            try:
-                counters[basename].append(dirname+'/'+item)
-            except KeyError:
-                counters[basename] = [dirname+'/'+item]
-            names.add(basename)
-
         except ValueError:
             print filename,'is single'
-            names.add(filename)
-    return names
+            continue
+        url=os.path.join(dirname,item)
+        counters.setdefault(basename,{})[url]=os.path.getmtime(url)
+    return counters
 
-try:
-    inputdir = sys.argv[1]
-    if not os.path.isdir(inputdir):
-        print "Input directory not found:", inputdir
-        exit(-1)
-except IndexError:
-    print "Need to provide an input directory."
-    exit(-1)
+def readManifest(outputdir):
+    try:
+        with open(os.path.join(outputdir,MANIFEST),'r') as cache:
+            return json.load(cache)
+    except (IOError,ValueError):
+        return {}
+
+def writeManifest(outputdir,manifest):
+    with open(os.path.join(outputdir,MANIFEST),'w') as cache:
+        json.dump(manifest,cache,indent=1,sort_keys=True)
+
+def runHadd(args):
+    """wrapper to be used in the pool, returns the hadd exit code"""
+    target,files,noTrees=args
+    cmd = 'hadd -f %s %s %s > /dev/null' % ('-T' if noTrees else '', target, " ".join(files))
+    return os.system(cmd)
+
+def mergeSamples(samples,noTrees,pool,maxChunks,tmpdir):
+
+    """
+    merges the chunks of all the samples concurrently; samples with more than maxChunks chunks are merged in
+    successive stages (groups of maxChunks chunks are merged into partial files which are merged in turn)
+    samples is a dict of basename : (target, [chunks]), returns the list of samples which failed to merge
+    """
+
+    failed=[]
+    pending=dict(samples)
+    stage=0
+    while len(pending)>0:
+
+        jobs,partials=[],{}
+        for basename,(target,files) in pending.iteritems():
+            if len(files)<=maxChunks:
+                jobs.append( (basename,target,files) )
+                continue
+            partials[basename]=(target,[])
+            for i in xrange(0,len(files),maxChunks):
+                partial=os.path.join(tmpdir,'%s_stage%d_%d.root'%(basename,stage,len(partials[basename][1])))
+                partials[basename][1].append(partial)
+                jobs.append( (basename,partial,files[i:i+maxChunks]) )
 
-noTrees=False
-if len(sys.argv)>2 and sys.argv[2]=='True': noTrees=True
+        print '... stage %d: %d merge jobs for %d samples'%(stage,len(jobs),len(pending))
+        codes=pool.map(runHadd,[(target,files,noTrees) for _,target,files in jobs])
 
-outputdir = inputdir
-if len(sys.argv)>3 : outputdir=sys.argv[3]
-chunkdir  = os.path.join(inputdir, 'Chunks')
-basenames = getBaseNames(chunkdir)
+        #samples with a failed merge are not propagated to the next stage
+        for (basename,target,_),code in zip(jobs,codes):
+            if code==0: continue
+            if not basename in failed: failed.append(basename)
+            partials.pop(basename,None)
 
-print '-----------------------'
-print 'Will process the following samples:', basenames
+        #remove partial files from the previous stage
+        if stage>0:
+            for _,_,files in jobs:
+                for f in files:
+                    if f.startswith(tmpdir) and os.path.isfile(f): os.remove(f)
 
-os.system('mkdir -p %s' % chunkdir)
+        pending=partials
+        stage+=1
 
-for basename, files in counters.iteritems():
+    return failed
 
-    filenames = " ".join(files)
-    target = os.path.join(outputdir,"%s.root" % basename)
+def main():
 
-    # merging:
-    print '... processing', basename
-    if noTrees:
-        cmd = 'hadd -f -T %s %s' % (target, filenames)
-    else:
-        cmd = 'hadd -f %s %s' % (target, filenames)
-    os.system(cmd)
+    usage = 'usage: %prog [options] inputdir [noTrees] [outputdir]'
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-j', '--jobs',      dest='jobs',      help='number of parallel jobs [%default]',                    default=8,     type=int)
+    parser.add_option('--maxChunks',       dest='maxChunks', help='max. number of files per hadd call [%default]',          default=100,   type=int)
+    parser.add_option('--tmp',             dest='tmp',       help='directory for the partial merges [system temporary dir]', default=None)
+    parser.add_option('-f', '--force',     dest='force',     help='merge all samples, even if unchanged [%default]',        default=False, action='store_true')
+    (opt, args) = parser.parse_args()
+    if opt.maxChunks<2:
+        print "--maxChunks has to be at least 2"
+        exit(-1)
+
+    try:
+        inputdir = args[0]
+        if not os.path.isdir(inputdir):
+            print "Input directory not found:", inputdir
+            exit(-1)
+    except IndexError:
+        print "Need to provide an input directory."
+        exit(-1)
+
+    noTrees=False
+    if len(args)>1 and args[1]=='True': noTrees=True
+
+    outputdir = inputdir
+    if len(args)>2 : outputdir=args[2]
+    chunkdir  = os.path.join(inputdir, 'Chunks')
+    counters  = getChunks(chunkdir)
+
+    #skip samples for which the set of chunks is the same as in the last merge
+    manifest = readManifest(outputdir)
+    toMerge  = {}
+    badFiles = []
+    for basename, chunks in counters.iteritems():
+        target = os.path.join(outputdir,"%s.root" % basename)
+        entry  = manifest.get(basename,None)
+        if not opt.force and entry and os.path.isfile(target) \
+                and entry['chunks']==chunks and entry['noTrees']==noTrees:
+            badFiles += entry['bad']
+            continue
+        toMerge[basename]=(target,sorted(chunks.keys()))
 
-if (len(badFiles) > 0):
     print '-----------------------'
-    print 'The following files are not done yet or require resubmission, please check LSF output:'
-    for file in badFiles:
-        print file,
+    print 'Will process the following samples:', sorted(toMerge.keys())
+    print 'Unchanged since the last merge:', sorted(set(counters.keys())-set(toMerge.keys()))
+
+    import multiprocessing as MP
+    pool = MP.Pool(opt.jobs)
+
+    #validate the chunks
+    status = dict(pool.map(isGoodFile,[f for _,files in toMerge.values() for f in files]))
+    newBad = {}
+    for basename in toMerge.keys():
+        target,files = toMerge[basename]
+        newBad[basename] = [f for f in files if not status[f]]
+        badFiles += newBad[basename]
+        files = [f for f in files if status[f]]
+        if len(files)==0:
+            del toMerge[basename]
+            continue
+        toMerge[basename] = (target,files)
+
+    #merge
+    tmpdir = tempfile.mkdtemp(dir=opt.tmp)
+    try:
+        failed = mergeSamples(toMerge,noTrees,pool,opt.maxChunks,tmpdir)
+    finally:
+        shutil.rmtree(tmpdir,ignore_errors=True)
+    pool.close()
+    pool.join()
+
+    #update the manifest with the samples merged successfully, dropping the samples which no longer
+    #exist or have no good chunks left
+    for basename in manifest.keys():
+        if not basename in counters or (basename in newBad and not basename in toMerge):
+            del manifest[basename]
+    for basename in toMerge:
+        if basename in failed:
+            manifest.pop(basename,None)
+            continue
+        manifest[basename]={'chunks':counters[basename],'bad':newBad[basename],'noTrees':noTrees}
+    writeManifest(outputdir,manifest)
+
+    if (len(failed) > 0):
+        print '-----------------------'
+        print 'hadd failed for the following samples:'
+        for basename in sorted(failed):
+            print basename,
+
+    if (len(badFiles) > 0):
+        print '-----------------------'
+        print 'The following files are not done yet or require resubmission, please check LSF output:'
+        for file in badFiles:
+            print file,
+
+if __name__ == "__main__":
+    sys.exit(main())
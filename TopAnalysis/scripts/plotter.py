@@ -7,6 +7,91 @@ from collections import OrderedDict
 from TopLJets2015.TopAnalysis.Plot import *
 
 
+def getPlotGroup(name):
+    """plots are grouped by the first token of their name (usually the category)"""
+    return name.split('_')[0]
+
+
+def isSelected(key,onlyList,strictOnly):
+    """filter plots using a selection list"""
+    keep=False if len(onlyList)>0 else True
+    for pname in onlyList:
+        if strictOnly and pname!=key: continue
+        if not strictOnly and not pname in key: continue
+        keep=True
+        break
+    return keep
+
+
+def getInputIndex(url):
+    """
+    returns the list of (name,class) of the objects in an input file without reading them
+    the list is cached in a json file in a .plotterindex sub-directory and rebuilt if the file is modified
+    returns None if the file can't be opened
+    """
+
+    indexUrl=os.path.join(os.path.dirname(url),'.plotterindex',os.path.basename(url)+'.json')
+    try:
+        mtime=os.path.getmtime(url)
+    except OSError:
+        mtime=None
+
+    if mtime is not None:
+        try:
+            with open(indexUrl,'r') as cache:
+                index=json.load(cache)
+            if index['mtime']==mtime and index['size']==os.path.getsize(url):
+                return index['keys']
+        except (IOError,ValueError,KeyError):
+            pass
+
+    fIn=ROOT.TFile.Open(url)
+    if not fIn : return None
+    keys=[(tkey.GetName(),tkey.GetClassName()) for tkey in fIn.GetListOfKeys()]
+    fIn.Close()
+
+    if mtime is not None:
+        try:
+            if not os.path.isdir(os.path.dirname(indexUrl)): os.makedirs(os.path.dirname(indexUrl))
+            with open(indexUrl,'w') as cache:
+                json.dump({'mtime':mtime,'size':os.path.getsize(url),'keys':keys},cache)
+        except (IOError,OSError):
+            pass
+
+    return keys
+
+
+def canRenderInWorker(plot):
+    """only plots made of 1D histograms (no profiles) can be converted to plain contents"""
+    if plot.normUncGr or plot.relShapeGr: return False
+    for h in plot.mc.values()+plot.mcsyst.values()+plot.spimpose.values()+[plot.dataH]:
+        if h is None: continue
+        if not h.InheritsFrom('TH1') or h.InheritsFrom('TH2') or h.InheritsFrom('TProfile'): return False
+    return True
+
+
+def renderPlotsTask(args):
+    """renders plots in a worker process: returns their final state or writes them to outUrl, if given"""
+
+    states,outDir,lumis,noStack,saveTeX,outUrl=args
+    ROOT.gStyle.SetOptTitle(0)
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.gROOT.SetBatch(True)
+
+    writer=PlotWriter(outUrl) if outUrl else None
+    finalStates=[]
+    for state,lumi in zip(states,lumis):
+        plot=Plot.fromState(state)
+        plot.show(outDir=outDir,lumi=lumi,noStack=noStack,saveTeX=saveTeX)
+        if writer:
+            writer.write(plot)
+        else:
+            finalStates.append(plot.getState())
+        plot.reset()
+    if writer: writer.close()
+    return finalStates
+
+
 """
 steer the script
 """
@@ -34,6 +119,8 @@ def main():
     parser.add_option(      '--ratioRange',  dest='ratioRange' , help='ratio range',                    default="0.7,1.3",         type='string')
     parser.add_option(      '--onlyData',    dest='onlyData' ,   help='only plots containing data',     default=False,             action='store_true')
     parser.add_option(      '--saveTeX',     dest='saveTeX' ,    help='save as tex file as well',       default=False,             action='store_true')
+    parser.add_option(      '--jobs',        dest='jobs',        help='number of processes used to render the plots', default=1,     type=int)
+    parser.add_option(      '--splitOutput', dest='splitOutput', help='write one summary ROOT file per plot group (first token of the plot name)', default=False, action='store_true')
     parser.add_option(      '--rebin',       dest='rebin',       help='rebin factor',                   default=1,                 type=int)
     parser.add_option('-l', '--lumi',        dest='lumi' ,       help='lumi to print out, if == 1 draw normalized',              default=12900,              type=float)
     parser.add_option(      '--lumiSpecs',   dest='lumiSpecs',   help='lumi specifications for some channels [tag:lumi,tag2:lumi2,...]', default=None,       type=str)
@@ -138,8 +225,20 @@ def main():
                 for flav in [(1,sample[3]+'+l'),(4,sample[3]+'+c'),(5,sample[3]+'+b',sample[4])]:
                     subProcs.append(('%d_%s'%(flav[0],tag),flav[1],sample[4]+3*len(subProcs)))
             for sp in subProcs:
-                print '%s/%s.root' % ( opt.inDir, sp[0]) 
-                fIn=ROOT.TFile.Open('%s/%s.root' % ( opt.inDir, sp[0]) )
+                inUrl='%s/%s.root' % ( opt.inDir, sp[0])
+                print inUrl
+
+                #select the objects to read from the index (TH2 systematics are only used for ttbar)
+                index=getInputIndex(inUrl)
+                if index is None : continue
+                selKeys=[]
+                for key,cls in index:
+                    if not isSelected(key,onlyList,opt.strictOnly) : continue
+                    if key[-5:]=='_syst' and sample[3]!='t#bar{t}' and ROOT.TClass.GetClass(str(cls)).InheritsFrom('TH2') : continue
+                    selKeys.append(key)
+                if len(selKeys)==0 : continue
+
+                fIn=ROOT.TFile.Open(inUrl)
                 if not fIn : continue
 
                 #fix pileup weighting normalization
@@ -160,35 +259,21 @@ def main():
                         except:
                             print 'Check pu weight control histo',opt.puNormSF,'for',sp[0]
 
-                for tkey in fIn.GetListOfKeys():
+                for key in selKeys:
                     keyIsSyst=False
                     try:
-                        key=tkey.GetName()
-
-                        #filter plots using a selection list
-                        keep=False if len(onlyList)>0 else True
-                        for pname in onlyList:
-                            if opt.strictOnly and pname!=key: continue
-                            if not opt.strictOnly and not pname in key: continue
-                            keep=True
-                            break
-                        if not keep: continue
                         histos = []
                         obj=fIn.Get(key)
                         if obj.InheritsFrom('TH2'):
                             if key[-5:]=='_syst':
                                 if sample[3]=='t#bar{t}':
+                                    #the weights (Y bins) are added at once as a matrix of systematic variations
+                                    #(NaN bins are reset before the histogram is scaled or rebinned)
                                     keyIsSyst=True
                                     key = key[:-5]
-                                    for ybin in xrange(1,obj.GetNbinsY()+1):
-                                        for xbin in xrange(0,obj.GetNbinsX()+2):
-                                            if math.isnan(obj.GetBinContent(xbin, ybin)):
-                                                obj.SetBinContent(xbin, ybin, 0)
-                                                obj.SetBinError(xbin, ybin, 0)
-                                        weighthist = obj.ProjectionX('_px'+str(ybin), ybin, ybin)
-                                        weighthist.SetTitle(sp[1]+' weight '+str(ybin))                                  
-                                        weighthist.Draw()
-                                        if (weighthist.Integral() > 0): histos.append(weighthist)
+                                    resetNaNBins(obj)
+                                    histos.append(obj)
+                                    histos[-1].SetTitle(sp[1])
                                 else:
                                     continue
                             else:
@@ -229,7 +314,9 @@ def main():
                                     print xsec
              
                             #rebin if needed
-                            if opt.rebin>1:  hist.Rebin(opt.rebin)
+                            if opt.rebin>1:
+                                if keyIsSyst and hist.InheritsFrom('TH2') : hist.RebinX(opt.rebin)
+                                else                                      : hist.Rebin(opt.rebin)
 
                             #create new plot if needed
                             if not key in plots : 
@@ -257,6 +344,15 @@ def main():
     else:                outDir = opt.outDir
     os.system('mkdir -p %s' % outDir)
     os.system('rm %s/%s'%(outDir,opt.outName))
+    writer=PlotWriter('%s/../%s'%(outDir,opt.outName),groupBy=getPlotGroup if opt.splitOutput else None)
+
+    #the per-group summary files are opened in update mode, remove the ones left by previous runs
+    if opt.splitOutput:
+        for group in set([getPlotGroup(p) for p in plots]):
+            url=writer.getFileName(group)
+            if os.path.isfile(url): os.remove(url)
+
+    toRender,toWrite=[],[]
     for p in plots:
         plots[p].mcUnc=opt.mcUnc
         if opt.saveLog    : plots[p].savelog=True
@@ -271,9 +367,42 @@ def main():
 
         #continue
         if opt.normToData: plots[p].normToData()
+        if opt.jobs>1 and not skipPlot and canRenderInWorker(plots[p]):
+            toRender.append( (p,lumi) )
+        else:
+            toWrite.append( (p,lumi,skipPlot) )
+
+    #render in parallel: the plots are sent as histogram contents and either sent back to be
+    #written to the summary file or, if it is split, written by the worker handling the plot group
+    if len(toRender)>0:
+        import multiprocessing as MP
+        pool = MP.Pool(opt.jobs)
+        if opt.splitOutput:
+            groups=OrderedDict()
+            for p,lumi in toRender:
+                groups.setdefault(getPlotGroup(p),[]).append( (p,lumi) )
+            tasks=[]
+            for group in groups:
+                tasks.append( ([plots[p].getState() for p,_ in groups[group]],
+                               outDir,[lumi for _,lumi in groups[group]],opt.noStack,opt.saveTeX,writer.getFileName(group)) )
+                for p,_ in groups[group]: plots[p].reset()
+            pool.map(renderPlotsTask,tasks)
+        else:
+            tasks=[([plots[p].getState()],outDir,[lumi],opt.noStack,opt.saveTeX,None) for p,lumi in toRender]
+            for (p,_),states in zip(toRender,pool.imap(renderPlotsTask,tasks)):
+                plots[p].reset()
+                rendered=Plot.fromState(states[0])
+                if rendered.dataH: rendered.finalize()
+                writer.write(rendered)
+                rendered.reset()
+        pool.close()
+        pool.join()
+
+    for p,lumi,skipPlot in toWrite:
         if not skipPlot: plots[p].show(outDir=outDir,lumi=lumi,noStack=opt.noStack,saveTeX=opt.saveTeX)
-        plots[p].appendTo('%s/../%s'%(outDir,opt.outName))
+        writer.write(plots[p])
         plots[p].reset()
+    writer.close()
 
     print '-'*50
     print 'Plots and summary ROOT file can be found in %s' % outDir
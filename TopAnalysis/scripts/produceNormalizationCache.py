@@ -3,8 +3,122 @@
 import optparse
 import os,sys
 import math
+import json
 import ROOT
-from subprocess import Popen, PIPE
+from array import array
+from TopLJets2015.TopAnalysis.storeTools import listDirectory
+
+STATEDIR='normCacheState'
+
+"""
+converts an histogram to a dict of lists which can be summed and exchanged between processes
+"""
+def histoToSums(h,labelH=None):
+    nbins=h.GetNbinsX()
+    sums={'edges'    : [h.GetXaxis().GetBinLowEdge(xbin) for xbin in xrange(1,nbins+2)],
+          'contents' : [h.GetBinContent(xbin) for xbin in xrange(0,nbins+2)],
+          'sumw2'    : [h.GetBinError(xbin)**2 for xbin in xrange(0,nbins+2)],
+          'labels'   : [h.GetXaxis().GetBinLabel(xbin) for xbin in xrange(1,nbins+1)]}
+    if labelH:
+        nlabels=labelH.GetNbinsX()
+        sums['labels']=[labelH.GetXaxis().GetBinLabel(xbin) if xbin<=nlabels else '' for xbin in xrange(1,nbins+1)]
+    return sums
+
+"""
+converts back the sums to an histogram
+"""
+def sumsToHisto(name,sums):
+    h=ROOT.TH1D(name,name,len(sums['edges'])-1,array('d',sums['edges']))
+    h.SetDirectory(0)
+    for xbin in xrange(0,len(sums['contents'])):
+        h.SetBinContent(xbin,sums['contents'][xbin])
+        h.SetBinError(xbin,math.sqrt(sums['sumw2'][xbin]))
+    for xbin,label in enumerate(sums['labels']):
+        if label : h.GetXaxis().SetBinLabel(xbin+1,label)
+    return h
+
+"""
+adds two partial sums (the labels of the last one are kept, as they are taken from the last file read)
+"""
+def addSums(a,b):
+    if a is None : return b
+    if b is None : return a
+    if len(a['contents'])!=len(b['contents']):
+        print '[Warning] inconsistent binning found, ignoring partial sum'
+        return a
+    return {'edges'    : a['edges'],
+            'contents' : [x+y for x,y in zip(a['contents'],b['contents'])],
+            'sumw2'    : [x+y for x,y in zip(a['sumw2'],b['sumw2'])],
+            'labels'   : b['labels'] if any(b['labels']) else a['labels']}
+
+"""
+reduces a list of partial sums pairwise (as a binary tree) to keep the precision for large number of files
+"""
+def reduceSums(parts):
+    parts=[x for x in parts if x is not None]
+    if len(parts)==0: return None
+    while len(parts)>1:
+        parts=[addSums(parts[i],parts[i+1]) if i+1<len(parts) else parts[i] for i in xrange(0,len(parts),2)]
+    return parts[0]
+
+"""
+reads the generator level weights and pileup distribution from a file (to be used in the pool)
+returns (sample, url, mtime, weight sums, pileup sums), the sums are None in case of failure
+"""
+def readFileSums(args):
+
+    sample,url,mtime,HiForest=args
+    wgtSums,puSums=None,None
+    try:
+        fIn=ROOT.TFile.Open(url)
+        if not HiForest:
+            try:
+                labelH=fIn.Get('analysis/generator_initrwgt')
+                px=fIn.Get('analysis/fidcounter').ProjectionX('px',1,1)
+                wgtSums=histoToSums(px,labelH)
+                px.Delete()
+                puSums=histoToSums(fIn.Get('analysis/putrue'))
+            except:
+                print 'Check %s probably corrupted?' % url
+                wgtSums,puSums=None,None
+        else:
+            wgtCounter=ROOT.TH1F('genwgts','genwgts',1500,0,1500)
+            wgtCounter.SetDirectory(0)
+            hiTree=fIn.Get('hiEvtAnalyzer/HiTree')
+            for i in xrange(0,hiTree.GetEntriesFast()):
+                hiTree.GetEntry(i)
+                try:
+                    ttbar_w=getattr(hiTree,'ttbar_w')
+                    for ibin in xrange(0,ttbar_w.size()):
+                        wgtCounter.Fill(ibin,ttbar_w[ibin])
+                    if ttbar_w.size()==0: raise ValueError('simple count required')
+                except:
+                    wgtCounter.Fill(0,1)
+            wgtSums=histoToSums(wgtCounter)
+            wgtCounter.Delete()
+        fIn.Close()
+    except:
+        print 'Failed to get weights for',url
+        wgtSums,puSums=None,None
+
+    return sample,url,mtime,wgtSums,puSums
+
+"""
+reads the raw sums and the list of files (with their modification times) used to build an existing cache
+"""
+def readCacheState(url):
+    state,processed={},{}
+    if not os.path.isfile(url): return state,processed
+    fIn=ROOT.TFile.Open(url)
+    stateDir=fIn.Get(STATEDIR)
+    if stateDir:
+        processed=dict([(str(s),dict([(str(f),m) for f,m in v.items()])) for s,v in json.loads(stateDir.Get('processed').GetTitle()).items()])
+        for sample in processed:
+            wgtH,puH=stateDir.Get(sample),stateDir.Get(sample+'_pu')
+            state[sample]=(histoToSums(wgtH) if wgtH else None,
+                           histoToSums(puH) if puH else None)
+    fIn.Close()
+    return state,processed
 
 """
 steer the script
@@ -16,84 +130,73 @@ def main():
     parser = optparse.OptionParser(usage)
     parser.add_option('-i', '--inDir',       dest='inDir',       help='input directory with files',   default='/store/cmst3/user/psilva/LJets2015/5736a2c',        type='string')
     parser.add_option(      '--HiForest',    dest='HiForest',    help='flag if these are HiForest',   default=False, action='store_true')
-    parser.add_option(      '--update',      dest='update',      help='update current weight cache',   default=False, action='store_true')
-    #parser.add_option(      '--mount',       dest='mount',       help='mount eos locally',   default=False, action='store_true')
+    parser.add_option(      '--update',      dest='update',      help='update current weight cache, only new or modified files are read',   default=False, action='store_true')
+    parser.add_option('-j', '--jobs',        dest='jobs',        help='number of files read in parallel [%default]',   default=8, type=int)
     parser.add_option('-o', '--output',      dest='cache',       help='output file',                  default='data/era2016/genweights.root',                      type='string')
     (opt, args) = parser.parse_args()
 
     baseEOS='root://eoscms' #/eos/cms/'
-    #eos_cmd = '/afs/cern.ch/project/eos/installation/0.3.15/bin/eos.select'
-    #if opt.mount:
-    #    baseEOS='eos/cms'
-    #    Popen([eos_cmd, ' -b fuse mount', 'eos'],stdout=PIPE).communicate()
 
-    #loop over samples available
+    #raw sums and files used in the current cache
+    state,processed={},{}
+    if opt.update:
+        state,processed=readCacheState(opt.cache)
+
+    #decide which files need to be read for each sample
+    tasks=[]
+    newProcessed={}
+    for sample,isDir,_,_ in listDirectory('/eos/cms/%s' % opt.inDir):
+        if not isDir : continue
+        files=dict([(f,mtime) for f,fIsDir,_,mtime in listDirectory('/eos/cms/%s/%s' % (opt.inDir,sample)) if not fIsDir])
+        newProcessed[sample]=files
+
+        #if a file was removed or modified since the last time the sample has to be re-read
+        toRead=files.keys()
+        if sample in processed and sample in state:
+            old=processed[sample]
+            if all([f in files and files[f]==old[f] for f in old]):
+                toRead=[f for f in files if not f in old]
+            else:
+                print sample,'has removed or modified files, will be fully re-read'
+                del state[sample]
+        for f in sorted(toRead):
+            tasks.append( (sample,'%s/%s/%s/%s' % (baseEOS,opt.inDir,sample,f),files[f],opt.HiForest) )
+    print 'Reading %d files in %d parallel jobs'%(len(tasks),opt.jobs)
+
+    #read the files concurrently and collect the partial sums per sample
+    parts={}
+    import multiprocessing as MP
+    pool = MP.Pool(opt.jobs)
+    for sample,url,mtime,wgtSums,puSums in pool.imap_unordered(readFileSums,tasks):
+        if wgtSums is None:
+            newProcessed[sample].pop(os.path.basename(url),None)
+            continue
+        parts.setdefault(sample,([],[]))
+        parts[sample][0].append(wgtSums)
+        parts[sample][1].append(puSums)
+    pool.close()
+    pool.join()
+
+    #reduce the partial sums and add them to the previous ones
     genweights={}
     puprofile={}
-    for sample in os.listdir('/eos/cms/%s' % opt.inDir):
-
-        #sum weight generator level weights
-        wgtCounter=None
-        putrue=None
-        labelH=None
-
-        for f in os.listdir('/eos/cms/%s/%s' % (opt.inDir,sample ) ):
-            
-            try:
-                fIn=ROOT.TFile.Open('%s/%s/%s/%s' % (baseEOS,opt.inDir,sample,f ) )
-               # if not fIn:
-                 #   print "Wanring!!! Can't open chunk file:", f, " skipping this file!"
-                  #  continue
-                if not opt.HiForest:
-                    if wgtCounter is None:
-                        try:
-                            wgtCounter=fIn.Get('analysis/fidcounter').ProjectionX('genwgts',1,1)
-                            wgtCounter.SetDirectory(0)
-                            wgtCounter.Reset('ICE')
-                            
-                            putrue=fIn.Get('analysis/putrue').Clone()
-                            putrue.SetDirectory(0)
-                            putrue.Reset('ICE')                            
-
-                        except:
-                            print 'Check %s/%s/%s/%s probably corrupted?' % (baseEOS,opt.inDir,sample,f )
-                            continue
-
-                    
-                    labelH=fIn.Get('analysis/generator_initrwgt')
-                    if labelH : labelH.SetDirectory(0)                             
-                    try:
-                        px=fIn.Get('analysis/fidcounter').ProjectionX('px',1,1)
-                        wgtCounter.Add(px)
-                        px.Delete()
-                        putrue.Add( fIn.Get('analysis/putrue') )
-                    except:
-                        print 'Check eos/cms/%s/%s/%s probably corrupted?' % (opt.inDir,sample,f )
-                        continue
-                else:
-                    if wgtCounter is None:
-                        wgtCounter=ROOT.TH1F('genwgts','genwgts',1500,0,1500)
-                        wgtCounter.SetDirectory(0)
-                    hiTree=fIn.Get('hiEvtAnalyzer/HiTree')
-                    for i in xrange(0,hiTree.GetEntriesFast()):
-                        hiTree.GetEntry(i)
-                        try:
-                            ttbar_w=getattr(hiTree,'ttbar_w')
-                            for ibin in xrange(0,ttbar_w.size()):
-                                wgtCounter.Fill(ibin,ttbar_w[ibin])
-                            if ttbar_w.size()==0: raise ValueError('simple count required')
-                        except:
-                            wgtCounter.Fill(0,1)
-                fIn.Close()
-            except:
-                print 'Failed to get weights for','%s/%s/%s/%s' % (baseEOS,opt.inDir,sample,f )
-
-        if wgtCounter is None: continue
-        if labelH:
-            for xbin in range(1,wgtCounter.GetNbinsX()+1):
-                label=labelH.GetXaxis().GetBinLabel(xbin)
-                for tkn in ['<','>',' ','\"','/','weight','=','\n']: label=label.replace(tkn,'')
-                wgtCounter.GetXaxis().SetBinLabel(xbin,label)
+    rawSums={}
+    for sample in newProcessed:
+        wgtParts,puParts=parts.get(sample,([],[]))
+        if sample in state:
+            wgtParts=[state[sample][0]]+wgtParts
+            puParts=[state[sample][1]]+puParts
+        wgtSums=reduceSums(wgtParts)
+        if wgtSums is None: continue
+        puSums=reduceSums(puParts)
+        rawSums[sample]=(wgtSums,puSums)
+
+        wgtCounter=sumsToHisto('genwgts',wgtSums)
+        for xbin in range(1,wgtCounter.GetNbinsX()+1):
+            label=wgtCounter.GetXaxis().GetBinLabel(xbin)
+            if not label : continue
+            for tkn in ['<','>',' ','\"','/','weight','=','\n']: label=label.replace(tkn,'')
+            wgtCounter.GetXaxis().SetBinLabel(xbin,label)
 
         #invert to set normalization
         print sample,' initial sum of weights=',wgtCounter.GetBinContent(1)
@@ -103,32 +206,38 @@ def main():
             else:                         val=1./val
             wgtCounter.SetBinContent(xbin,val)
             wgtCounter.SetBinError(xbin,0.)
-            
+
         #normalize pudistribution
-        totalEvts=putrue.Integral(0,putrue.GetNbinsX()+1)
+        putrue=sumsToHisto('putrue',puSums) if puSums else None
+        totalEvts=putrue.Integral(0,putrue.GetNbinsX()+1) if putrue else 0
         if totalEvts>0: putrue.Scale(1./totalEvts)
 
         if wgtCounter.GetBinContent(1)==0 and totalEvts>0:
             print '[Warning] fidcounter seems to have the countings at 0'
             print 'Trying to recover from putrue integral=',totalEvts
             wgtCounter.SetBinContent(1,1./totalEvts)
-       
+
         genweights[sample]=wgtCounter
         puprofile[sample]=putrue
 
-    #dump to ROOT file    
+    #dump to ROOT file, the raw sums and files read are kept to allow incremental updates
     cachefile=ROOT.TFile.Open(opt.cache,'UPDATE' if opt.update else 'RECREATE')
     for sample in genweights:
         genweights[sample].SetDirectory(cachefile)
-        genweights[sample].Write(sample)
-        puprofile[sample].SetDirectory(cachefile)
-        puprofile[sample].Write(sample+'_pu')
+        genweights[sample].Write(sample,ROOT.TObject.kOverwrite)
+        if puprofile[sample]:
+            puprofile[sample].SetDirectory(cachefile)
+            puprofile[sample].Write(sample+'_pu',ROOT.TObject.kOverwrite)
+    stateDir=cachefile.Get(STATEDIR) or cachefile.mkdir(STATEDIR)
+    stateDir.cd()
+    for sample,(wgtSums,puSums) in rawSums.items():
+        sumsToHisto(sample,wgtSums).Write(sample,ROOT.TObject.kOverwrite)
+        if puSums: sumsToHisto(sample+'_pu',puSums).Write(sample+'_pu',ROOT.TObject.kOverwrite)
+        processed[sample]=newProcessed[sample]
+    ROOT.TNamed('processed',json.dumps(processed)).Write('processed',ROOT.TObject.kOverwrite)
     cachefile.Close()
     print 'Produced normalization cache @ %s'%opt.cache
 
-    #if opt.mount:
-    #    Popen([eos_cmd, ' -b fuse umount', 'eos'],stdout=PIPE).communicate()
-
     #all done here
     exit(0)
 
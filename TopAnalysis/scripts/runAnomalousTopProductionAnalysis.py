@@ -9,6 +9,8 @@ import array
 from TopLJets2015.TopAnalysis.storeTools import getEOSlslist
 from TopLJets2015.TopAnalysis.nuSolutions import *
 
+SOLVERBATCH=5000
+
 """
 a dummy converter
 """
@@ -50,6 +52,87 @@ def topRadiusFilter(tree,filtArgs):
     return filtArgs[0].GetBinContent(xbin)
 
 
+"""
+solves the neutrino kinematics for a list of selected events at once (for both b-lepton assignments)
+and fills the ntuple and the histograms
+"""
+def fillSolvedEvents(selEvents,lVec,ntuple,observablesH):
+
+    if len(selEvents)==0: return
+
+    def toArray(p4list):
+        return numpy.array([[p4.Px(),p4.Py(),p4.Pz(),p4.E()] for p4 in p4list])
+    b1  = toArray([ev[2][0] for ev in selEvents])
+    b2  = toArray([ev[2][1] for ev in selEvents])
+    l1  = toArray([ev[3][0] for ev in selEvents])
+    l2  = toArray([ev[3][1] for ev in selEvents])
+    met = numpy.array([[ev[5],ev[6]] for ev in selEvents])
+
+    #try to solve the kinematics (need to swap bl assignments)
+    assignments=[ doubleNeutrinoSolutionsBatch( (b1,b2), (l1,l2), met ),
+                  doubleNeutrinoSolutionsBatch( (b1,b2), (l2,l1), met ) ]
+    nunu_s=[sols.nunu_s for sols in assignments]
+
+    for iev,(evcat,evWeight,bjets,leptons,otherjets,metx,mety,met_pt,genTops) in enumerate(selEvents):
+
+        allSols=[]
+        for k,sols in enumerate(assignments):
+            lep,lep_ = (leptons[0],leptons[1]) if k==0 else (leptons[1],leptons[0])
+            for isol in xrange(0,sols.mask.shape[1]):
+                if not sols.mask[iev,isol] : continue
+                top  = bjets[0]+lep +convertToPtEtaPhiM(lVec,nunu_s[k][iev,isol,0],0.)
+                top_ = bjets[1]+lep_+convertToPtEtaPhiM(lVec,nunu_s[k][iev,isol,1],0.)
+                allSols.append( (k,top,top_) )
+
+        #sort solutions by increasing m(ttbar)
+        if len(allSols)==0: continue
+        allSols=sorted(allSols, key=lambda sol: (sol[1]+sol[2]).mass() )        
+
+        values = [ bjets[0].Pt(), bjets[0].Eta(),     bjets[0].Phi(),
+                   bjets[1].Pt(), bjets[1].Eta(),     bjets[1].Phi(),
+                   leptons[0].Pt(), leptons[0].Eta(), leptons[0].Phi(),
+                   leptons[1].Pt(), leptons[1].Eta(), leptons[1].Phi(),
+                   metx,mety,
+                   len(otherjets)+len(bjets),
+                   (allSols[0][1]+allSols[0][2]).pt() ]
+        if len(allSols)>1 :
+            values += [ (allSols[1][1]+allSols[1][2]).pt() ]
+        else :
+            values += [ -1 ]
+        values += [ (genTops[0]+genTops[1]).pt() ]
+
+        ntuple.Fill(array.array("f",values))
+
+        #lowest mttbar solution
+        l1idx=0 if allSols[0][0]==0 else 1
+        l2idx=1 if allSols[0][0]==0 else 0
+ 
+        #setup the Lorentz transformations to the top/anti-top rest frames
+        topBoost, top_Boost = allSols[0][1].BoostToCM(), allSols[0][2].BoostToCM()
+
+        #measure b-jet angles
+        cosb1 = ROOT.TMath.Cos( ROOT.Math.VectorUtil.Angle( ROOT.Math.VectorUtil.boost(bjets[0],topBoost), allSols[0][1] ) )
+        cosb2 = ROOT.TMath.Cos( ROOT.Math.VectorUtil.Angle( ROOT.Math.VectorUtil.boost(bjets[1],top_Boost), allSols[0][2] ) )
+        observablesH['dphibb_'+evcat].Fill(ROOT.TMath.Abs(ROOT.Math.VectorUtil.DeltaPhi(bjets[0],bjets[1])),evWeight)
+        observablesH['cosbstar_'+evcat].Fill(cosb1,evWeight)
+        observablesH['cosbstar_'+evcat].Fill(cosb2,evWeight)
+        observablesH['cosbstarprod_'+evcat].Fill(cosb1*cosb2,evWeight)
+
+        #measure leptonic angles
+        cosl1 = ROOT.TMath.Cos( ROOT.Math.VectorUtil.Angle( ROOT.Math.VectorUtil.boost(leptons[l1idx],topBoost), allSols[0][1] ) )
+        cosl2 = ROOT.TMath.Cos( ROOT.Math.VectorUtil.Angle( ROOT.Math.VectorUtil.boost(leptons[l2idx],top_Boost), allSols[0][2] ) )
+        observablesH['dphill_'+evcat].Fill(ROOT.TMath.Abs(ROOT.Math.VectorUtil.DeltaPhi(leptons[l1idx],leptons[l2idx])),evWeight)
+        observablesH['coslstar_'+evcat].Fill(cosl1,evWeight)
+        observablesH['coslstar_'+evcat].Fill(cosl2,evWeight)
+        observablesH['coslstarprod_'+evcat].Fill(cosl1*cosl2,evWeight)
+
+        if len(otherjets)>=2:
+            observablesH['dphijj_'+evcat].Fill(ROOT.Math.VectorUtil.DeltaPhi(otherjets[0],otherjets[1]),evWeight)
+     
+        #other control variables
+        observablesH['ht_'+evcat].Fill(bjets[0].pt()+bjets[1].pt()+leptons[0].pt()+leptons[1].pt()+met_pt,evWeight)
+
+
 """
 Analysis loop
 """
@@ -114,6 +197,7 @@ def runAnomalousTopProductionAnalysis(fileName,outFileName,filterName):
 
     #loop over events in the tree and fill histos
     totalEntries=tree.GetEntries()
+    selEvents=[]
     lVec = ROOT.Math.LorentzVector(ROOT.Math.PtEtaPhiM4D('double')) 
     for i in xrange(0,totalEntries):
 
@@ -152,33 +236,6 @@ def runAnomalousTopProductionAnalysis(fileName,outFileName,filterName):
         #met
         metx,mety=tree.met_pt*ROOT.TMath.Cos(tree.met_phi),tree.met_pt*ROOT.TMath.Sin(tree.met_phi)
 
-        #try to solve the kinematics (need to swap bl assignments)
-        allSols=[]
-        try:
-            sols=doubleNeutrinoSolutions( (bjets[0],   bjets[1]), 
-                                          (leptons[0], leptons[1]),
-                                          (metx,mety) )
-            for isol in xrange(0,len(sols.nunu_s)):               
-                top  = bjets[0]+leptons[0]+convertToPtEtaPhiM(lVec,sols.nunu_s[isol][0],0.)
-                top_ = bjets[1]+leptons[1]+convertToPtEtaPhiM(lVec,sols.nunu_s[isol][1],0.)
-                allSols.append( (0,top,top_) )
-        except numpy.linalg.linalg.LinAlgError:
-            pass        
-        try:
-            sols=doubleNeutrinoSolutions( (bjets[0],   bjets[1]), 
-                                          (leptons[1], leptons[0]),
-                                          (metx,mety) )
-            for isol in xrange(0,len(sols.nunu_s)):
-                top  = bjets[0]+leptons[1]+convertToPtEtaPhiM(lVec,sols.nunu_s[isol][0],0.)
-                top_ = bjets[1]+leptons[0]+convertToPtEtaPhiM(lVec,sols.nunu_s[isol][1],0.)
-                allSols.append( (1,top,top_) )
-        except numpy.linalg.linalg.LinAlgError :
-            pass
-
-        #sort solutions by increasing m(ttbar)
-        if len(allSols)==0: continue
-        allSols=sorted(allSols, key=lambda sol: (sol[1]+sol[2]).mass() )        
-
         #mc truth
         genTops=[]
         for i in xrange(0,tree.nt):
@@ -186,49 +243,13 @@ def runAnomalousTopProductionAnalysis(fileName,outFileName,filterName):
             if abs(tree.t_id[i])!=6 : continue
             genTops.append(p4)
 
-        values = [ bjets[0].Pt(), bjets[0].Eta(),     bjets[0].Phi(),
-                   bjets[1].Pt(), bjets[1].Eta(),     bjets[1].Phi(),
-                   leptons[0].Pt(), leptons[0].Eta(), leptons[0].Phi(),
-                   leptons[1].Pt(), leptons[1].Eta(), leptons[1].Phi(),
-                   metx,mety,
-                   len(otherjets)+len(bjets),
-                   (allSols[0][1]+allSols[0][2]).pt() ]
-        if len(allSols)>1 :
-            values += [ (allSols[1][1]+allSols[1][2]).pt() ]
-        else :
-            values += [ -1 ]
-        values += [ (genTops[0]+genTops[1]).pt() ]
-
-        ntuple.Fill(array.array("f",values))
+        #the kinematics is solved for blocks of events at once
+        selEvents.append( (evcat,evWeight,bjets,leptons,otherjets,metx,mety,tree.met_pt,genTops) )
+        if len(selEvents)>=SOLVERBATCH:
+            fillSolvedEvents(selEvents,lVec,ntuple,observablesH)
+            selEvents=[]
 
-        #lowest mttbar solution
-        l1idx=0 if allSols[0][0]==0 else 1
-        l2idx=1 if allSols[0][0]==0 else 0
- 
-        #setup the Lorentz transformations to the top/anti-top rest frames
-        topBoost, top_Boost = allSols[0][1].BoostToCM(), allSols[0][2].BoostToCM()
-
-        #measure b-jet angles
-        cosb1 = ROOT.TMath.Cos( ROOT.Math.VectorUtil.Angle( ROOT.Math.VectorUtil.boost(bjets[0],topBoost), allSols[0][1] ) )
-        cosb2 = ROOT.TMath.Cos( ROOT.Math.VectorUtil.Angle( ROOT.Math.VectorUtil.boost(bjets[1],top_Boost), allSols[0][2] ) )
-        observablesH['dphibb_'+evcat].Fill(ROOT.TMath.Abs(ROOT.Math.VectorUtil.DeltaPhi(bjets[0],bjets[1])),evWeight)
-        observablesH['cosbstar_'+evcat].Fill(cosb1,evWeight)
-        observablesH['cosbstar_'+evcat].Fill(cosb2,evWeight)
-        observablesH['cosbstarprod_'+evcat].Fill(cosb1*cosb2,evWeight)
-
-        #measure leptonic angles
-        cosl1 = ROOT.TMath.Cos( ROOT.Math.VectorUtil.Angle( ROOT.Math.VectorUtil.boost(leptons[l1idx],topBoost), allSols[0][1] ) )
-        cosl2 = ROOT.TMath.Cos( ROOT.Math.VectorUtil.Angle( ROOT.Math.VectorUtil.boost(leptons[l2idx],top_Boost), allSols[0][2] ) )
-        observablesH['dphill_'+evcat].Fill(ROOT.TMath.Abs(ROOT.Math.VectorUtil.DeltaPhi(leptons[l1idx],leptons[l2idx])),evWeight)
-        observablesH['coslstar_'+evcat].Fill(cosl1,evWeight)
-        observablesH['coslstar_'+evcat].Fill(cosl2,evWeight)
-        observablesH['coslstarprod_'+evcat].Fill(cosl1*cosl2,evWeight)
-
-        if len(otherjets)>=2:
-            observablesH['dphijj_'+evcat].Fill(ROOT.Math.VectorUtil.DeltaPhi(otherjets[0],otherjets[1]),evWeight)
-         
-        #other control variables
-        observablesH['ht_'+evcat].Fill(bjets[0].pt()+bjets[1].pt()+leptons[0].pt()+leptons[1].pt()+tree.met_pt,evWeight)
+    fillSolvedEvents(selEvents,lVec,ntuple,observablesH)
 
     #save results
     if filterName:
@@ -7,11 +7,78 @@ from collections import OrderedDict
 import json
 import re
 import commands
+import hashlib
+import time
 from TopLJets2015.TopAnalysis.storeTools import *
 from TopLJets2015.TopAnalysis.batchTools import *
+from TopLJets2015.TopAnalysis.splitTools import *
+from TopLJets2015.TopAnalysis.eraTools import *
 
+MANIFEST='.analysisManifest.json'
+
+"""
+Builds the command to run the analysis for a task
+"""
+def getAnalysisCommand(args):
+
+    method,inF,outF,channel,charge,flag,runSysts,systVar,era,tag,debug,CR,QCDTemp,SRfake,mvatree,genWeights,xsec=args
+    cmd='analysisWrapper --era %s --normTag %s --in %s --out %s --method %s --charge %d --channel %d --flag %d --systVar %s --genWeights %s --xsec %f'\
+        %(era, tag, inF, outF, method, charge, channel, flag, systVar,genWeights,xsec)
+    if runSysts : cmd += ' --runSysts'
+    if debug : cmd += ' --debug'
+    if mvatree : cmd += ' --mvatree'
+    if CR : cmd += ' --CR'
+    if QCDTemp : cmd += ' --QCDTemp'
+    if SRfake : cmd += ' --SRfake'
+    return cmd
+
+"""
+Identifies the build of analysisWrapper used to run the tasks (checksum of the executable)
+"""
+def getBuildId():
+    exe=commands.getstatusoutput('which analysisWrapper')[1].strip()
+    if not os.path.isfile(exe): return ''
+    md5=hashlib.md5()
+    with open(exe,'rb') as f:
+        for block in iter(lambda : f.read(1<<20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+"""
+Builds a key which changes whenever the input file, the options or the analysis build used for a task change
+if given, era is the source directory of the corrections (the one in args may be a staged copy)
+"""
+def getTaskKey(args,buildId,era=None):
+    method,inF,outF,channel,charge,flag,runSysts,systVar,taskEra,tag,debug,CR,QCDTemp,SRfake,mvatree,genWeights,xsec=args
+    if era is None: era=taskEra
+    normF=os.path.join(era,genWeights)
+    desc=[inF,getFileInfo(inF),
+          method,channel,charge,flag,runSysts,systVar,era,tag,debug,CR,QCDTemp,SRfake,mvatree,xsec,
+          genWeights,os.path.getmtime(normF) if os.path.isfile(normF) else None,
+          buildId]
+    return hashlib.md5(json.dumps(desc)).hexdigest()
+
+"""
+Returns the modification time of an output file (local or on eos), None if it doesn't exist
 """
-Wrapper to be used when run in parallel
+def getOutputMtime(outF):
+    for path in [outF,'/eos/cms/'+outF]:
+        if os.path.isfile(path): return os.path.getmtime(path)
+    return None
+
+def readManifest(url):
+    try:
+        with open(url,'r') as cache:
+            return json.load(cache)
+    except (IOError,ValueError):
+        return {}
+
+def writeManifest(url,manifest):
+    with open(url,'w') as cache:
+        json.dump(manifest,cache,indent=1,sort_keys=True)
+
+"""
+Wrapper to be used when run sequentially
 """
 def RunMethodPacked(args):
 
@@ -28,16 +95,10 @@ def RunMethodPacked(args):
     print 'Prepare the region to apply fake ratio?', SRfake
 
     try:
-        cmd='analysisWrapper --era %s --normTag %s --in %s --out %s --method %s --charge %d --channel %d --flag %d --systVar %s --genWeights %s --xsec %f'\
-            %(era, tag, inF, outF, method, charge, channel, flag, systVar,genWeights,xsec)
-        if runSysts : cmd += ' --runSysts'
-        if debug : cmd += ' --debug'
-        if mvatree : cmd += ' --mvatree'
-        if CR : cmd += ' --CR'
-        if QCDTemp : cmd += ' --QCDTemp'
-        if SRfake : cmd += ' --SRfake'
+        cmd=getAnalysisCommand(args)
         print(cmd)
-        os.system(cmd)
+        if os.system(cmd)!=0:
+            raise RuntimeError('analysisWrapper failed')
 
     except :
         print 50*'<'
@@ -69,11 +130,16 @@ def main():
     parser.add_option(      '--tag',         dest='tag',         help='normalize from this tag  [%default]',                    default=None,       type='string')
     parser.add_option('-q', '--queue',       dest='queue',       help='if not local send to batch with condor. queues are now called flavours, see http://batchdocs.web.cern.ch/batchdocs/local/submit.html#job-flavours   [%default]',     default='local',    type='string')    
     parser.add_option('-n', '--njobs',       dest='njobs',       help='# jobs to run in parallel  [%default]',                  default=0,    type='int')
+    parser.add_option(      '--retries',     dest='retries',     help='# times a failed local job is retried  [%default]',      default=1,    type='int')
+    parser.add_option(      '--taskTime',    dest='taskTime',    help='files of a sample are grouped in jobs of this expected time in seconds, 0 for one file per job (local jobs are kept in at least --njobs groups, condor jobs are capped to half the wall time of the flavour) [%default]', default=0., type=float)
+    parser.add_option(      '--throughputCache', dest='throughputCache', help='cache with the throughput measured for each sample (default: $CMSSW_BASE/.analysisThroughput.json)', default=None, type='string')
     parser.add_option(      '--dryRun',      dest='dryRun',      help='create jobs, do not submit them  [%default]',       default=False,      action='store_true')
     parser.add_option(      '--skipexisting',dest='skipexisting',help='skip jobs with existing output files  [%default]',       default=False,      action='store_true')
+    parser.add_option(      '--force',       dest='force',       help='run all jobs, even if the output is up-to-date with the inputs and options  [%default]', default=False, action='store_true')
     parser.add_option(      '--exactonly',   dest='exactonly',   help='match only exact sample tags to process  [%default]',    default=False,      action='store_true')
     parser.add_option(      '--outputonly',  dest='outputonly',  help='filter job submission for a csv list of output files  [%default]',             default=None,       type='string')
     parser.add_option(      '--farmappendix',dest='farmappendix',help='Appendix to condor FARM directory [%default]',             default='',       type='string')
+    parser.add_option(      '--eraCache',    dest='eraCache',    help='node-local directory where the era corrections are staged for local jobs, empty to read them in place [%default]', default=DEFAULTERACACHE, type='string')
     parser.add_option(      '--genWeights',  dest='genWeights',  help='genWeights to get the normalization from (found within data/era directory) [%default]',             default='genweights.root',       type='string')
     parser.add_option(      '--mvatree',     dest='mvatree',     help='make mva tree  [%default]',                            default=False,      action='store_true'),
     parser.add_option(      '--CR',          dest='CR',          help='provide control region for photon FR  [%default]',                            default=False,      action='store_true')
@@ -146,6 +212,15 @@ def main():
     cmsswBase=os.environ['CMSSW_BASE']
     if not cmsswBase in opt.era : opt.era=cmsswBase+'/src/TopLJets2015/TopAnalysis/data/'+opt.era
 
+    #local jobs read the corrections from a read-only copy in node-local memory (re-used while the files are unchanged)
+    eraSource=opt.era
+    if opt.queue=='local' and opt.eraCache:
+        try:
+            opt.era=stageEra(opt.era,opt.eraCache)
+            print 'Corrections staged in',opt.era
+        except (IOError,OSError) as e:
+            print 'Unable to stage corrections in %s (%s), will read them from %s'%(opt.eraCache,e,opt.era)
+
     #process tasks
     task_list = []
     processedTags=[]
@@ -204,21 +279,99 @@ def main():
                     task_list.append( (opt.method,inF,outF,opt.channel,opt.charge,opt.flag,opt.runSysts,systVar,opt.era,tag,opt.debug, opt.CR, opt.QCDTemp, opt.SRfake, opt.mvatree,opt.genWeights,xsec) )
                 if (opt.skipexisting and nexisting): print '--skipexisting: %s - skipping %d of %d tasks as files already exist'%(systVar,nexisting,len(input_list))
 
+    #skip the tasks whose output was produced with the same input, options and build
+    #(outputs are only trusted if they are more recent than the time the task was launched)
+    manifestUrl=None
+    manifest={}
+    if not '.root' in opt.output:
+        manifestUrl=os.path.join('/eos/cms'+opt.output if '/store/' in opt.output else opt.output,MANIFEST)
+        manifest=readManifest(manifestUrl)
+        buildId=getBuildId()
+        toRun=[]
+        for args in task_list:
+            key=getTaskKey(args,buildId,eraSource)
+            entry=manifest.get(args[2],None)
+            outMtime=getOutputMtime(args[2])
+            if not opt.force and entry and entry['key']==key and outMtime and outMtime>=entry['time']:
+                continue
+            manifest[args[2]]={'key':key,'time':time.time()}
+            toRun.append(args)
+        if len(toRun)<len(task_list):
+            print '%d tasks are up-to-date and will be skipped (use --force to re-run them)'%(len(task_list)-len(toRun))
+        task_list=toRun
+        writeManifest(manifestUrl,manifest)
+
+    #group the files of each sample in jobs with a similar expected running time
+    if not opt.throughputCache: opt.throughputCache='%s/.analysisThroughput.json'%cmsswBase
+    throughput=readThroughputCache(opt.throughputCache)
+    sizes=[getFileSize(args[1]) for args in task_list]
+    costs=[getExpectedTime(args[9],sizes[i],throughput) for i,args in enumerate(task_list)]
+    taskTime=getJobTimeBudget(opt.queue,opt.taskTime,opt.njobs,sum(costs))
+    samples=OrderedDict()
+    for i,args in enumerate(task_list):
+        samples.setdefault((args[9],args[7]),[]).append(i)
+    task_groups=[]
+    for idxList in samples.values():
+        for group in groupByCost([costs[i] for i in idxList],taskTime):
+            task_groups.append( sorted([idxList[i] for i in group]) )
+
     #run the analysis jobs
     if opt.queue=='local':
         print 'launching %d tasks in %d parallel jobs'%(len(task_list),opt.njobs)
         if opt.njobs == 0:
-            for args in task_list: RunMethodPacked(args)
+            failedOutputs=[args[2] for args in task_list if not RunMethodPacked(args)]
         else:
-            from multiprocessing import Pool
-            pool = Pool(opt.njobs)
-            pool.map(RunMethodPacked, task_list)
+            LocalDirectory = '%s/LOCAL%s%s'%(cmsswBase,os.path.basename(opt.output),opt.farmappendix)
+            print 'Logs of the %d local jobs are stored in %s'%(len(task_groups),LocalDirectory)
+            os.system('mkdir -p %s'%LocalDirectory)
+            tasks,markers=[],[]
+            for group in task_groups:
+                name='%s'%(os.path.splitext(os.path.basename(task_list[group[0]][2]))[0])
+
+                #the files grouped in a job are all processed even if one fails, and only the failed ones are retried
+                groupMarkers=[]
+                if len(group)==1:
+                    cmd=getAnalysisCommand(task_list[group[0]])
+                else:
+                    groupMarkers=['%s/.%s_%d.done'%(LocalDirectory,name,k) for k in xrange(len(group))]
+                    for marker in groupMarkers:
+                        if os.path.isfile(marker): os.remove(marker)
+                    cmd=getSequentialCommand([getAnalysisCommand(task_list[i]) for i in group],groupMarkers)
+                tasks.append( (name,cmd,sum([costs[i] for i in group])) )
+                markers.append(groupMarkers)
+            timings={}
+            failed=runLocalTasks(tasks,opt.njobs,LocalDirectory,maxRetries=opt.retries,timings=timings)
+            failedOutputs=[]
+            with open('%s/failedList.dat'%LocalDirectory,'w') as f:
+                for (name,_,_),group,groupMarkers in zip(tasks,task_groups,markers):
+                    if not name in failed: continue
+                    for k,i in enumerate(group):
+                        if groupMarkers and os.path.isfile(groupMarkers[k]): continue
+                        f.write('%s %s\n'%(task_list[i][1],task_list[i][2]))
+                        failedOutputs.append(task_list[i][2])
+                for groupMarkers in markers:
+                    for marker in groupMarkers:
+                        if os.path.isfile(marker): os.remove(marker)
+
+            #update the throughput measured for each sample
+            measurements={}
+            for (name,_,_),group in zip(tasks,task_groups):
+                if not name in timings: continue
+                tag=task_list[group[0]][9]
+                nbytes,seconds=measurements.get(tag,(0,0))
+                measurements[tag]=(nbytes+sum([sizes[i] for i in group]),seconds+timings[name])
+            updateThroughputCache(opt.throughputCache,measurements)
+
+        #failed tasks are not considered up-to-date
+        if manifestUrl:
+            for outF in failedOutputs: manifest.pop(outF,None)
+            writeManifest(manifestUrl,manifest)
     else:
         
         FarmDirectory = '%s/FARM%s%s'%(cmsswBase,os.path.basename(opt.output),opt.farmappendix)
         os.system('mkdir -p %s'%FarmDirectory)
         
-        print 'Preparing %d tasks to submit to the batch'%len(task_list)
+        print 'Preparing %d tasks in %d jobs to submit to the batch'%(len(task_list),len(task_groups))
         print 'Executables and condor wrapper are stored in %s'%FarmDirectory
         
         OpSysAndVer = str(os.system('cat /etc/redhat-release'))
@@ -237,11 +390,10 @@ def main():
             condor.write('requirements = (OpSysAndVer =?= "{0}")\n'.format(OpSysAndVer)) 
             condor.write('+JobFlavour = "{0}"\n'.format(opt.queue))
             jobNb=0
-            for method,inF,outF,channel,charge,flag,runSysts,systVar,era,tag,debug,CR,QCDTemp,SRfake,mvatree,genWeights,xsec in task_list:
+            for group in task_groups:
 
                 jobNb+=1
-                cfgFile='%s'%(os.path.splitext(os.path.basename(outF))[0])
-                allCfgs.append((inF,outF))
+                cfgFile='%s'%(os.path.splitext(os.path.basename(task_list[group[0]][2]))[0])
                 condor.write('cfgFile=%s\n'%cfgFile)
                 condor.write('queue 1\n')
                 
@@ -253,21 +405,28 @@ def main():
                     cfg.write('cd %s\n'%cmsswBase)
                     cfg.write('eval `scram r -sh`\n')
                     cfg.write('cd ${WORKDIR}\n')
-                    localOutF=os.path.basename(outF)
-                    runOpts='-i %s -o ${WORKDIR}/%s --charge %d --ch %d --era %s --tag %s --flag %d --method %s --systVar %s --genWeights %s --xsec %f'\
-                        %(inF, localOutF, charge, channel, era, tag, flag, method, systVar,genWeights,xsec)
-                    if runSysts : runOpts += ' --runSysts'
-                    if debug :    runOpts += ' --debug'
-                    if mvatree :  runOpts += ' --mvatree'                    
-                    if CR :       runOpts += ' --CR'
-                    if QCDTemp :  runOpts += ' --QCDTemp'
-                    if SRfake :  runOpts += ' --SRfake'
-                    cfg.write('python %s/src/TopLJets2015/TopAnalysis/scripts/runLocalAnalysis.py %s\n'%(cmsswBase,runOpts))
-                    if '/store' in outF:
-                        cfg.write('xrdcp --force ${WORKDIR}/%s root://eoscms//%s\n'%(localOutF,outF))
-                        cfg.write('rm ${WORKDIR}/%s'%localOutF)
-                    elif outF!=localOutF:
-                        cfg.write('  mv -v ${WORKDIR}/%s %s\n'%(localOutF,outF))
+
+                    #the files grouped in this job are processed sequentially
+                    for i in group:
+                        method,inF,outF,channel,charge,flag,runSysts,systVar,era,tag,debug,CR,QCDTemp,SRfake,mvatree,genWeights,xsec=task_list[i]
+                        allCfgs.append((inF,outF))
+                        localOutF=os.path.basename(outF)
+                        runOpts='-i %s -o ${WORKDIR}/%s --charge %d --ch %d --era %s --tag %s --flag %d --method %s --systVar %s --genWeights %s --xsec %f'\
+                            %(inF, localOutF, charge, channel, era, tag, flag, method, systVar,genWeights,xsec)
+                        if runSysts : runOpts += ' --runSysts'
+                        if debug :    runOpts += ' --debug'
+                        if mvatree :  runOpts += ' --mvatree'                    
+                        if CR :       runOpts += ' --CR'
+                        if QCDTemp :  runOpts += ' --QCDTemp'
+                        if SRfake :  runOpts += ' --SRfake'
+                        #single-use batch jobs read the corrections in place
+                        runOpts += " --eraCache ''"
+                        cfg.write('python %s/src/TopLJets2015/TopAnalysis/scripts/runLocalAnalysis.py %s\n'%(cmsswBase,runOpts))
+                        if '/store' in outF:
+                            cfg.write('xrdcp --force ${WORKDIR}/%s root://eoscms//%s\n'%(localOutF,outF))
+                            cfg.write('rm ${WORKDIR}/%s\n'%localOutF)
+                        elif outF!=localOutF:
+                            cfg.write('  mv -v ${WORKDIR}/%s %s\n'%(localOutF,outF))
 
                 os.system('chmod u+x %s/%s.sh'%(FarmDirectory,cfgFile))
 
@@ -0,0 +1,610 @@
+#!/usr/bin/env python
+
+import ROOT
+import os
+import pickle
+import numpy as np
+from root_numpy import tree2array
+from TopLJets2015.TopAnalysis.myProgressBar import *
+from EventMixingTool import *
+from EventSummary import EventSummary
+from MixedEventSummary import MixedEventSummary
+from runExclusiveAnalysis import VALIDLHCXANGLES,DIMUONS,EMU,DIELECTRONS,SINGLEPHOTON,MINCSI
+from runExclusiveAnalysis import isDYFile,loadMixingBank,bookAnalysisHistos
+
+#event categories in the order they are checked in the event loop
+EVCATS=['ee','em','mm','offz','a','zbias']
+
+#eras and cumulative luminosity fractions used to assign an era to simulated events
+ERAS=['2017B','2017C','2017D','2017E','2017F']
+ERACUMFRACS=[0.115,0.348,0.451,0.671,1]
+
+#branches read from the input trees
+EVENTBRANCHES=['run','lumi','event','evcat','evwgt','isZ','isA','isSS','hasATrigger','hasZBTrigger','beamXangle',
+               'l1pt','l1eta','l1phi','ml1','l2pt','l2eta','l2phi','ml2',
+               'bosonpt','bosoneta','bosonphi','mboson',
+               'nvtx','nchPV','rho','met_pt','met_phi','metfilters',
+               'nj','j1pt','j1eta','j1phi','j1m','j2pt','j2eta','j2phi','j2m',
+               'nrawmu','rawmu_pt','rawmu_eta','rawmu_phi'] \
+               + ['PF%sSum%s'%(v,d) for v in ['Mult','Ht','Pz'] for d in ['HF','HE','EE','EB']]
+PROTONBRANCHES=['nProtons','protonCsi','isFarRPProton','isMultiRPProton','isPosRPProton']
+
+#max. number of summary entries (events x mixing tries) held in memory at once
+MAXSUMMARYROWS=200000
+
+
+def p4FromPtEtaPhiM(pt,eta,phi,m):
+
+    """returns an array of (px,py,pz,E) four-momenta, following TLorentzVector::SetPtEtaPhiM"""
+
+    pt,eta,phi,m=[np.asarray(x,dtype=np.float64) for x in [pt,eta,phi,m]]
+    px,py,pz=pt*np.cos(phi),pt*np.sin(phi),pt*np.sinh(eta)
+    p2=px**2+py**2+pz**2
+    e=np.where(m>=0, np.sqrt(p2+m**2), np.sqrt(np.maximum(p2-m**2,0.)))
+    return np.stack([px,py,pz,e],axis=-1)
+
+
+def p4Pt(p4):
+    return np.hypot(p4[...,0],p4[...,1])
+
+
+def p4M(p4):
+
+    """invariant mass with the sign convention of TLorentzVector::M for space-like vectors"""
+
+    m2=p4[...,3]**2-(p4[...,0]**2+p4[...,1]**2+p4[...,2]**2)
+    return np.where(m2<0,-np.sqrt(np.abs(m2)),np.sqrt(np.abs(m2)))
+
+
+def p4Eta(p4):
+
+    """pseudo-rapidity following TVector3::PseudoRapidity (null vectors return 0)"""
+
+    pt,pz=p4Pt(p4),p4[...,2]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        eta=np.arcsinh(pz/pt)
+    return np.where(pt>0,eta,np.sign(pz)*10e10)
+
+
+def p4Rapidity(p4):
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return 0.5*np.log((p4[...,3]+p4[...,2])/(p4[...,3]-p4[...,2]))
+
+
+def phiMpiPi(x):
+
+    """maps an angle to [-pi,pi[ as TVector2::Phi_mpi_pi"""
+
+    return x-2*np.pi*np.floor((x+np.pi)/(2*np.pi))
+
+
+def computeCosThetaStarArrays(lm,lp):
+
+    """array version of computeCosThetaStar"""
+
+    dil=lm+lp
+    mdil=p4M(dil)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        costhetaCS = np.where(dil[...,2]<0,-1.,1.)/mdil
+        costhetaCS *= (lm[...,3]+lm[...,2])*(lp[...,3]-lp[...,2]) - (lm[...,3]-lm[...,2])*(lp[...,3]+lp[...,2])
+        costhetaCS /= np.sqrt(mdil**2+p4Pt(dil)**2)
+    return costhetaCS
+
+
+def buildDiProtonArrays(csi_pos,csi_neg,sqrts=13000.):
+
+    """array version of buildDiProton"""
+
+    beamP=0.5*sqrts
+    csi_pos,csi_neg=np.asarray(csi_pos,dtype=np.float64),np.asarray(csi_neg,dtype=np.float64)
+    zero=np.zeros_like(csi_pos)
+    return np.stack([zero,zero,beamP*(csi_pos-csi_neg),beamP*(csi_pos+csi_neg)],axis=-1)
+
+
+def getRandomEras(n):
+
+    """array version of getRandomEra for background simulation, returns indices in the ERAS list"""
+
+    return np.searchsorted(ERACUMFRACS,np.random.random(n),side='left')
+
+
+def flattenJagged(col):
+
+    """flattens an object array of per-event arrays and returns the values and the event index of each value"""
+
+    counts=np.array([len(x) for x in col],dtype=np.int64)
+    if counts.sum()==0:
+        return np.zeros(0),np.zeros(0,dtype=np.int64)
+    return np.concatenate(col),np.repeat(np.arange(len(col)),counts)
+
+
+def buildProtonArrays(evIdx,side,algo,csi,nEvents):
+
+    """
+    groups proton xi's per (event, RP side, reconstruction algorithm) and sorts them by decreasing xi
+    side is 0/1 for the positive/negative arm, algo is 0/1/2 for multiRP/far/near RP (as in getTracksPerRomanPot)
+    returns the sorted xi's and the number of protons per group as a (nEvents,2,3) array
+    """
+
+    group=(np.asarray(evIdx,dtype=np.int64)*2+side)*3+algo
+    csi=np.asarray(csi,dtype=np.float64)
+    order=np.lexsort((-csi,group))
+    counts=np.bincount(group,minlength=6*nEvents).reshape(nEvents,2,3)
+    return csi[order],counts
+
+
+def getLeadingProtons(csi,counts):
+
+    """returns the highest xi of each (event, RP side, reconstruction algorithm) group, 0 if empty"""
+
+    flatCounts=counts.ravel()
+    offsets=np.cumsum(flatCounts)-flatCounts
+    lead=np.zeros(flatCounts.shape)
+    hasTk=(flatCounts>0)
+    lead[hasTk]=csi[offsets[hasTk]]
+    return lead.reshape(counts.shape)
+
+
+def getProtonsInGroup(csi,counts,side,algo):
+
+    """returns the event index and xi of all the protons of a given RP side and reconstruction algorithm"""
+
+    nEvents=counts.shape[0]
+    group=np.repeat(np.arange(6*nEvents),counts.ravel())
+    sel=(group%6==side*3+algo)
+    return group[sel]//6,csi[sel]
+
+
+def getProtonLists(csi,counts,i):
+
+    """converts back the protons of the i-th event to the lists of xi's per algorithm returned by getTracksPerRomanPot"""
+
+    flatCounts=counts.ravel()
+    offsets=np.cumsum(flatCounts)-flatCounts
+    protons=[[],[]]
+    for side in range(2):
+        for algo in range(3):
+            ig=(i*2+side)*3+algo
+            protons[side].append( csi[offsets[ig]:offsets[ig]+flatCounts[ig]].tolist() )
+    return protons
+
+
+def getTracksPerRomanPotArrays(ev,minCsi=0,evMask=None):
+
+    """array version of getTracksPerRomanPot for the reconstructed protons"""
+
+    csi,evIdx=flattenJagged(ev['protonCsi'])
+    isFar,_=flattenJagged(ev['isFarRPProton'])
+    isMulti,_=flattenJagged(ev['isMultiRPProton'])
+    isPos,_=flattenJagged(ev['isPosRPProton'])
+
+    sel=(csi>=minCsi)
+    if evMask is not None:
+        sel &= evMask[evIdx]
+    algo=np.where(isMulti,0,np.where(isFar,1,2))
+    side=np.where(isPos,0,1)
+    return buildProtonArrays(evIdx[sel],side[sel],algo[sel],csi[sel],len(ev))
+
+
+def drawMixedProtons(evMixTool,evEras,beamXangles,isData,mixEvCategs,nDraws=1):
+
+    """
+    draws nDraws mixed events for each event and returns, per mixing category, the proton arrays
+    (see buildProtonArrays) for nEvents*nDraws pseudo-events (ordered by event and then by draw)
+    the draws are made in batches for all the events sharing the same era and crossing angle
+    """
+
+    nEvents=len(beamXangles)
+    evEras=np.asarray(evEras)
+    beamXangles=np.asarray(beamXangles,dtype=np.int64)
+
+    flat={c:([],[],[],[]) for c in mixEvCategs}
+    for era in np.unique(evEras):
+        for xangle in np.unique(beamXangles[evEras==era]):
+            evIdx=np.flatnonzero((evEras==era) & (beamXangles==xangle))
+            mixed,_=evMixTool.getNewBatch(evEra=str(era),
+                                          beamXangle=int(xangle),
+                                          isData=isData,
+                                          validAngles=VALIDLHCXANGLES,
+                                          mixEvCategs=mixEvCategs,
+                                          n=len(evIdx)*nDraws)
+
+            #map each drawn group back to its pseudo-event
+            pseudoEvIdx=(evIdx[:,None]*nDraws+np.arange(nDraws)).ravel()
+            for c in mixEvCategs:
+                csi,counts=mixed[c]
+                group=np.repeat(np.arange(counts.size),counts.ravel())
+                flat[c][0].append(pseudoEvIdx[group//6])
+                flat[c][1].append((group//3)%2)
+                flat[c][2].append(group%3)
+                flat[c][3].append(csi)
+
+    mixed={}
+    for c in mixEvCategs:
+        if len(flat[c][0])==0:
+            mixed[c]=(np.zeros(0),np.zeros((nEvents*nDraws,2,3),dtype=np.int64))
+            continue
+        mixed[c]=buildProtonArrays(*([np.concatenate(x) for x in flat[c]]+[nEvents*nDraws]))
+    return mixed
+
+
+def getDiProtonCategoryArrays(counts,lead,allowPixMult):
+
+    """
+    array version of getDiProtonCategory: counts and lead are (...,2,3) arrays with the number of protons
+    and the highest xi per RP side and reconstruction algorithm
+    returns the proton category (-1 if not selected) and the xi's of the positive and negative protons
+    """
+
+    nmulti_pos, nmulti_neg = counts[...,0,0], counts[...,1,0]
+    npix_pos,   npix_neg   = counts[...,0,1], counts[...,1,1]
+    pixOK_pos = np.isin(npix_pos,allowPixMult)
+    pixOK_neg = np.isin(npix_neg,allowPixMult)
+
+    conds=[ (nmulti_pos==1) & (nmulti_neg==1),
+            (nmulti_pos==1) & (nmulti_neg==0) & pixOK_neg,
+            (nmulti_pos==0) & pixOK_pos & (nmulti_neg==1),
+            (nmulti_pos==0) & pixOK_pos & (nmulti_neg==0) & pixOK_neg ]
+    proton_cat = np.select(conds,[1,2,3,4],default=-1)
+    csi_pos    = np.select(conds,[lead[...,0,0],lead[...,0,0],lead[...,0,1],lead[...,0,1]],default=0.)
+    csi_neg    = np.select(conds,[lead[...,1,0],lead[...,1,1],lead[...,1,0],lead[...,1,1]],default=0.)
+
+    return proton_cat,csi_pos,csi_neg
+
+
+def getEventCategoryArrays(ev):
+
+    """array version of the base event selection, returns the index in EVCATS (-1 if failed) and the off-Z flag"""
+
+    evcat=ev['evcat']
+    isOffZ=(ev['mboson']>101) & ((evcat==DIELECTRONS) | (evcat==DIMUONS))
+    conds=[ (evcat==DIELECTRONS) & ev['isZ'],
+            (evcat==EMU) & ~ev['isSS'],
+            (evcat==DIMUONS) & ev['isZ'],
+            isOffZ,
+            (evcat==SINGLEPHOTON) & ev['hasATrigger'],
+            (evcat==0) & ev['hasZBTrigger'] ]
+    return np.select(conds,list(range(len(EVCATS))),default=-1),isOffZ
+
+
+def isValidRunLumiArrays(runs,lumis,runLumiList):
+
+    """array version of isValidRunLumi"""
+
+    if not runLumiList: return np.ones(len(runs),dtype=bool)
+    return ~runLumiList.mask(runs,lumis)
+
+
+def computeEventKinematics(ev):
+
+    """computes the lepton, boson and hadronic recoil kinematics of a chunk of events"""
+
+    kin={}
+    n=len(ev)
+    isDilepton=(ev['evcat']!=SINGLEPHOTON) & (ev['evcat']!=0)
+
+    #leptons (null four-vectors if not a dilepton event)
+    l1p4=p4FromPtEtaPhiM(ev['l1pt'],ev['l1eta'],ev['l1phi'],ev['ml1'])
+    l2p4=p4FromPtEtaPhiM(ev['l2pt'],ev['l2eta'],ev['l2phi'],ev['ml2'])
+    l1p4[~isDilepton]=0.
+    l2p4[~isDilepton]=0.
+    kin['acopl']=np.where(isDilepton,1.0-np.abs(phiMpiPi(ev['l1phi'].astype(np.float64)-ev['l2phi']))/np.pi,0.)
+    kin['costhetacs']=np.where(isDilepton,computeCosThetaStarArrays(l1p4,l2p4),0.)
+
+    #force ordering by pT (before they were ordered by charge to compute costhetacs)
+    swap=(p4Pt(l1p4)<p4Pt(l2p4))[:,None]
+    l1p4,l2p4=np.where(swap,l2p4,l1p4),np.where(swap,l1p4,l2p4)
+    for tag,p4 in [('l1',l1p4),('l2',l2p4)]:
+        kin[tag+'pt']=p4Pt(p4)
+        kin[tag+'eta']=p4Eta(p4)
+        kin[tag+'phi']=np.arctan2(p4[:,1],p4[:,0])
+
+    #boson
+    boson=p4FromPtEtaPhiM(ev['bosonpt'],ev['bosoneta'],ev['bosonphi'],ev['mboson'])
+    kin['boson']=boson
+    kin['bosonpt']=p4Pt(boson)
+    kin['bosonm']=p4M(boson)
+    kin['bosony']=p4Rapidity(boson)
+    kin['bosoneta']=p4Eta(boson)
+
+    #additional muons not matching the leptons
+    mupt,muIdx=flattenJagged(ev['rawmu_pt'])
+    mueta,_=flattenJagged(ev['rawmu_eta'])
+    muphi,_=flattenJagged(ev['rawmu_phi'])
+    mupt=mupt.astype(np.float64)
+    mueta=np.where(mupt>0,mueta/10.,0.)
+    muphi=phiMpiPi(np.where(mupt>0,muphi/10.,0.))
+    isExtra=np.ones(len(mupt),dtype=bool)
+    for tag in ['l1','l2']:
+        dR=np.hypot(mueta-kin[tag+'eta'][muIdx],phiMpiPi(muphi-kin[tag+'phi'][muIdx]))
+        isExtra &= (dR>=0.05)
+    kin['extramu']=(muIdx[isExtra],mupt[isExtra],np.abs(mueta[isExtra]))
+    kin['n_extra_mu']=np.bincount(muIdx[isExtra],minlength=n)
+
+    #hadronic recoil
+    met,metphi=ev['met_pt'].astype(np.float64),ev['met_phi'].astype(np.float64)
+    kin['mpf']=1.+(met*np.cos(metphi)*boson[:,0]+met*np.sin(metphi)*boson[:,1])/(kin['bosonpt']**2+1.0e-6)
+    j1p4=p4FromPtEtaPhiM(ev['j1pt'],ev['j1eta'],ev['j1phi'],ev['j1m'])
+    j2p4=p4FromPtEtaPhiM(ev['j2pt'],ev['j2eta'],ev['j2phi'],ev['j2m'])
+    kin['zjb']=np.where(ev['nj']>0,ev['j1pt'].astype(np.float64)-kin['bosonpt'],0.)
+    kin['zj2b']=np.where(ev['nj']>1,p4Pt(j1p4+j2p4)-kin['bosonpt'],0.)
+
+    return kin
+
+
+def fillControlHistos(ht,ev,kin,wgt,catMasks,xangles,csi,counts,proton_cat,csi_pos,csi_neg):
+
+    """fills the control histograms for the events in each category mask"""
+
+    ppSystem=buildDiProtonArrays(csi_pos,csi_neg)
+    mmass=p4M(ppSystem-kin['boson'])
+    extraMuIdx,extraMuPt,extraMuEta=kin['extramu']
+
+    #per-event variables
+    evVars=[ ('l1pt',kin['l1pt']), ('l2pt',kin['l2pt']), ('l1eta',np.abs(kin['l1eta'])), ('l2eta',np.abs(kin['l2eta'])),
+             ('acopl',kin['acopl']), ('mll',kin['bosonm']), ('mll_full',kin['bosonm']), ('yll',kin['bosony']),
+             ('etall',kin['bosoneta']), ('ptll',kin['bosonpt']), ('ptll_high',kin['bosonpt']), ('costhetacs',kin['costhetacs']),
+             ('xangle',xangles), ('nvtx',ev['nvtx']), ('rho',ev['rho']), ('met',ev['met_pt']), ('mpf',kin['mpf']),
+             ('njets',ev['nj']), ('nch',ev['nchPV']),
+             ('PFMultHF',ev['PFMultSumHF']), ('PFHtHF',ev['PFHtSumHF']), ('PFPZHF',ev['PFPzSumHF']/1.e3),
+             ('nextramu',kin['n_extra_mu']), ('metbits',ev['metfilters']) ]
+    for sd in ['HE','EE','EB']:
+        evVars += [ ('PFMult'+sd,ev['PFMultSum'+sd]), ('PFHt'+sd,ev['PFHtSum'+sd]), ('PFPZ'+sd,ev['PFPzSum'+sd]/1.e3) ]
+
+    for c,mask in catMasks:
+
+        for key,vals in evVars:
+            ht.fillN(vals[mask],wgt[mask],key,[c])
+        for key,nmin in [('zjb',0),('zj2b',1)]:
+            sel=mask & (ev['nj']>nmin)
+            ht.fillN(kin[key][sel],wgt[sel],key,[c])
+        sel=mask[extraMuIdx]
+        ht.fillN(extraMuPt[sel],  wgt[extraMuIdx][sel], 'extramupt',  [c])
+        ht.fillN(extraMuEta[sel], wgt[extraMuIdx][sel], 'extramueta', [c])
+
+        #proton counting and kinematics
+        for ip in range(3):
+            for irp,rpside in [(0,'%dpos'%ip),(1,'%dneg'%ip)]:
+                ht.fillN(counts[:,irp,ip][mask], wgt[mask], 'ntk', [c], rpside)
+                tkIdx,tkCsi=getProtonsInGroup(csi,counts,irp,ip)
+                sel=mask[tkIdx]
+                ht.fillN(tkCsi[sel], wgt[tkIdx][sel], 'csi', [c], rpside)
+
+        #diproton kinematics
+        hasPP=mask & (proton_cat>0)
+        ht.fillN(hasPP[mask].astype(np.float64), wgt[mask], 'ppcount', [c])
+        ht.fillN(p4M(ppSystem[hasPP]),        wgt[hasPP], 'mpp',  [c])
+        ht.fillN(ppSystem[hasPP][:,2],        wgt[hasPP], 'pzpp', [c])
+        ht.fillN(p4Rapidity(ppSystem[hasPP]), wgt[hasPP], 'ypp',  [c])
+        for pfix,sel in [(None,hasPP)]+[('%d'%pc,hasPP & (proton_cat==pc)) for pc in range(1,5)]:
+            ht.fillN(mmass[sel], wgt[sel], 'mmass_full', [c], pfix)
+            sel = sel & (mmass>0)
+            ht.fillN(mmass[sel], wgt[sel], 'mmass', [c], pfix)
+
+
+def fillEventSummaries(evSummary,tOut,ev,kin,isData,evEras,xangles,isOffZ,wgt,nomCounts,nomLead,mixedDraws,nMixTries,allowPixMult):
+
+    """
+    fills the summary tree for a block of events: for each event the nominal proton selection is followed by
+    nMixTries fully mixed events (mixType=1) and nMixTries events mixed in one arm only (mixType=2)
+    """
+
+    n=len(ev)
+    nTries=2*nMixTries+1
+    mixCounts={c:mixedDraws[c][1].reshape(n,2*nMixTries,2,3) for c in mixedDraws}
+    mixLead={c:getLeadingProtons(*mixedDraws[c]).reshape(n,2*nMixTries,2,3) for c in mixedDraws}
+
+    #assign the protons for each try: nominal and variation (shifted xi, different mixing source or arm)
+    counts=np.zeros((n,nTries,2,3),dtype=np.int64)
+    lead=np.zeros((n,nTries,2,3))
+    systCounts=np.zeros_like(counts)
+    systLead=np.zeros_like(lead)
+
+    counts[:,0],lead[:,0]=nomCounts,nomLead
+    systCounts[:,0],systLead[:,0]=nomCounts,1.01*nomLead
+
+    mix1=slice(1,nMixTries+1)
+    counts[:,mix1],lead[:,mix1]=mixCounts[DIMUONS][:,0:nMixTries],mixLead[DIMUONS][:,0:nMixTries]
+    systCounts[:,mix1],systLead[:,mix1]=mixCounts[EMU][:,0:nMixTries],mixLead[EMU][:,0:nMixTries]
+
+    mix2=slice(nMixTries+1,nTries)
+    counts[:,mix2,0],lead[:,mix2,0]=mixCounts[DIMUONS][:,nMixTries:,0],mixLead[DIMUONS][:,nMixTries:,0]
+    counts[:,mix2,1],lead[:,mix2,1]=nomCounts[:,None,1],nomLead[:,None,1]
+    systCounts[:,mix2,0],systLead[:,mix2,0]=nomCounts[:,None,0],nomLead[:,None,0]
+    systCounts[:,mix2,1],systLead[:,mix2,1]=mixCounts[DIMUONS][:,nMixTries:,1],mixLead[DIMUONS][:,nMixTries:,1]
+
+    mixType=np.array([0]+[1]*nMixTries+[2]*nMixTries)
+
+    #select and keep entries with at least one selection passing the cuts
+    proton_cat,csi_pos,csi_neg=getDiProtonCategoryArrays(counts,lead,allowPixMult)
+    syst_proton_cat,syst_csi_pos,syst_csi_neg=getDiProtonCategoryArrays(systCounts,systLead,allowPixMult)
+    passSel=(proton_cat>0) | (syst_proton_cat>0)
+    evIdx,tryIdx=np.nonzero(passSel)
+
+    arr=evSummary.getEmptyArray(len(evIdx))
+    if isData:
+        arr['run']=ev['run'][evIdx]
+        arr['event']=ev['event'][evIdx]
+        arr['lumi']=ev['lumi'][evIdx]
+    arr['era']=np.array([ord(x[-1]) for x in ERAS])[evEras[evIdx]]
+    arr['cat']=ev['evcat'][evIdx]
+    arr['isOffZ']=isOffZ[evIdx]
+    arr['wgt']=np.where(tryIdx==0,wgt[evIdx],wgt[evIdx]/float(nMixTries))
+    arr['xangle']=xangles[evIdx]
+    for v in ['l1pt','l1eta','l2pt','l2eta','bosonm','bosonpt','bosoneta','bosony','acopl','costhetacs','mpf','zjb','zj2b']:
+        arr[v]=kin[v][evIdx]
+    for v,b in [('njets','nj'),('nch','nchPV'),('nvtx','nvtx'),('rho','rho'),
+                ('PFMultSumHF','PFMultSumHF'),('PFHtSumHF','PFHtSumHF'),('PFPzSumHF','PFPzSumHF')]:
+        arr[v]=ev[b][evIdx]
+    arr['gen_pzwgtUp']=1.
+    arr['gen_pzwgtDown']=1.
+    arr['mixType']=mixType[tryIdx]
+
+    boson=kin['boson'][evIdx]
+    for pfix,cat,cpos,cneg in [('',proton_cat,csi_pos,csi_neg),('syst',syst_proton_cat,syst_csi_pos,syst_csi_neg)]:
+        cat,cpos,cneg=cat[evIdx,tryIdx],cpos[evIdx,tryIdx],cneg[evIdx,tryIdx]
+        arr[pfix+'protonCat']=cat
+        hasPP=(cat>0)
+        ppSystem=buildDiProtonArrays(cpos,cneg)
+        mmassSystem=ppSystem-boson
+        for v,vals in [('csi1',cpos),('csi2',cneg),('mpp',p4M(ppSystem)),('ypp',p4Rapidity(ppSystem)),('pzpp',ppSystem[:,2]),
+                       ('mmiss',p4M(mmassSystem)),('ymmiss',p4Rapidity(mmassSystem)),('ppsEff',1.)]:
+            arr[pfix+v]=np.where(hasPP,vals,0.)
+        if pfix!='': continue
+
+        #vary boson energy scale
+        arr['mmissvup']=np.where(hasPP,p4M(ppSystem-boson*1.03),0.)
+        arr['mmissvdn']=np.where(hasPP,p4M(ppSystem-boson*0.97),0.)
+
+    evSummary.fillTreeFromArray(tOut,arr)
+
+
+def runExclusiveAnalysisColumnar(inFile,outFileName,runLumiList,maxEvents=-1,mixDir=None,allowPixMult=[1,2],chunkSize=50000):
+
+    """
+    columnar version of the event loop in runExclusiveAnalysis for data and background simulation:
+    the input tree is read in chunks of numpy arrays and the selection and kinematics are computed as array operations
+    """
+
+    isData=True if 'Data' in inFile else False
+    era=os.path.basename(inFile).split('_')[1] if isData else None
+    isDY=isDYFile(inFile)
+
+    MIXEDRP=loadMixingBank(mixDir,inFile)
+    evMixTool=EventMixingTool(mixedRP=MIXEDRP,validAngles=VALIDLHCXANGLES)
+    print 'Allowed pixel multiplicity is',allowPixMult
+
+    ht=bookAnalysisHistos(isSignal=False)
+
+    tree=ROOT.TChain('tree')
+    tree.AddFile(inFile)
+    nEntries=tree.GetEntries()
+    print '....analysing',nEntries,'in',inFile,', with output @',outFileName,'(columnar)'
+    if maxEvents>0:
+        nEntries=min(maxEvents,nEntries)
+        print '      will process',nEntries,'events'
+
+    #start output and tree
+    fOut=ROOT.TFile.Open(outFileName,'RECREATE')
+    evSummary=EventSummary()
+    tOut=ROOT.TTree('data','data')
+    evSummary.attachToTree(tOut)
+
+    #summary events for the mixing
+    rpData={}
+
+    branches=EVENTBRANCHES+(PROTONBRANCHES if isData else [])
+    for start in xrange(0,nEntries,chunkSize):
+
+        drawProgressBar(float(start)/float(nEntries))
+
+        ev=tree2array(tree,branches=branches,start=start,stop=min(start+chunkSize,nEntries))
+
+        #base event selection
+        evcatIdx,isOffZ=getEventCategoryArrays(ev)
+        sel=(evcatIdx>=0)
+        ev,evcatIdx,isOffZ=ev[sel],evcatIdx[sel],isOffZ[sel]
+        n=len(ev)
+        if n==0: continue
+
+        #assign data-taking era and crossing angle
+        if isData:
+            evEras=np.full(n,ERAS.index(era),dtype=np.int64)
+            xangles=ev['beamXangle'].astype(np.int64)
+        else:
+            evEras=getRandomEras(n)
+            xangles=np.zeros(n,dtype=np.int64)
+            for iera,evEra in enumerate(ERAS):
+                for evCat in [SINGLEPHOTON,DIMUONS]:
+                    eraSel=(evEras==iera) & (ev['isA'] if evCat==SINGLEPHOTON else ~ev['isA'])
+                    if eraSel.sum()==0: continue
+                    xbins=evMixTool.getRandomLHCCrossingAngles(evEra=evEra,evCat=evCat,n=eraSel.sum())
+                    xangles[eraSel]=np.array(VALIDLHCXANGLES)[xbins]
+        evEraNames=[ERAS[i] for i in evEras]
+
+        #check if RP is in (MC assume true by default)
+        if isData:
+            isRPIn=np.isin(xangles,VALIDLHCXANGLES) & isValidRunLumiArrays(ev['run'],ev['lumi'],runLumiList)
+        else:
+            isRPIn=np.ones(n,dtype=bool)
+
+        kin=computeEventKinematics(ev)
+
+        #proton tracks
+        if isData:
+            ev_csi,ev_counts=getTracksPerRomanPotArrays(ev,minCsi=MINCSI,evMask=isRPIn)
+        else:
+            ev_csi,ev_counts=np.zeros(0),np.zeros((n,2,3),dtype=np.int64)
+
+        #if data and there is nothing to mix store the main characteristics of the event and continue
+        if evMixTool.isIdle():
+            if not isData: continue
+            toStore=isRPIn & ( (ev['isZ'] & (ev['evcat']==DIMUONS) & (kin['bosonpt']<10)) | (evcatIdx==EVCATS.index('em')) )
+            for i in np.nonzero(toStore)[0]:
+                rpDataKey=(evEraNames[i],int(xangles[i]),int(ev['evcat'][i]))
+                pos_protons,neg_protons=getProtonLists(ev_csi,ev_counts,i)
+                rpData.setdefault(rpDataKey,[]).append( MixedEventSummary(puDiscr=[int(kin['n_extra_mu'][i]),int(ev['nvtx'][i]),float(ev['rho'][i]),
+                                                                                   float(ev['PFMultSumHF'][i]),float(ev['PFHtSumHF'][i]),float(ev['PFPzSumHF'][i]),0],
+                                                                          pos_protons=pos_protons,
+                                                                          neg_protons=neg_protons) )
+            continue
+
+        #kinematics using RP tracks (mixed in case of simulation)
+        if isData:
+            csi,counts=ev_csi,ev_counts
+        else:
+            mixed=drawMixedProtons(evMixTool,evEraNames,xangles,isData,[DIMUONS])
+            csi,counts=mixed[DIMUONS]
+        lead=getLeadingProtons(csi,counts)
+        proton_cat,csi_pos,csi_neg=getDiProtonCategoryArrays(counts,lead,allowPixMult)
+
+        #compare categorization with fully exclusive selection of pixels
+        ht.fillN(np.zeros(n),1.0,'catcount',['inc'])
+        exclPix=np.isin(counts[:,0,1],allowPixMult) & np.isin(counts[:,1,1],allowPixMult)
+        ht.fillN(np.ones(exclPix.sum()),1.0,'catcount',['inc'])
+        ht.fillN(proton_cat+1,1.0,'catcount',['inc'])
+
+        #event categories
+        catMasks=[]
+        for ic,c in enumerate(EVCATS):
+            mask=(evcatIdx==ic)
+            if not mask.any(): continue
+            catMasks.append( (c,mask) )
+            mask=mask & isRPIn
+            if not mask.any(): continue
+            catMasks.append( (c+'rpin',mask) )
+            mask=mask & (proton_cat>0)
+            if not mask.any(): continue
+            catMasks.append( (c+'rpinhpur',mask) )
+
+        wgt=ev['evwgt'].astype(np.float64)
+        fillControlHistos(ht,ev,kin,wgt,catMasks,xangles,csi,counts,proton_cat,csi_pos,csi_neg)
+
+        if not isData and not isDY : continue
+
+        #save the event summary for the statistical analysis in blocks of events
+        nMixTries=100 if isData else 1
+        blockSize=max(1,MAXSUMMARYROWS//(2*nMixTries+1))
+        for bstart in xrange(0,n,blockSize):
+            bsel=slice(bstart,min(bstart+blockSize,n))
+            bkin={k:(kin[k][bsel] if k!='extramu' else None) for k in kin}
+            mixedDraws=drawMixedProtons(evMixTool,evEraNames[bsel],xangles[bsel],isData,[DIMUONS,EMU],nDraws=2*nMixTries)
+            fillEventSummaries(evSummary,tOut,ev[bsel],bkin,isData,evEras[bsel],xangles[bsel],isOffZ[bsel],wgt[bsel],
+                               counts[bsel],lead[bsel],mixedDraws,nMixTries,allowPixMult)
+
+    #dump events for the mixing
+    nSelRPData=sum([len(rpData[x]) for x in rpData])
+    if nSelRPData>0:
+        rpDataOut=outFileName.replace('.root','.pck')
+        print 'Saving',nSelRPData,'events for mixing in',rpDataOut
+        with open(rpDataOut,'w') as cachefile:
+            pickle.dump(rpData,cachefile, pickle.HIGHEST_PROTOCOL)
+
+    #if there was no mixing don't do anything else
+    if not MIXEDRP: return
+
+    #save results
+    fOut.cd()
+    tOut.Write()
+    ht.writeToFile(fOut)
+    fOut.Close()
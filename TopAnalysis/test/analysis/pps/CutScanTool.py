@@ -0,0 +1,136 @@
+import re
+import ROOT
+import numpy as np
+
+class CutScanTool:
+
+    """
+    reads once the columns needed to scan cut thresholds and returns the histograms of a variable
+    for all the thresholds (or a grid of thresholds in several variables) at once:
+    each event is assigned the number of thresholds it passes and the histograms are obtained
+    as cumulative sums over that index
+    """
+
+    def __init__(self,chain,var,wgt,bins,scanVars,presel=None,step=500000):
+
+        """
+        chain    - TChain/TTree to read
+        var      - expression to histogram
+        wgt      - expression for the weight
+        bins     - (nbins,xmin,xmax) of the histogram
+        scanVars - expressions which will be used in the cuts
+        presel   - common selection applied when reading the tree
+        """
+
+        from root_numpy import tree2array
+
+        self.nbins,self.xmin,self.xmax=bins
+        self.scanVars=list(scanVars)
+
+        exprs=[var,wgt]+[x for x in self.scanVars if not x in [var,wgt]]
+        cols=[[] for x in exprs]
+        nEntries=chain.GetEntries()
+        for start in xrange(0,nEntries,step):
+            arr=tree2array(chain,branches=exprs,selection=presel,start=start,stop=start+step)
+            for i in range(len(exprs)):
+                cols[i].append( np.asarray(arr[arr.dtype.names[i]],dtype=np.float64) )
+        cols=[np.concatenate(x) if len(x) else np.zeros(0) for x in cols]
+        self.cols=dict(zip(exprs,cols))
+
+        self.wgt=self.cols[wgt]
+        self.binIdx=self.getBinIndex(self.cols[var])
+
+
+    def getBinIndex(self,x):
+
+        """same convention as TAxis::FindBin: 0 is the underflow and nbins+1 the overflow"""
+
+        idx=1+np.floor(self.nbins*(x-self.xmin)/(self.xmax-self.xmin))
+        return np.clip(idx,0,self.nbins+1).astype(np.int64)
+
+
+    def passes(self,scanVar,op,val):
+
+        """returns the mask of the events passing a single cut"""
+
+        x=self.cols[scanVar]
+        if op=='>'  : return x>val
+        if op=='>=' : return x>=val
+        if op=='<'  : return x<val
+        if op=='<=' : return x<=val
+        raise ValueError('unknown cut operator %s'%op)
+
+
+    def scan(self,grid,cuts=[]):
+
+        """
+        grid - list of (scanVar,op,thresholds) to scan simultaneously, op is one of >,>=,<,<=
+        cuts - list of (scanVar,op,value) applied to all the points of the grid
+        returns the sum of weights and of squared weights with shape (len(thresholds_1),...,len(thresholds_n),nbins+2)
+        """
+
+        mask=np.ones(len(self.wgt),dtype=bool)
+        for scanVar,op,val in cuts:
+            mask &= self.passes(scanVar,op,val)
+
+        #index of the first/last sorted threshold passed by each event
+        shape,idx,perms=[],[],[]
+        for scanVar,op,thresholds in grid:
+            thresholds=np.asarray(thresholds,dtype=np.float64)
+            order=np.argsort(thresholds)
+            x=self.cols[scanVar][mask]
+            side='left' if op in ['>','<='] else 'right'
+            if not op in ['>','>=','<','<=']:
+                raise ValueError('unknown cut operator %s'%op)
+            idx.append( np.searchsorted(thresholds[order],x,side=side) )
+            shape.append( len(thresholds)+1 )
+            perms.append( np.argsort(order) )
+        shape.append(self.nbins+2)
+        idx.append(self.binIdx[mask])
+
+        flatIdx=np.ravel_multi_index(idx,shape)
+        w=self.wgt[mask]
+        size=int(np.prod(shape))
+        sumw=np.bincount(flatIdx,weights=w,minlength=size).reshape(shape)
+        sumw2=np.bincount(flatIdx,weights=w**2,minlength=size).reshape(shape)
+
+        #accumulate along each threshold axis and restore the original order of the thresholds
+        for axis,(scanVar,op,_) in enumerate(grid):
+            results=[]
+            for h in [sumw,sumw2]:
+                if op in ['>','>=']:
+                    h=np.flip(np.cumsum(np.flip(h,axis),axis=axis),axis)
+                    h=np.take(h,np.arange(1,shape[axis]),axis=axis)
+                else:
+                    h=np.cumsum(h,axis=axis)
+                    h=np.take(h,np.arange(0,shape[axis]-1),axis=axis)
+                results.append( np.take(h,perms[axis],axis=axis) )
+            sumw,sumw2=results
+
+        return sumw,sumw2
+
+
+    def getHistogram(self,name,sumw,sumw2=None):
+
+        """converts the output of scan for one point to a TH1"""
+
+        h=ROOT.TH1F(name,'',self.nbins,self.xmin,self.xmax)
+        h.Sumw2()
+        h.SetDirectory(0)
+        for xbin in range(self.nbins+2):
+            h.SetBinContent(xbin,sumw[xbin])
+            if sumw2 is not None: h.SetBinError(xbin,np.sqrt(sumw2[xbin]))
+        return h
+
+
+def getCutThresholds(cut):
+
+    """parses a conjunction of simple thresholds (e.g. 'bosonpt>40 && csi1>0.035') to a list of (var,op,value)"""
+
+    thresholds=[]
+    for c in cut.split('&&'):
+        m=re.match(r'^\s*([\w:\(\),]+?)\s*(>=|<=|>|<)\s*([-+.\deE]+)\s*$',c)
+        if not m:
+            raise ValueError('can not interpret %s as a threshold'%c)
+        thresholds.append( (m.group(1),m.group(2),float(m.group(3))) )
+    return thresholds
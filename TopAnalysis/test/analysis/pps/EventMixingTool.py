@@ -1,16 +1,21 @@
 import pickle
 import ROOT
 import random
-import copy
+import numpy as np
 from random import shuffle
+from MixingBank import MixingBankEntries,buildMixingBankEntries
 
 class EventMixingTool:
 
     def __init__(self, mixedRP,validAngles):
 
-        """ Reads the event mixing data from a pickle file and builds a list of crossing angle probabilities """
+        """ 
+        Takes the event mixing data (a dict of lists read from a pickle file or a columnar MixingBank) 
+        and builds a list of crossing angle probabilities 
+        """
 
         self.mixedRP=mixedRP
+        self.mixedRPEntries={}
         self.xangleRelFracs={}
 
         try:
@@ -74,9 +79,9 @@ class EventMixingTool:
                 
                 mixedEvKey                  = (evEra,beamXangle,mixEvCat)
                 mixedEv                     = random.choice( self.mixedRP[mixedEvKey] )                
-                mixed_pudiscr[mixEvCat]     = copy.deepcopy(mixedEv.puDiscr)
-                mixed_pos_protons[mixEvCat] = copy.deepcopy(mixedEv.pos_protons)               
-                mixed_neg_protons[mixEvCat] = copy.deepcopy(mixedEv.neg_protons)
+                mixed_pudiscr[mixEvCat]     = list(mixedEv.puDiscr)
+                mixed_pos_protons[mixEvCat] = [list(x) for x in mixedEv.pos_protons]
+                mixed_neg_protons[mixEvCat] = [list(x) for x in mixedEv.neg_protons]
 
                 if orderByDecreasingCsi:
                     mixed_pos_protons[mixEvCat][1].sort(reverse = True) 
@@ -90,6 +95,46 @@ class EventMixingTool:
         return mixed_pos_protons, mixed_neg_protons, mixed_pudiscr
 
 
+    def getMixingBankEntries(self,mixedEvKey):
+
+        """returns the columnar view of the events for a given key (pickled lists are converted once and cached)"""
+
+        entries=self.mixedRP[mixedEvKey]
+        if isinstance(entries,MixingBankEntries): return entries
+        if not mixedEvKey in self.mixedRPEntries:
+            self.mixedRPEntries[mixedEvKey]=buildMixingBankEntries(entries)
+        return self.mixedRPEntries[mixedEvKey]
+
+
+    def getNewBatch(self,evEra,beamXangle,isData,validAngles,mixEvCategs,n):
+
+        """batch version of getNew: draws n mixed events at once from each event category
+        returns per category the flat array of xi's (sorted by decreasing xi per event, RP side and algorithm)
+        and the (n,2,3) array with the number of protons per group, as well as the (n,nDiscr) pileup discriminators"""
+
+        mixed_protons={}
+        mixed_pudiscr={}
+
+        for mixEvCat in mixEvCategs:
+            mixed_protons[mixEvCat]=(np.zeros(0),np.zeros((n,2,3),dtype=np.int64))
+            mixed_pudiscr[mixEvCat]=np.zeros((n,0))
+
+            if isData and not beamXangle in validAngles : continue
+
+            mixedEvKey=(evEra,beamXangle,mixEvCat)
+            if not mixedEvKey in self.mixedRP:
+                print evEra,beamXangle,mixEvCat,'->',mixedEvKey,'not found in the mixing bank'
+                continue
+
+            entries=self.getMixingBankEntries(mixedEvKey)
+            if len(entries)==0 : continue
+            idx=np.random.randint(0,len(entries),size=n)
+            mixed_protons[mixEvCat]=entries.getProtonArrays(idx)
+            mixed_pudiscr[mixEvCat]=np.asarray(entries.pudiscr[idx])
+
+        return mixed_protons, mixed_pudiscr
+
+
     def mergeWithMixedEvent(self,
                             pos_protons, mixed_pos_protons,
                             neg_protons, mixed_neg_protons,
@@ -150,3 +195,15 @@ class EventMixingTool:
             xbin=ROOT.TMath.FloorNint(self.xangleRelFracs[xangleKey].GetRandom())
 
         return xbin
+
+
+    def getRandomLHCCrossingAngles(self,evEra,evCat,n):
+
+        """samples n LHC crossing angle bins at once according to the relative fractions"""
+
+        if not self.xangleRelFracs:
+            return np.full(n,-1,dtype=int)
+
+        h=self.xangleRelFracs[(evEra,evCat)]
+        fracs=np.array([h.GetBinContent(xbin+1) for xbin in range(h.GetNbinsX())])
+        return np.random.choice(len(fracs),size=n,p=fracs/fracs.sum())
@@ -49,6 +49,22 @@ class EventSummary:
             for v in self.vars[t]:
                 tree.Branch( v,   getattr(self,v), '%s/%s'%(v,t.upper()) )
 
+    def getEmptyArray(self,n):
+
+        """ returns a structured numpy array with n entries, with one field per branch (used to fill in bulk) """
+
+        import numpy as np
+        dtypes={'i':np.int32,'l':np.int64,'f':np.float32}
+        return np.zeros(n,dtype=[(v,dtypes[t]) for t in self.vars for v in self.vars[t]])
+
+    def fillTreeFromArray(self,tree,arr):
+
+        """ appends the entries of a structured array (see getEmptyArray) to the tree """
+
+        if len(arr)==0: return
+        from root_numpy import array2tree
+        array2tree(arr,tree=tree)
+
 
 def main():
     print 'Defines EventSummary class'
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import pickle
+import numpy as np
+from MixedEventSummary import MixedEventSummary
+
+MIXBANKEXT='.npbank'
+
+class MixingBankEntries:
+
+    """
+    events for the mixing stored in a columnar format for a given (era, xangle, evcat) key
+    pudiscr - (nEvents,nDiscr) matrix with the pileup discriminators
+    offsets - (6*nEvents+1) array with the start of each (event, RP side, reconstruction algorithm) group in csi
+              sides are ordered as positive/negative, algorithms as multiRP/far/near (as in MixedEventSummary)
+    csi     - flat array with the proton xi's, sorted by decreasing xi within each group
+    """
+
+    def __init__(self,pudiscr,offsets,csi):
+        self.pudiscr=pudiscr
+        self.offsets=offsets
+        self.csi=csi
+
+    def __len__(self):
+        return self.pudiscr.shape[0]
+
+    def __getitem__(self,i):
+
+        """ builds the MixedEventSummary for the i-th event (new lists are created on every call) """
+
+        i=int(i)
+        if i<0: i+=len(self)
+        if i<0 or i>=len(self): raise IndexError('mixing bank index out of range')
+        bounds=self.offsets[6*i:6*i+7].tolist()
+        protons=[self.csi[bounds[ig]:bounds[ig+1]].tolist() for ig in range(6)]
+        return MixedEventSummary(puDiscr=self.pudiscr[i].tolist(),
+                                 pos_protons=protons[0:3],
+                                 neg_protons=protons[3:6])
+
+    def getProtonArrays(self,idx):
+
+        """
+        returns the protons of the events with indices idx as a flat array of xi's (sorted by decreasing xi
+        per event, RP side and reconstruction algorithm) and an (n,2,3) array with the number of protons in each group
+        """
+
+        idx=np.asarray(idx,dtype=np.int64)
+        groups=(6*idx[:,None]+np.arange(6)).ravel()
+        starts=np.asarray(self.offsets[groups])
+        counts=np.asarray(self.offsets[groups+1])-starts
+        outStarts=np.cumsum(counts)-counts
+        flatIdx=np.repeat(starts-outStarts,counts)+np.arange(counts.sum())
+        return np.asarray(self.csi[flatIdx],dtype=np.float64),counts.reshape(len(idx),2,3)
+
+
+def buildMixingBankEntries(evList):
+
+    """ converts a list of MixedEventSummary to the columnar format (in memory) """
+
+    nDiscr=max([len(ev.puDiscr) for ev in evList]) if len(evList) else 0
+    pudiscr=np.zeros((len(evList),nDiscr),dtype=np.float64)
+    counts=np.zeros(6*len(evList),dtype=np.int64)
+    csi=[]
+    for i,ev in enumerate(evList):
+        pudiscr[i,0:len(ev.puDiscr)]=ev.puDiscr
+        for side,protons in enumerate([ev.pos_protons,ev.neg_protons]):
+            for algo in range(3):
+                counts[6*i+3*side+algo]=len(protons[algo])
+                csi += sorted(protons[algo],reverse=True)
+    offsets=np.concatenate([[0],np.cumsum(counts)]).astype(np.int64)
+
+    return MixingBankEntries(pudiscr,offsets,np.array(csi,dtype=np.float64))
+
+
+def writeMixingBank(rpData,url):
+
+    """ converts a dict of (era,xangle,evcat) : [MixedEventSummary,...] to the columnar format and writes it to a directory """
+
+    if not os.path.isdir(url): os.makedirs(url)
+
+    index=[]
+    for key in rpData:
+
+        entries=buildMixingBankEntries(rpData[key])
+
+        era,xangle,evcat=key
+        tag='%s_%d_%d'%(era,xangle,evcat)
+        np.save(os.path.join(url,tag+'_pudiscr.npy'),entries.pudiscr)
+        np.save(os.path.join(url,tag+'_offsets.npy'),entries.offsets)
+        np.save(os.path.join(url,tag+'_csi.npy'),entries.csi)
+        index.append( [era,int(xangle),int(evcat),len(entries)] )
+
+    with open(os.path.join(url,'index.json'),'w') as cache:
+        json.dump(index,cache)
+
+
+class MixingBank:
+
+    """
+    read-only view of one or more columnar mixing banks: the arrays are memory-mapped so that opening the bank
+    does not depend on its size and the pages are shared by all the processes reading it
+    provides the same (era,xangle,evcat) : [MixedEventSummary,...] interface as the pickled banks
+    """
+
+    def __init__(self,urls):
+
+        self.entries={}
+        if isinstance(urls,str): urls=[urls]
+        for url in urls:
+            with open(os.path.join(url,'index.json'),'r') as cache:
+                index=json.load(cache)
+            for era,xangle,evcat,_ in index:
+                key=(str(era),xangle,evcat)
+                if key in self.entries:
+                    raise ValueError('%s is found in more than one mixing bank'%str(key))
+                tag='%s_%d_%d'%key
+                self.entries[key]=MixingBankEntries(*[np.load(os.path.join(url,'%s_%s.npy'%(tag,x)),mmap_mode='r')
+                                                      for x in ['pudiscr','offsets','csi']])
+
+    def __getitem__(self,key):
+        return self.entries[key]
+
+    def __contains__(self,key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+
+def main():
+
+    """ converts pickled mixing banks to the columnar format: python MixingBank.py mixbank_2017B_120.pck ... """
+
+    for url in sys.argv[1:]:
+        with open(url,'r') as cache:
+            rpData=pickle.load(cache)
+        outUrl=url.replace('.pck',MIXBANKEXT)
+        writeMixingBank(rpData,outUrl)
+        print url,'->',outUrl
+
+
+if __name__ == "__main__":
+    sys.exit(main())
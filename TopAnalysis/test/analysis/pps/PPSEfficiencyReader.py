@@ -1,17 +1,31 @@
 import ROOT
+import os
 import sys
+import numpy as np
 
 class PPSEfficiencyReader:
     
     """ 
     takes care of reading the efficency measurements to memory and retrieving the final efficiency correction 
     see details in https://twiki.cern.ch/twiki/bin/view/CMS/TaggedProtonsStripsEfficiencies
+    the histograms are stored as arrays (bin edges, contents and errors including under/overflows) so that the
+    efficiencies can be looked up without ROOT, either for a single proton or for arrays of protons
+    fList is a CSV list of ROOT files or a cache written by buildPPSEfficiencyCache
     """
 
     def __init__(self, fList, year=2017):
 
         self.allEffs={}
 
+        if fList.endswith('.npz'):
+            cache=np.load(ROOT.gSystem.ExpandPathName(fList))
+            for key in cache.files:
+                if not key.endswith('_edges') : continue
+                hname=key[0:-len('_edges')]
+                self.allEffs[hname]=(cache[hname+'_edges'],cache[hname+'_contents'],cache[hname+'_errors'])
+            print '[PPSEfficiencyReader] retrieved %d histograms from cache'%len(self.allEffs)
+            return
+
         for fIn in fList.split(','):
             baseDir='Strips/%d'%year if 'MultiTrack' in fIn else 'Pixel/%d'%year
             fIn=ROOT.TFile.Open(ROOT.gSystem.ExpandPathName(fIn))
@@ -19,8 +33,9 @@ class PPSEfficiencyReader:
                 for kk in fIn.Get(baseDir+'/'+k.GetName()).GetListOfKeys():
                     hname=kk.GetName()
                     if '2D'in hname : continue
-                    self.allEffs[hname]=kk.ReadObj()
-                    self.allEffs[hname].SetDirectory(0)
+                    h=kk.ReadObj()
+                    if h.GetDimension()!=1 : continue
+                    self.allEffs[hname]=getHistoArrays(h)
             fIn.Close()
 
         print '[PPSEfficiencyReader] retrieved %d histograms'%len(self.allEffs)
@@ -34,16 +49,15 @@ class PPSEfficiencyReader:
 
             if applyMultiTrack:
                 multiTrack=self.allEffs['h%dmultitrackeff_%s_avg_RP%d'%(sector,era,rp)]
-                ieff = multiTrack.GetBinContent(1)
+                ieff = multiTrack[1][1]
                 eff *= ieff
         
-            raddam=self.allEffs['h%d_%s_%d_1D'%(sector,era,xangle)]
-            raddamUnc=self.allEffs['h%derrors_%s_%d_1D'%(sector,era,xangle)]
-            ibin=raddam.FindBin(xi)
-            ieff    = raddam.GetBinContent(ibin)
+            edges,raddam,_=self.allEffs['h%d_%s_%d_1D'%(sector,era,xangle)]
+            uncEdges,_,raddamUnc=self.allEffs['h%derrors_%s_%d_1D'%(sector,era,xangle)]
+            ieff    = raddam[np.searchsorted(edges,xi,side='right')]
             if ieff>0:
                 eff    *= ieff
-                effUnc += (raddamUnc.GetBinError(ibin)/ieff)**2            
+                effUnc += (raddamUnc[np.searchsorted(uncEdges,xi,side='right')]/ieff)**2
                 
         else:
 
@@ -57,6 +71,39 @@ class PPSEfficiencyReader:
         return eff,effUnc
 
 
+    def getPPSEfficiencyArrays(self,eras,xangles,xis,rp,isMulti=True, applyMultiTrack=False):
+
+        """array version of getPPSEfficiency, returns the arrays of efficiencies and uncertainties"""
+
+        eras=np.asarray(eras)
+        xangles=np.asarray(xangles)
+        xis=np.asarray(xis,dtype=np.float64)
+        eff=np.ones(len(xis),dtype=np.float64)
+        effUnc=np.zeros(len(xis),dtype=np.float64)
+        if not isMulti or len(xis)==0:
+            return eff,effUnc
+
+        sector=45 if rp<100 else 56
+        keys=np.char.add(eras.astype(str),np.char.mod('_%d',xangles.astype(np.int64)))
+        for key in np.unique(keys):
+            era,xangle=key.split('_')
+            mask=(keys==key)
+
+            if applyMultiTrack:
+                eff[mask] *= self.allEffs['h%dmultitrackeff_%s_avg_RP%d'%(sector,era,rp)][1][1]
+
+            edges,raddam,_=self.allEffs['h%d_%s_%s_1D'%(sector,era,xangle)]
+            uncEdges,_,raddamUnc=self.allEffs['h%derrors_%s_%s_1D'%(sector,era,xangle)]
+            ieff=raddam[np.searchsorted(edges,xis[mask],side='right')]
+            iunc=raddamUnc[np.searchsorted(uncEdges,xis[mask],side='right')]
+            hasEff=(ieff>0)
+            ieff=np.where(hasEff,ieff,1.)
+            eff[mask] *= ieff
+            effUnc[mask] = np.where(hasEff,(iunc/ieff)**2,0.)
+
+        return eff,eff*np.sqrt(effUnc)
+
+
     def getProjectedFinalState(self,
                                pos_protons,stripPosEff,stripPosEffUnc,
                                neg_protons,stripNegEff,stripNegEffUnc,
@@ -163,6 +210,36 @@ class PPSEfficiencyReader:
 
 
 
+def getHistoArrays(h):
+
+    """returns the bin edges, contents and errors of a 1D histogram (contents and errors include under/overflows)"""
+
+    nbins=h.GetNbinsX()
+    edges=np.array([h.GetXaxis().GetBinLowEdge(xbin) for xbin in range(1,nbins+2)],dtype=np.float64)
+    contents=np.array([h.GetBinContent(xbin) for xbin in range(nbins+2)],dtype=np.float64)
+    errors=np.array([h.GetBinError(xbin) for xbin in range(nbins+2)],dtype=np.float64)
+    return edges,contents,errors
+
+
+def buildPPSEfficiencyCache(fList,cacheUrl,year=2017):
+
+    """reads the efficiency files once and stores the arrays in a numpy file which can be passed to PPSEfficiencyReader"""
+
+    reader=PPSEfficiencyReader(fList,year)
+    arrays={}
+    for hname,(edges,contents,errors) in reader.allEffs.items():
+        arrays[hname+'_edges']=edges
+        arrays[hname+'_contents']=contents
+        arrays[hname+'_errors']=errors
+
+    #write to a temporary file first so that the cache is never seen half-written
+    tmpUrl=cacheUrl+'.tmp'
+    with open(tmpUrl,'wb') as cache:
+        np.savez(cache,**arrays)
+    os.rename(tmpUrl,cacheUrl)
+    return cacheUrl
+
+
 def main():
 
     ppEffReader=PPSEfficiencyReader(fList='test/analysis/pps/PreliminaryEfficiencies_October92019_1D2DMultiTrack.root')
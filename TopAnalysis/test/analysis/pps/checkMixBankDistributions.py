@@ -2,9 +2,13 @@ import MixedEventSummary
 import sys
 import pickle
 import ROOT
+from MixingBank import MixingBank,MIXBANKEXT
 
-with open(sys.argv[1],'r') as f:
-    rpData=pickle.load(f)
+if sys.argv[1].endswith(MIXBANKEXT):
+    rpData=MixingBank(sys.argv[1])
+else:
+    with open(sys.argv[1],'r') as f:
+        rpData=pickle.load(f)
 
 csi={}
 for key in rpData:
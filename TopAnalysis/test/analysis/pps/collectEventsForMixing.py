@@ -4,6 +4,7 @@ import sys
 from random import shuffle
 from collections import defaultdict
 from generateBinnedWorkspace import VALIDLHCXANGLES
+from MixingBank import writeMixingBank,MIXBANKEXT
 
 #create mixing manks per era and crossing angle
 for era in 'BCDEF':
@@ -41,11 +42,12 @@ for era in 'BCDEF':
         for key in rpData:
             print '\t',key,len(rpData[key])
 
-        mixbank='%s/mixing/mixbank_%s_%d.pck'%(baseDir,era,xangle)
+        #the columnar format is memory-mapped by the analysis jobs
+        mixbank='%s/mixing/mixbank_%s_%d%s'%(baseDir,era,xangle,MIXBANKEXT)
         print '\t writing mixing bank @',mixbank
-        with open('mixbank.pck','w') as cache:
-            pickle.dump(rpData,cache)
-        os.system('mv mixbank.pck %s'%mixbank)
+        os.system('rm -rf mixbank%s'%MIXBANKEXT)
+        writeMixingBank(rpData,'mixbank%s'%MIXBANKEXT)
+        os.system('rm -rf %s && mv mixbank%s %s'%(mixbank,MIXBANKEXT,mixbank))
 
 if len(toCheck)>0:
     print '-'*50
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+compares the outputs of runExclusiveAnalysis.py obtained with the event loop and the columnar engine
+usage: python compareAnalysisEngines.py loop.root columnar.root [relative tolerance]
+histograms are compared bin-by-bin, the summary tree is compared for the non-mixed entries (mixType=0)
+"""
+
+import sys
+import ROOT
+
+
+def getHistos(fIn):
+
+    """reads all histograms in a file"""
+
+    histos={}
+    for k in fIn.GetListOfKeys():
+        obj=k.ReadObj()
+        if not obj.InheritsFrom('TH1') : continue
+        histos[k.GetName()]=obj
+    return histos
+
+
+def isClose(a,b,tol):
+    return abs(a-b)<=tol*max(1.,abs(a),abs(b))
+
+
+def main():
+
+    tol=float(sys.argv[3]) if len(sys.argv)>3 else 1e-5
+    fLoop=ROOT.TFile.Open(sys.argv[1])
+    fCol=ROOT.TFile.Open(sys.argv[2])
+
+    #histograms
+    hLoop,hCol=getHistos(fLoop),getHistos(fCol)
+    nDiff=0
+    for name in sorted(set(hLoop.keys()+hCol.keys())):
+        if not name in hLoop or not name in hCol:
+            print '%30s only found in %s'%(name,'loop' if name in hLoop else 'columnar')
+            nDiff+=1
+            continue
+        for xbin in range(hLoop[name].GetNcells()):
+            if isClose(hLoop[name].GetBinContent(xbin),hCol[name].GetBinContent(xbin),tol) : continue
+            print '%30s differs in bin %d: %f (loop) vs %f (columnar)'%(name,xbin,
+                                                                        hLoop[name].GetBinContent(xbin),
+                                                                        hCol[name].GetBinContent(xbin))
+            nDiff+=1
+            break
+    print 'Compared',len(hLoop),'histograms,',nDiff,'differ'
+
+    #summary tree (mixed entries are random and can't be compared)
+    tLoop,tCol=fLoop.Get('data'),fCol.Get('data')
+    if tLoop and tCol:
+        for b in ['wgt','l1pt','bosonm','bosonpt','acopl','costhetacs','mpf','protonCat','csi1','csi2','mmiss','systmmiss','mmissvup']:
+            vals=[]
+            for t in [tLoop,tCol]:
+                h=ROOT.TH1D('h','',1,-1e9,1e9)
+                n=t.Draw('%s>>h'%b,'mixType==0','goff')
+                vals.append( (n,h.GetMean(),h.GetRMS()) )
+                h.Delete()
+            status='ok' if vals[0][0]==vals[1][0] and all([isClose(vals[0][i],vals[1][i],tol) for i in [1,2]]) else 'DIFFERS'
+            print '%15s %8s'%(b,status),vals
+
+    fLoop.Close()
+    fCol.Close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
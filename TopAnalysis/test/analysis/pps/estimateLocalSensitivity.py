@@ -3,6 +3,7 @@ import os
 import sys
 import optparse
 import numpy as np
+from CutScanTool import CutScanTool
 
 CSILIST=np.arange(0.04,0.05,0.001)
 PTLIST=np.arange(20,60,5)
@@ -19,11 +20,16 @@ def estimateLocalSensitivity(opt):
         if 'MuonEG' in f : continue
         data.AddFile(f)
 
-    cuts='xangle==%d && mixType==1 && cat==169 && l1pt>30 && l2pt>20 && bosonpt>40 && nvtx<20 && PFPzSumHF<12000'%opt.xangle
-    finalCut=cuts+' && csi1>0.04 && csi2>0.04'
-    data.Draw('mmiss >> (50,0,2500)','wgt*ppsEff*%s'%finalCut,'goff')
-    h=data.GetHistogram()    
-    h.SetDirectory(0)
+    #read the columns needed for all the scans at once
+    #(the selection is applied as a whole: pasted after 'wgt*ppsEff*' it was parsed as (wgt*ppsEff*xangle)==N && ...)
+    cuts='xangle==%d && mixType==1 && cat==169 && l1pt>30 && l2pt>20'%opt.xangle
+    nominal=[('TMath::Min(csi1,csi2)', '>', 0.04),
+             ('bosonpt',               '>', 40),
+             ('nvtx',                  '<', 20),
+             ('PFPzSumHF',             '<', 12000)]
+    scanTool=CutScanTool(data,'mmiss','wgt*ppsEff',(50,0,2500),[x[0] for x in nominal],presel=cuts)
+    sumw,sumw2=scanTool.scan([],nominal)
+    h=scanTool.getHistogram('h',sumw,sumw2)
 
     #local  variation graphs will be approximated by pol1
     csiEvol=[]   
@@ -37,56 +43,20 @@ def estimateLocalSensitivity(opt):
         hfEvol.append(ROOT.TGraph())
     gfunc=ROOT.TF1('grad','[0]*x+[1]',-100,100)
 
-    #scan in csi
-    print 'Scanning csi in',CSILIST
-    for csi in CSILIST:
-        finalCut='%s && csi1>%f && csi2>%f'%(cuts,csi,csi)
-        data.Draw('mmiss >> (50,0,2500)','wgt*ppsEff*%s'%finalCut,'goff')
-        hvar=data.GetHistogram()
-        for xbin in range(h.GetNbinsX()):
-            nomCts=h.GetBinContent(xbin+1)
-            if nomCts==0: continue
-            rel_diff=100.*(hvar.GetBinContent(xbin+1)/nomCts)
-            csiEvol[xbin].SetPoint(csiEvol[xbin].GetN(),100*(csi/0.5-1),rel_diff)
-
-    #scan in ptll
-    print 'Scanning ptll in',PTLIST
-    cuts='xangle==%d && mixType==1 && cat==169 && l1pt>30 && l2pt>20 && csi1>0.04 && csi2>0.04 && nvtx<20 && PFPzSumHF<12000'%opt.xangle
-    for pt in PTLIST:
-        finalCut='%s && bosonpt>%f'%(cuts,pt)
-        data.Draw('mmiss >> (50,0,2500)','wgt*ppsEff*%s'%finalCut,'goff')
-        hvar=data.GetHistogram()
-        for xbin in range(h.GetNbinsX()):
-            nomCts=h.GetBinContent(xbin+1)
-            if nomCts==0: continue
-            rel_diff=100.*(hvar.GetBinContent(xbin+1)/nomCts)
-            ptllEvol[xbin].SetPoint(ptllEvol[xbin].GetN(),100*(pt/40.-1),rel_diff)
-
-    #scan in vertices
-    print 'Scanning nvtx in',NVTXLIST
-    cuts='xangle==%d && mixType==1 && cat==169 && l1pt>30 && l2pt>20 && csi1>0.04 && csi2>0.04 && bosonpt>40 && PFPzSumHF<12000'%opt.xangle
-    for n in NVTXLIST:
-        finalCut='%s && nvtx<%f'%(cuts,n)
-        data.Draw('mmiss >> (50,0,2500)','wgt*ppsEff*%s'%finalCut,'goff')
-        hvar=data.GetHistogram()
-        for xbin in range(h.GetNbinsX()):
-            nomCts=h.GetBinContent(xbin+1)
-            if nomCts==0: continue
-            rel_diff=100.*(hvar.GetBinContent(xbin+1)/nomCts)
-            vtxEvol[xbin].SetPoint(vtxEvol[xbin].GetN(),100*(n/20.-1),rel_diff)
-
-    #scan in HF
-    print 'Scanning PFSumPz in',PFSUMPZLIST
-    cuts='xangle==%d && mixType==1 && cat==169 && l1pt>30 && l2pt>20 && csi1>0.04 && csi2>0.04 && bosonpt>40 && nvtx<20'%opt.xangle
-    for hf in PFSUMPZLIST:
-        finalCut='%s && PFPzSumHF<%f'%(cuts,hf)
-        data.Draw('mmiss >> (50,0,2500)','wgt*ppsEff*%s'%finalCut,'goff')
-        hvar=data.GetHistogram()
-        for xbin in range(h.GetNbinsX()):
-            nomCts=h.GetBinContent(xbin+1)
-            if nomCts==0: continue
-            rel_diff=100.*(hvar.GetBinContent(xbin+1)/nomCts)
-            hfEvol[xbin].SetPoint(hfEvol[xbin].GetN(),100*(hf/12000.-1),rel_diff)
+    #scan each variable keeping the other cuts at their nominal values
+    for ivar,title,thrList,evol,xnorm in [(0, 'csi',      CSILIST,     csiEvol,  0.5),
+                                          (1, 'ptll',     PTLIST,      ptllEvol, 40.),
+                                          (2, 'nvtx',     NVTXLIST,    vtxEvol,  20.),
+                                          (3, 'PFSumPz',  PFSUMPZLIST, hfEvol,   12000.)]:
+        print 'Scanning',title,'in',thrList
+        scanVar,op,_=nominal[ivar]
+        hvar,_=scanTool.scan([(scanVar,op,thrList)],nominal[0:ivar]+nominal[ivar+1:])
+        for ithr,thr in enumerate(thrList):
+            for xbin in range(h.GetNbinsX()):
+                nomCts=h.GetBinContent(xbin+1)
+                if nomCts==0: continue
+                rel_diff=100.*(hvar[ithr][xbin+1]/nomCts)
+                evol[xbin].SetPoint(evol[xbin].GetN(),100*(thr/xnorm-1),rel_diff)
 
     #local sensitivities
     csils=h.Clone('csils')
@@ -4,6 +4,7 @@ import sys
 import argparse
 import pickle
 import copy
+import numpy as np
 
 #sigma=1pb distributed accross crossing angles 
 #NB this does not sum to 1 as we don't use all crossing angles in the analysis
@@ -96,6 +97,100 @@ def defineProcessTemplates(histos,norm=False):
     return templates
 
         
+class TemplateBooker:
+
+    """
+    collects the templates to be filled from a chain and fills them all in a single pass:
+    the variables and weights (TTreeFormula expressions) are evaluated together with root_numpy
+    and the histograms are filled with TH1::FillN
+    """
+
+    def __init__(self,chain,presel=None,step=500000,check=False):
+        self.chain=chain
+        self.presel=presel
+        self.step=step
+        self.check=check
+        self.templates=[]
+
+    def book(self,name,var,wgt,nbins,xmin,xmax):
+
+        """books a histogram filled with var, weighted by wgt (entries with null weight are skipped as in TTree::Draw)"""
+
+        h=ROOT.TH1F(name,'',nbins,xmin,xmax)
+        h.Sumw2()
+        h.SetDirectory(0)
+        self.templates.append( (h,var,wgt) )
+        return h
+
+    def fill(self):
+
+        """reads the chain once (in blocks of entries) and fills all the booked templates"""
+
+        from root_numpy import tree2array
+
+        exprs=[]
+        for _,var,wgt in self.templates:
+            for x in [var,wgt]:
+                if not x in exprs: exprs.append(x)
+        if len(exprs)==0: return
+
+        nEntries=self.chain.GetEntries()
+        for start in xrange(0,nEntries,self.step):
+            arr=tree2array(self.chain,branches=exprs,selection=self.presel,start=start,stop=start+self.step)
+            if arr.shape[0]==0: continue
+            cols=dict( [(x,np.asarray(arr[arr.dtype.names[i]],dtype=np.float64)) for i,x in enumerate(exprs)] )
+            for h,var,wgt in self.templates:
+                mask=(cols[wgt]!=0)
+                vals=np.ascontiguousarray(cols[var][mask])
+                wgts=np.ascontiguousarray(cols[wgt][mask])
+                if len(vals)==0: continue
+                h.FillN(len(vals),vals,wgts)
+
+        if self.check: self.compareWithDraw()
+
+    def compareWithDraw(self,tol=1e-4):
+
+        """compares the templates bin-by-bin with the ones filled with TTree::Draw (slow, for validation), returns the number of differences"""
+
+        ROOT.gROOT.cd()
+        nFailed=0
+        for h,var,wgt in self.templates:
+            href=h.Clone(h.GetName()+'_draw')
+            href.Reset('ICE')
+            href.SetDirectory(ROOT.gROOT)
+            self.chain.Draw('{0}>>{1}'.format(var,href.GetName()),wgt,'goff')
+            for xbin in xrange(0,h.GetNbinsX()+2):
+                for a,b in [(h.GetBinContent(xbin),href.GetBinContent(xbin)),(h.GetBinError(xbin),href.GetBinError(xbin))]:
+                    if abs(a-b)<=tol*max(1.,abs(a),abs(b)): continue
+                    print '\t\t [check] %s differs from TTree::Draw at bin %d: %f vs %f'%(h.GetName(),xbin,a,b)
+                    nFailed+=1
+            href.Delete()
+        print '\t\t [check] %d templates compared with TTree::Draw, %d differences found'%(len(self.templates),nFailed)
+        return nFailed
+
+
+def getTemplateDef(opt,pfix=''):
+
+    """returns the variable and the binning of the missing mass templates"""
+
+    if opt.signed:
+        #return '(%sypp>=0 ? %smmiss : -%smmiss)'%(pfix,pfix,pfix),2*opt.nbins,-opt.mMax,opt.mMax
+        return '(bosoneta>=0 ? %smmiss : -%smmiss)'%(pfix,pfix),2*opt.nbins,-opt.mMax,opt.mMax
+    return '%smmiss'%pfix,opt.nbins,opt.mMin,opt.mMax
+
+
+def getBookingPreselection(presel):
+
+    """
+    preselection for reading the chains: the systematic templates replace the proton cuts (csi, protonCat)
+    by their systematic variants, so the events passing either form of the preselection are read
+    """
+
+    systPresel=presel.replace('csi1','systcsi1').replace('csi2','systcsi2').replace('protonCat','systprotonCat')
+    if systPresel==presel: return presel
+    return '({0}) || ({1})'.format(presel,systPresel)
+
+        
 def fillBackgroundTemplates(opt):
 
     """fills the background and observed data histograms"""
@@ -122,7 +217,9 @@ def fillBackgroundTemplates(opt):
     #define final preselection cuts
     cuts=opt.presel
 
-    #loop over categories build templates
+    #book the templates for all categories and fill them in one go
+    booker=TemplateBooker(data,presel=getBookingPreselection(cuts),check=opt.checkTemplates)
+    booked=[]
     for icat in range(len(opt.categs)):
 
         #apply category cuts
@@ -132,23 +229,12 @@ def fillBackgroundTemplates(opt):
 
         print '\t\t',catName,categCut
 
+        #observed data
+        var,nbins,xmin,xmax=getTemplateDef(opt)
+        obs=booker.book('data_obs_'+catName,var,'{0} && mmiss>0 && mixType==0'.format(categCut),nbins,xmin,xmax)
+
         #background modelling histos
         histos=[]
-        data_obs=None
-        histodef='mmiss >> h(%d,%f,%f)'%(opt.nbins,opt.mMin,opt.mMax)
-        if opt.signed:
-            #histodef='(ypp>=0 ? mmiss : -mmiss) >> h(%d,%f,%f)'%(2*opt.nbins,-opt.mMax,opt.mMax)
-            histodef='(bosoneta>=0 ? mmiss : -mmiss) >> h(%d,%f,%f)'%(2*opt.nbins,-opt.mMax,opt.mMax)
-        data.Draw(histodef,
-                  '{0} && mmiss>0 && mixType==0'.format(categCut),
-                  'goff')
-        h=data.GetHistogram()
-        totalBkg[icat]=h.Integral()
-        if opt.unblind:
-            data_obs=h.Clone('data_obs_'+catName)
-            data_obs.SetDirectory(0)
-        h.Reset('ICE')
-
         for name,mixType,pfix in [('bkg_'+catName,                          1, ''),
                                   ('bkg_%s_bkgShape'%catName,               1, 'syst'),
                                   ('bkg_%s_bkgShapeSingleDiffUp'%catName,   2, ''),
@@ -160,25 +246,26 @@ def fillBackgroundTemplates(opt):
             if pfix=='syst':
                 templCuts=templCuts.replace('protonCat','systprotonCat')
 
-            histodef='%smmiss >> h(%d,%f,%f)'%(pfix,opt.nbins,opt.mMin,opt.mMax)           
-            if opt.signed:
-                #histodef='(%sypp>=0 ? %smmiss : -%smmiss) >> h(%d,%f,%f)'%(pfix,pfix,pfix,2*opt.nbins,-opt.mMax,opt.mMax)
-                histodef='(bosoneta>=0 ? %smmiss : -%smmiss) >> h(%d,%f,%f)'%(pfix,pfix,2*opt.nbins,-opt.mMax,opt.mMax)
-            
-            data.Draw(histodef,
-                      'wgt*({0} && {1}mmiss>0 && mixType=={2})'.format(templCuts,pfix,mixType),
-                      'goff')
-            h=data.GetHistogram()
-            h.Scale(totalBkg[icat]/h.Integral())
-            histos.append(h.Clone(name))
-            histos[-1].SetDirectory(0)
+            var,nbins,xmin,xmax=getTemplateDef(opt,pfix)
+            histos.append( booker.book(name,var,'wgt*({0} && {1}mmiss>0 && mixType=={2})'.format(templCuts,pfix,mixType),nbins,xmin,xmax) )
+
+        booked.append( (catName,obs,histos) )
+
+    booker.fill()
 
-            #use first histogram in a category as pseudo-data in case we're blinded
-            if len(histos)==1 and not opt.unblind :
-                data_obs=h.Clone('data_obs_'+catName)
-                data_obs.SetDirectory(0)
+    for icat,(catName,obs,histos) in enumerate(booked):
+
+        totalBkg[icat]=obs.Integral()
+        for h in histos:
+            h.Scale(totalBkg[icat]/h.Integral())
 
-            h.Reset('ICE')
+        #use first histogram in a category as pseudo-data in case we're blinded
+        if opt.unblind:
+            data_obs=obs
+        else:
+            data_obs=histos[0].Clone('data_obs_'+catName)
+            data_obs.SetDirectory(0)
+            obs.Delete()
 
         #finalize templates
         templates += defineProcessTemplates(histos)
@@ -207,7 +294,10 @@ def fillSignalTemplates(mass,signalFile,xsec,opt,fiducialCuts='gencsi1>0.02 && g
     #common weight exppression
     wgtExpr='ppsEff*wgt*{xsec}*{lumi}'.format(xsec=xsec,lumi=opt.lumi)
 
-    #loop over categories build templates
+    #book the templates for all categories and fill them with one pass over each chain
+    booker=TemplateBooker(data,presel=getBookingPreselection(opt.presel),check=opt.checkTemplates)
+    altBooker=TemplateBooker(dataAlt,presel=getBookingPreselection(opt.presel),check=opt.checkTemplates)
+    booked=[]
     for icat in range(len(opt.categs)):
 
         #apply category cuts
@@ -238,47 +328,47 @@ def fillSignalTemplates(mass,signalFile,xsec,opt,fiducialCuts='gencsi1>0.02 && g
                 if pfix=='syst':
                     templCuts=templCuts.replace('protonCat','systprotonCat')
 
-                histodef='%smmiss >> h(%d,%f,%f)'%(pfix,opt.nbins,opt.mMin,opt.mMax)           
-                if opt.signed:
-                    #histodef='(%sypp>=0 ? %smmiss : -%smmiss) >> h(%d,%f,%f)'%(pfix,pfix,pfix,2*opt.nbins,-opt.mMax,opt.mMax)
-                    histodef='(bosoneta>=0 ? %smmiss : -%smmiss) >> h(%d,%f,%f)'%(pfix,pfix,2*opt.nbins,-opt.mMax,opt.mMax)
+                var,nbins,xmin,xmax=getTemplateDef(opt,pfix)
 
                 shiftDataWgt=1.0
                 if 'sigCalibUp' in name:   shiftDataWgt *=1.03
                 if 'sigCalibDown' in name: shiftDataWgt *=0.97
-                
 
                 #sum up contributions
-                data.Draw(histodef,
-                          '{0}*{1}*{2}*({3} && mixType=={4} && {5}mmiss>0)'.format(wgtExpr,
-                                                                                   addWgt if addWgt else '1',
-                                                                                   dataWgt*shiftDataWgt,
-                                                                                   templCuts,
-                                                                                   mixType,
-                                                                                   pfix),
-                          'goff')
-                h=data.GetHistogram()
-
-                dataAlt.Draw(histodef.replace('h(','halt('),
-                             '{0}*{1}*{2}*({3} && mixType=={4} && {5}mmiss>0)'.format(wgtExpr,
-                                                                                      addWgt if addWgt else '1',
-                                                                                      (1-dataWgt*shiftDataWgt),
-                                                                                      templCuts,
-                                                                                      mixType,
-                                                                                      pfix),
-                             'goff')
-                h.Add(dataAlt.GetHistogram())
-
-                histos.append( h.Clone(name) )         
-                histos[-1].SetDirectory(0)
-
-                if len(histos)==1:
-                    totalSig[sigType][icat]=h.Integral()
-                    nom_templates[sigType].append(h.Clone(name+'_sigforpseudodata'))
-                    nom_templates[sigType][-1].SetDirectory(0)
-
-                h.Reset('ICE')
-            templates[sigType] += defineProcessTemplates(histos)
+                h=booker.book(name,var,
+                              '{0}*{1}*{2}*({3} && mixType=={4} && {5}mmiss>0)'.format(wgtExpr,
+                                                                                       addWgt if addWgt else '1',
+                                                                                       dataWgt*shiftDataWgt,
+                                                                                       templCuts,
+                                                                                       mixType,
+                                                                                       pfix),
+                              nbins,xmin,xmax)
+                halt=altBooker.book(name+'_alt',var,
+                                    '{0}*{1}*{2}*({3} && mixType=={4} && {5}mmiss>0)'.format(wgtExpr,
+                                                                                             addWgt if addWgt else '1',
+                                                                                             (1-dataWgt*shiftDataWgt),
+                                                                                             templCuts,
+                                                                                             mixType,
+                                                                                             pfix),
+                                    nbins,xmin,xmax)
+                histos.append( (h,halt) )
+
+            booked.append( (icat,sigType,histos) )
+
+    booker.fill()
+    altBooker.fill()
+
+    for icat,sigType,histos in booked:
+        for h,halt in histos:
+            h.Add(halt)
+            halt.Delete()
+        histos=[h for h,_ in histos]
+
+        totalSig[sigType][icat]=histos[0].Integral()
+        nom_templates[sigType].append(histos[0].Clone(histos[0].GetName()+'_sigforpseudodata'))
+        nom_templates[sigType][-1].SetDirectory(0)
+
+        templates[sigType] += defineProcessTemplates(histos)
     
     print '\t total signal:',totalSig
     return totalSig,templates,nom_templates
@@ -521,6 +611,11 @@ def main(args):
                         default=False,
                         action='store_true',
                         help='Use non-mixed data in the final fit [default: %default]')
+    parser.add_argument('--checkTemplates',
+                        dest='checkTemplates',
+                        default=False,
+                        action='store_true',
+                        help='compare the templates with the ones filled with TTree::Draw (slow) [default: %default]')
     opt=parser.parse_args(args)
 
     ROOT.gROOT.SetBatch(True)
@@ -3,6 +3,8 @@ import os
 import sys
 import argparse
 import itertools
+import numpy as np
+from CutScanTool import CutScanTool,getCutThresholds
 
 #PRE-APP VERSION
 #KINEMATICS = [('bosonpt>30',                       'bosonpt>95'),
@@ -36,6 +38,47 @@ CATEGS     = [
 
 OPTIMLIST=list(itertools.product(KINEMATICS, RPSEL,CATEGS))
 
+def printExpectedBackground(opt):
+
+    """
+    prints the expected background (mixed events) for the kinematics and RP selections of the optimization grid
+    all the points of the grid are evaluated from a single read of the data of each channel
+    """
+
+    xangles=[x for x in opt.xangles.split(',') if int(x)!=0]
+    xangleCut=' || '.join(['xangle==%s'%x for x in xangles]) if len(xangles) else '1'
+    points=list(itertools.product(KINEMATICS,RPSEL))
+    for ch,ikin,tag in [('169', 0, 'DoubleMuon'), ('121', 0, 'DoubleEG'), ('22', 1, 'Photon')]:
+
+        data=ROOT.TChain('data')
+        for f in [os.path.join(opt.input,x) for x in os.listdir(opt.input) if 'Data13TeV' in x and tag in x]:
+            data.AddFile(f)
+
+        #build the grid from the thresholds found in all the points (+/-inf is used if a cut is not applied)
+        pointCuts=[getCutThresholds('%s && %s'%(kin[ikin],rpsel)) for kin,rpsel in points]
+        axes=[]
+        for cuts in pointCuts:
+            for var,op,_ in cuts:
+                if not (var,op) in axes: axes.append( (var,op) )
+        thresholds=[]
+        for var,op in axes:
+            noCut=-np.inf if op[0]=='>' else np.inf
+            thresholds.append( sorted(set([noCut]+[val for cuts in pointCuts for ivar,iop,val in cuts if (ivar,iop)==(var,op)])) )
+
+        scanTool=CutScanTool(data,'mmiss','wgt',(1,0,1e6),[var for var,_ in axes],
+                             presel='cat==%s && mixType==1 && mmiss>0 && (%s)'%(ch,xangleCut))
+        sumw,_=scanTool.scan([(var,op,thresholds[i]) for i,(var,op) in enumerate(axes)])
+
+        print '-'*50
+        print 'Expected background for cat=%s'%ch
+        for ipt,cuts in enumerate(pointCuts):
+            gridIdx=[]
+            for i,(var,op) in enumerate(axes):
+                val=[ival for ivar,iop,ival in cuts if (ivar,iop)==(var,op)]
+                gridIdx.append( thresholds[i].index(val[0] if len(val) else thresholds[i][0 if op[0]=='>' else -1]) )
+            print '%50s %10.1f'%('%s && %s'%(points[ipt][0][ikin],points[ipt][1]),sumw[tuple(gridIdx)][1])
+
+
 def main(args):
 
     parser = argparse.ArgumentParser(description='usage: %prog [options]')
@@ -73,8 +116,17 @@ def main(args):
                         default=False,
                         action='store_true',
                         help='Use non-mixed data in the final fit [default: %default]')
+    parser.add_argument('--bkgOnly',
+                        dest='bkgOnly', 
+                        default=False,
+                        action='store_true',
+                        help='Only print the expected background for each point of the grid [default: %default]')
     opt=parser.parse_args(args)
 
+    if opt.bkgOnly:
+        printExpectedBackground(opt)
+        return
+
     #build a list of the points to run
     if opt.just: opt.just=[int(x) for x in opt.just.split(',')]
 
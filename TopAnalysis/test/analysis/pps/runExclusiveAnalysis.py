@@ -14,10 +14,12 @@ import pickle
 import re
 from collections import OrderedDict,defaultdict
 from TopLJets2015.TopAnalysis.HistoTool import *
+from TopLJets2015.TopAnalysis.RunLumiIndex import getRunLumiIndex
 from EventMixingTool import *
 from EventSummary import EventSummary
 from MixedEventSummary import MixedEventSummary
-from PPSEfficiencyReader import PPSEfficiencyReader
+from MixingBank import MixingBank,MIXBANKEXT
+from PPSEfficiencyReader import PPSEfficiencyReader,buildPPSEfficiencyCache
 from TopLJets2015.TopAnalysis.myProgressBar import *
 
 VALIDLHCXANGLES=[120,130,140,150]
@@ -28,25 +30,17 @@ SINGLEPHOTON=22
 MINCSI=0.035
 MIXEDRPSIG=None # this is only for a test
 ALLOWPIXMULT=[1,2]
+HISTOBUFFER=10000 # fills are buffered and done in bulk every HISTOBUFFER calls
 
 def isValidRunLumi(run,lumi,runLumiList):
 
-    """checks if run is available and lumi section was certified"""
+    """checks if run is available and lumi section was certified (runLumiList is a RunLumiIndex of the excluded lumi sections)"""
 
     #no run/lumi to select, all is good by default
     if not runLumiList:
         return True
 
-    #run is available
-    if not run in runLumiList: 
-        return True
-
-    for lran in runLumiList[run]:
-        if lumi>=lran[0] and lumi<=lran[1]:
-            return False
-
-    #reached this far, nothing found in list
-    return True
+    return not runLumiList.contains(run,lumi)
 
 def computeCosThetaStar(lm,lp):
     dil=lm+lp
@@ -203,93 +197,58 @@ def isSignalFiducial(csiPos,csiNeg,gen_pzpp):
 
 
 
-def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEvents=-1,sighyp=0,mixDir=None):
-    
-    """event loop"""
+def loadMixingBank(mixDir,inFile):
 
-    global MIXEDRPSIG
-    global ALLOWPIXMULT
+    """reads the events for the mixing which are compatible with the era/crossing angle of the file to analyse"""
+
+    MIXEDRP=defaultdict(list)
+    if not mixDir: 
+        return MIXEDRP
 
     isData=True if 'Data' in inFile else False
-    era=os.path.basename(inFile).split('_')[1] if isData else None
-    isDY=isDYFile(inFile)
     isSignal,isPreTS2Signal=isSignalFile(inFile)
-    isFullSimSignal = True if isSignal and 'fullsim' in inFile else False
-    isPhotonSignal=isPhotonSignalFile(inFile)
-    gen_mX=signalMassPoint(inFile) if isSignal else 0.
-
 
-    #open this just once as it may be quite heavy in case it's not data or signal
-    if mixDir:
- 
-        print 'Collecting events from the mixing bank'
+    print 'Collecting events from the mixing bank'
+    mixFiles=[f for f in os.listdir(mixDir) if f.endswith(MIXBANKEXT)]
+    isColumnarBank=True if len(mixFiles)>0 else False
+    if not isColumnarBank:
         mixFiles=[f for f in os.listdir(mixDir) if '.pck' in f]
         
-        #open just the necessary for signal and data
-        if isSignal or isData:
-            allowedEras=['2017%s'%x for x in 'BCDEF']
-            if isSignal:
-                allowedAngle=re.search('xangle_(\d+)',inFile).group(1)
-                mixFiles=[f for f in mixFiles if allowedAngle in f]
-                if isPreTS2Signal : 
-                    allowedEras=['2017%s'%x for x in 'BCD']
-                else : 
-                    allowedEras=['2017%s'%x for x in 'DEF']
-            if isData:
-                allowedEras=[era]
-            mixFiles=[f for f in mixFiles if f.split('_')[1] in allowedEras]
-
-        MIXEDRP=defaultdict(list)
-        for f in mixFiles:
-            print '\t',f
-            with open(os.path.join(mixDir,f),'r') as cachefile:
-                rpData=pickle.load(cachefile)
-                for key in rpData:
-                    MIXEDRP[key] += rpData[key]
-        print '\t size of mixing bank is',sys.getsizeof(MIXEDRP),'byte'
+    #open just the necessary for signal and data
+    if isSignal or isData:
+        allowedEras=['2017%s'%x for x in 'BCDEF']
+        if isSignal:
+            allowedAngle=re.search('xangle_(\d+)',inFile).group(1)
+            mixFiles=[f for f in mixFiles if allowedAngle in f]
+            if isPreTS2Signal : 
+                allowedEras=['2017%s'%x for x in 'BCD']
+            else : 
+                allowedEras=['2017%s'%x for x in 'DEF']
+        if isData:
+            allowedEras=[os.path.basename(inFile).split('_')[1]]
+        mixFiles=[f for f in mixFiles if f.split('_')[1] in allowedEras]
 
+    #columnar banks are memory-mapped
+    if isColumnarBank:
+        for f in mixFiles: print '\t',f
+        return MixingBank([os.path.join(mixDir,f) for f in mixFiles])
 
+    for f in mixFiles:
+        print '\t',f
+        with open(os.path.join(mixDir,f),'r') as cachefile:
+            rpData=pickle.load(cachefile)
+            for key in rpData:
+                MIXEDRP[key] += rpData[key]
+    print '\t size of mixing bank is',sys.getsizeof(MIXEDRP),'byte'
 
+    return MIXEDRP
 
-    #bind main tree with pileup discrimination tree, if failed return
-    tree=ROOT.TChain('analysis/data' if isSignal and not isFullSimSignal else 'tree')
-    tree.AddFile(inFile)
-    #try:
-    #    pudiscr_tree=ROOT.TChain('pudiscr')
-    #    baseName=os.path.basename(inFile)
-    #    baseDir=os.path.dirname(inFile)
-    #    pudiscr_file=os.path.join(baseDir,'pudiscr',baseName)
-    #    if not os.path.isfile(pudiscr_file):
-    #        raise ValueError(pudiscr_file+' does not exist')
-    #    pudiscr_tree.AddFile(pudiscr_file)
-    #    tree.AddFriend(pudiscr_tree)
-    #    print 'Added pu tree for',inFile
-    #except:
-    #    #print 'Failed to add pu discrimination tree as friend for',inFile
-    #    return
 
-    
-    #check if it is signal and load     
-    signalPt=[]
-    ppsEffReader=None
-    mcEff={}
-    if isSignal: 
-        ppsEffReader=PPSEfficiencyReader(ppsEffFile)
-        signalPt=[float(x) for x in re.findall(r'\d+', os.path.basename(inFile) )[2:]]
-        for ch in ['eez','mmz','a']:
-            effIn=ROOT.TFile.Open('%s/effsummary_%s_ptboson.root'%(effDir,ch))
-            pname='gen%srec_ptboson_ZH#rightarrowllbb_eff'%ch
-            if ch=='a': pname='genarec_ptboson_EWK #gammajj_eff'
-            mcEff[ch]=effIn.Get(pname)
-        effIn.Close()        
+def bookAnalysisHistos(isSignal):
 
-    #start event mixing tool
-    print MIXEDRP.keys()
-    evMixTool=EventMixingTool(mixedRP=MIXEDRP,validAngles=VALIDLHCXANGLES)
-    print 'Allowed pixel multiplicity is',ALLOWPIXMULT 
+    """books the control histograms filled in the analysis"""
 
-    #start histograms
-    ht=HistoTool()   
+    ht=HistoTool(bufferSize=HISTOBUFFER)
 
     if isSignal:
         ht.add(ROOT.TH2F('sighyp', ';Initial category; Final category;Events',16,0,16,16,0,16))
@@ -344,7 +303,80 @@ def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEve
     ht.add(ROOT.TH1F('ntk',';Track multiplicity;Events',5,0,5))
     ht.add(ROOT.TH1F('ppcount',';pp candidates;Events',3,0,3))
     ht.add(ROOT.TH1F('csi',';#xi;Events',50,0,0.3))
-        
+
+    return ht
+
+
+def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEvents=-1,sighyp=0,mixDir=None,engine='loop',chunkSize=50000):
+    
+    """
+    event loop
+    sighyp can be a list of signal hypotheses, in which case they are all analysed in the same pass over the events
+    and stored in the same output (distinguished by the sighyp branch of the summary tree)
+    """
+
+    global MIXEDRPSIG
+    global ALLOWPIXMULT
+
+    isData=True if 'Data' in inFile else False
+    era=os.path.basename(inFile).split('_')[1] if isData else None
+    isDY=isDYFile(inFile)
+    isSignal,isPreTS2Signal=isSignalFile(inFile)
+
+    #data and background simulation can be analysed with array operations (signal is kept in the event loop)
+    if engine=='columnar' and not isSignal:
+        from ColumnarExclusiveAnalysis import runExclusiveAnalysisColumnar
+        return runExclusiveAnalysisColumnar(inFile,outFileName,runLumiList,maxEvents,mixDir,ALLOWPIXMULT,chunkSize)
+
+    sighypList=sighyp if isinstance(sighyp,list) else [sighyp]
+    isFullSimSignal = True if isSignal and 'fullsim' in inFile else False
+    isPhotonSignal=isPhotonSignalFile(inFile)
+    gen_mX=signalMassPoint(inFile) if isSignal else 0.
+
+
+    #open this just once as it may be quite heavy in case it's not data or signal
+    MIXEDRP=loadMixingBank(mixDir,inFile)
+
+    #bind main tree with pileup discrimination tree, if failed return
+    tree=ROOT.TChain('analysis/data' if isSignal and not isFullSimSignal else 'tree')
+    tree.AddFile(inFile)
+    #try:
+    #    pudiscr_tree=ROOT.TChain('pudiscr')
+    #    baseName=os.path.basename(inFile)
+    #    baseDir=os.path.dirname(inFile)
+    #    pudiscr_file=os.path.join(baseDir,'pudiscr',baseName)
+    #    if not os.path.isfile(pudiscr_file):
+    #        raise ValueError(pudiscr_file+' does not exist')
+    #    pudiscr_tree.AddFile(pudiscr_file)
+    #    tree.AddFriend(pudiscr_tree)
+    #    print 'Added pu tree for',inFile
+    #except:
+    #    #print 'Failed to add pu discrimination tree as friend for',inFile
+    #    return
+
+    
+    #check if it is signal and load     
+    signalPt=[]
+    ppsEffReader=None
+    mcEff={}
+    if isSignal: 
+        ppsEffReader=PPSEfficiencyReader(ppsEffFile)
+        signalPt=[float(x) for x in re.findall(r'\d+', os.path.basename(inFile) )[2:]]
+        for ch in ['eez','mmz','a']:
+            effIn=ROOT.TFile.Open('%s/effsummary_%s_ptboson.root'%(effDir,ch))
+            pname='gen%srec_ptboson_ZH#rightarrowllbb_eff'%ch
+            if ch=='a': pname='genarec_ptboson_EWK #gammajj_eff'
+            mcEff[ch]=effIn.Get(pname)
+        effIn.Close()        
+
+    #start event mixing tool
+    print MIXEDRP.keys()
+    evMixTool=EventMixingTool(mixedRP=MIXEDRP,validAngles=VALIDLHCXANGLES)
+    print 'Allowed pixel multiplicity is',ALLOWPIXMULT 
+
+    #start histograms
+    ht=bookAnalysisHistos(isSignal)
+
     nEntries=tree.GetEntries()              
     print '....analysing',nEntries,'in',inFile,', with output @',outFileName
     if maxEvents>0:
@@ -399,7 +431,7 @@ def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEve
         elif tree.evcat==SINGLEPHOTON and (isPhotonSignal or tree.hasATrigger) :         
             evcat="a" 
         elif tree.evcat==0 and tree.hasZBTrigger : 
-            evcat=='zbias'
+            evcat='zbias'
         else : 
             nfail[0]+=1
             continue
@@ -503,13 +535,7 @@ def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEve
                                                                 neg_protons=ev_neg_protons) )
             continue
 
-        #event mixing
-        mixed_pos_protons,mixed_neg_protons,mixed_pudiscr=evMixTool.getNew(evEra=evEra,
-                                                                           beamXangle=beamXangle,
-                                                                           isData=isData,
-                                                                           validAngles=VALIDLHCXANGLES,
-                                                                           mixEvCategs=[DIMUONS,EMU])
-        ppsEff,ppsEffUnc=1.0,0.0
+        #signal efficiency and reconstructed category before projecting to the signal hypotheses
         if isSignal:
 
             ppsPosEff,ppsPosEffUnc=0.0,0.0
@@ -526,350 +552,362 @@ def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEve
             if len(ev_pos_protons[1])>0: rawSigHyp += 4
             if len(ev_pos_protons[0])>0: rawSigHyp += 8
 
-            #assign the final list of reconstructed protons depending on how the sighyp is requested
-            ev_pos_protons,ev_neg_protons,ppsEff,ppsEffUnc = ppsEffReader.getProjectedFinalState( ev_pos_protons, ppsPosEff, ppsPosEffUnc,
-                                                                                                  ev_neg_protons, ppsNegEff, ppsNegEffUnc,
-                                                                                                  sighyp)
-            #mixed_pos_protons={DIMUONS:ev_pos_protons,EMU:ev_pos_protons}
-            #mixed_neg_protons={DIMUONS:ev_neg_protons,EMU:ev_neg_protons}
-            mixed_pos_protons, mixed_neg_protons = evMixTool.mergeWithMixedEvent(ev_pos_protons, 
-                                                                                 mixed_pos_protons,
-                                                                                 ev_neg_protons,
-                                                                                 mixed_neg_protons)
+        #the same event is analysed under all the requested signal hypotheses
+        for sighyp in sighypList:
+
+            #event mixing
+            mixed_pos_protons,mixed_neg_protons,mixed_pudiscr=evMixTool.getNew(evEra=evEra,
+                                                                               beamXangle=beamXangle,
+                                                                               isData=isData,
+                                                                               validAngles=VALIDLHCXANGLES,
+                                                                               mixEvCategs=[DIMUONS,EMU])
+            ppsEff,ppsEffUnc=1.0,0.0
+            if isSignal:
+
+                #assign the final list of reconstructed protons depending on how the sighyp is requested
+                ev_pos_protons,ev_neg_protons,ppsEff,ppsEffUnc = ppsEffReader.getProjectedFinalState( copy.deepcopy(orig_ev_pos_protons), ppsPosEff, ppsPosEffUnc,
+                                                                                                      copy.deepcopy(orig_ev_neg_protons), ppsNegEff, ppsNegEffUnc,
+                                                                                                      sighyp)
+                #mixed_pos_protons={DIMUONS:ev_pos_protons,EMU:ev_pos_protons}
+                #mixed_neg_protons={DIMUONS:ev_neg_protons,EMU:ev_neg_protons}
+                mixed_pos_protons, mixed_neg_protons = evMixTool.mergeWithMixedEvent(ev_pos_protons, 
+                                                                                     mixed_pos_protons,
+                                                                                     ev_neg_protons,
+                                                                                     mixed_neg_protons)
 
 
-            orig_mixed_pos_protons, orig_mixed_neg_protons = evMixTool.mergeWithMixedEvent(orig_ev_pos_protons, 
-                                                                                           mixed_pos_protons,
-                                                                                           orig_ev_neg_protons,
-                                                                                           mixed_neg_protons)
+                orig_mixed_pos_protons, orig_mixed_neg_protons = evMixTool.mergeWithMixedEvent(orig_ev_pos_protons, 
+                                                                                               mixed_pos_protons,
+                                                                                               orig_ev_neg_protons,
+                                                                                               mixed_neg_protons)
 
 
-            #control before and after projection
-            ht.fill((rawSigHyp,sighyp,1.0),    'sighyp',  ['raw'])
-            ht.fill((rawSigHyp,sighyp,ppsEff), 'sighyp',  ['wgt'])
+                #control before and after projection
+                ht.fill((rawSigHyp,sighyp,1.0),    'sighyp',  ['raw'])
+                ht.fill((rawSigHyp,sighyp,ppsEff), 'sighyp',  ['wgt'])
 
-            n_extra_mu,nvtx,rho,PFMultSumHF,PFHtSumHF,PFPzSumHF,rfc = mixed_pudiscr[DIMUONS]
+                n_extra_mu,nvtx,rho,PFMultSumHF,PFHtSumHF,PFPzSumHF,rfc = mixed_pudiscr[DIMUONS]
 
-        #kinematics using RP tracks
-        pos_protons = ev_pos_protons if isData else mixed_pos_protons[DIMUONS]
-        neg_protons = ev_neg_protons if isData else mixed_neg_protons[DIMUONS]        
-        proton_cat,csi_pos,csi_neg,ppSystem,mmassSystem = getDiProtonCategory(pos_protons,neg_protons,boson,ALLOWPIXMULT)
+            #kinematics using RP tracks
+            pos_protons = ev_pos_protons if isData else mixed_pos_protons[DIMUONS]
+            neg_protons = ev_neg_protons if isData else mixed_neg_protons[DIMUONS]        
+            proton_cat,csi_pos,csi_neg,ppSystem,mmassSystem = getDiProtonCategory(pos_protons,neg_protons,boson,ALLOWPIXMULT)
      
-        #compare categorization with fully exclusive selection of pixels
-        ht.fill((0,ppsEff),'catcount',['inc'])
-        if len(pos_protons[1]) in ALLOWPIXMULT and len(neg_protons[1]) in ALLOWPIXMULT : 
-            ht.fill((1,ppsEff),'catcount',['inc'])
-        ht.fill((proton_cat+1,ppsEff),'catcount',['inc'])
-        if isSignal:
-            ht.fill((0,1.),'catcount',['single'])
-            if len(orig_mixed_pos_protons[DIMUONS][1]) in ALLOWPIXMULT and len(orig_mixed_neg_protons[DIMUONS][1]) in ALLOWPIXMULT:
-                ht.fill((1,1.),'catcount',['single'])
-
-
-
-        #event categories
-        cats=[]            
-        cats.append(evcat)
-        if isRPIn:
-            cats += [evcat+'rpin']
-            if proton_cat>0:
-                cats += [evcat+'rpinhpur']
-
-        #fill control plots (for signal correct wgt by ee efficiency curve and duplicate for mm channel)
-        wgt        = tree.evwgt
-        finalPlots = [[wgt,cats]]        
-        gen_pzpp   = 0
-        gen_pzwgt  = [1.,1.,1.]
-        gen_csiPos = 0.
-        gen_csiNeg = 0.
-        if isSignal:
-            true_pos_protons,true_neg_protons = getTracksPerRomanPot(tree,True)
-            if len(true_pos_protons[0])>0 : gen_csiPos=true_pos_protons[0][0]
-            if len(true_neg_protons[0])>0 : gen_csiNeg=true_neg_protons[0][0]
+            #compare categorization with fully exclusive selection of pixels
+            ht.fill((0,ppsEff),'catcount',['inc'])
+            if len(pos_protons[1]) in ALLOWPIXMULT and len(neg_protons[1]) in ALLOWPIXMULT : 
+                ht.fill((1,ppsEff),'catcount',['inc'])
+            ht.fill((proton_cat+1,ppsEff),'catcount',['inc'])
+            if isSignal:
+                ht.fill((0,1.),'catcount',['single'])
+                if len(orig_mixed_pos_protons[DIMUONS][1]) in ALLOWPIXMULT and len(orig_mixed_neg_protons[DIMUONS][1]) in ALLOWPIXMULT:
+                    ht.fill((1,1.),'catcount',['single'])
+
+
+
+            #event categories
+            cats=[]            
+            cats.append(evcat)
+            if isRPIn:
+                cats += [evcat+'rpin']
+                if proton_cat>0:
+                    cats += [evcat+'rpinhpur']
+
+            #fill control plots (for signal correct wgt by ee efficiency curve and duplicate for mm channel)
+            wgt        = tree.evwgt
+            finalPlots = [[wgt,cats]]        
+            gen_pzpp   = 0
+            gen_pzwgt  = [1.,1.,1.]
+            gen_csiPos = 0.
+            gen_csiNeg = 0.
+            if isSignal:
+                true_pos_protons,true_neg_protons = getTracksPerRomanPot(tree,True)
+                if len(true_pos_protons[0])>0 : gen_csiPos=true_pos_protons[0][0]
+                if len(true_neg_protons[0])>0 : gen_csiNeg=true_neg_protons[0][0]
             
-            gen_pzpp     = tree.gen_pzpp
-            pzwid        = 0.391*gen_mX+624
-            gen_pzwgt[0] = ROOT.TMath.Gaus(gen_pzpp,0,pzwid)
-            gen_pzwgt[1] = ROOT.TMath.Gaus(gen_pzpp,0,pzwid*1.1)/gen_pzwgt[0]
-            gen_pzwgt[2] = ROOT.TMath.Gaus(gen_pzpp,0,pzwid*0.9)/gen_pzwgt[0]
-
-            #use the sum of pz weighted events as normalization factor
-            if not isFullSimSignal:
-                if isZ:
-                    finalPlots=[ [wgt*ppsEff*gen_pzwgt[0]*mcEff['eez'].Eval(boson.Pt())/nSignalWgtSum , cats],
-                                 [wgt*ppsEff*gen_pzwgt[0]*mcEff['mmz'].Eval(boson.Pt())/nSignalWgtSum, [c.replace(evcat,'mm') for c in cats if c[0:2]=='ee']] ]
-
-                    #reject Z->ee if one electron in the transition
-                    if hasEEEBTransition:
-                        finalPlots[0][0]=0.
-
-                elif isPhotonSignal:
-                    finalPlots=[ [wgt*ppsEff*gen_pzwgt[0]*mcEff['a'].Eval(boson.Pt())/nSignalWgtSum, cats] ]
-            else:
-                finalPlots=[ [wgt*ppsEff*gen_pzwgt[0]/nSignalWgtSum, cats] ]
-
-        for pwgt,pcats in finalPlots:   
-
-            #fill plots only with fiducial signal contribution
-            if isSignal and not isSignalFiducial(gen_csiPos,gen_csiNeg,tree.gen_pzpp): continue
-
-            #boson kinematics
-            ht.fill((l1p4.Pt(),pwgt),             'l1pt',         pcats)
-            ht.fill((l2p4.Pt(),pwgt),             'l2pt',         pcats)
-            ht.fill((abs(l1p4.Eta()),pwgt),       'l1eta',        pcats)
-            ht.fill((abs(l2p4.Eta()),pwgt),       'l2eta',        pcats)
-            ht.fill((acopl,pwgt),                 'acopl',        pcats)
-            ht.fill((boson.M(),pwgt),             'mll',          pcats)
-            ht.fill((boson.M(),pwgt),             'mll_full',     pcats)
-            ht.fill((boson.Rapidity(),pwgt),      'yll',          pcats)
-            ht.fill((boson.Eta(),pwgt),           'etall',        pcats)
-            ht.fill((boson.Pt(),pwgt),            'ptll',         pcats)
-            ht.fill((boson.Pt(),pwgt),            'ptll_high',    pcats)
-            ht.fill((costhetacs,pwgt),            'costhetacs',   pcats)
+                gen_pzpp     = tree.gen_pzpp
+                pzwid        = 0.391*gen_mX+624
+                gen_pzwgt[0] = ROOT.TMath.Gaus(gen_pzpp,0,pzwid)
+                gen_pzwgt[1] = ROOT.TMath.Gaus(gen_pzpp,0,pzwid*1.1)/gen_pzwgt[0]
+                gen_pzwgt[2] = ROOT.TMath.Gaus(gen_pzpp,0,pzwid*0.9)/gen_pzwgt[0]
+
+                #use the sum of pz weighted events as normalization factor
+                if not isFullSimSignal:
+                    if isZ:
+                        finalPlots=[ [wgt*ppsEff*gen_pzwgt[0]*mcEff['eez'].Eval(boson.Pt())/nSignalWgtSum , cats],
+                                     [wgt*ppsEff*gen_pzwgt[0]*mcEff['mmz'].Eval(boson.Pt())/nSignalWgtSum, [c.replace(evcat,'mm') for c in cats if c[0:2]=='ee']] ]
+
+                        #reject Z->ee if one electron in the transition
+                        if hasEEEBTransition:
+                            finalPlots[0][0]=0.
+
+                    elif isPhotonSignal:
+                        finalPlots=[ [wgt*ppsEff*gen_pzwgt[0]*mcEff['a'].Eval(boson.Pt())/nSignalWgtSum, cats] ]
+                else:
+                    finalPlots=[ [wgt*ppsEff*gen_pzwgt[0]/nSignalWgtSum, cats] ]
+
+            for pwgt,pcats in finalPlots:   
+
+                #fill plots only with fiducial signal contribution
+                if isSignal and not isSignalFiducial(gen_csiPos,gen_csiNeg,tree.gen_pzpp): continue
+
+                #boson kinematics
+                ht.fill((l1p4.Pt(),pwgt),             'l1pt',         pcats)
+                ht.fill((l2p4.Pt(),pwgt),             'l2pt',         pcats)
+                ht.fill((abs(l1p4.Eta()),pwgt),       'l1eta',        pcats)
+                ht.fill((abs(l2p4.Eta()),pwgt),       'l2eta',        pcats)
+                ht.fill((acopl,pwgt),                 'acopl',        pcats)
+                ht.fill((boson.M(),pwgt),             'mll',          pcats)
+                ht.fill((boson.M(),pwgt),             'mll_full',     pcats)
+                ht.fill((boson.Rapidity(),pwgt),      'yll',          pcats)
+                ht.fill((boson.Eta(),pwgt),           'etall',        pcats)
+                ht.fill((boson.Pt(),pwgt),            'ptll',         pcats)
+                ht.fill((boson.Pt(),pwgt),            'ptll_high',    pcats)
+                ht.fill((costhetacs,pwgt),            'costhetacs',   pcats)
             
-            #pileup related
-            ht.fill((beamXangle,pwgt),            'xangle', pcats)
-            ht.fill((nvtx,pwgt),                  'nvtx',   pcats)
-            ht.fill((rho,pwgt),                   'rho',    pcats)
-            ht.fill((met,pwgt),                   'met',    pcats)
-            ht.fill((mpf,pwgt),                   'mpf',    pcats)
-            ht.fill((njets,pwgt),                 'njets',  pcats)
-            if njets>0: ht.fill((zjb,pwgt),       'zjb',    pcats)
-            if njets>1: ht.fill((zj2b,pwgt),      'zj2b',   pcats)
-            ht.fill((nch,pwgt),                   'nch',    pcats) 
-            #ht.fill((getattr(tree,'rfc_%d'%beamXangle),pwgt), 'rfc',         pcats)
-            ht.fill((PFMultSumHF,pwgt),     'PFMultHF',    pcats)
-            ht.fill((PFHtSumHF,pwgt),       'PFHtHF',      pcats)
-            ht.fill((PFPzSumHF/1.e3,pwgt),  'PFPZHF',      pcats)
-            ht.fill((n_extra_mu,pwgt), 'nextramu', pcats)
-            if isFullSimSignal or not isSignal:
-                ht.fill((tree.metfilters,pwgt), 'metbits', pcats)
-                for sd in ['HE','EE','EB']:
-                    ht.fill((getattr(tree,'PFMultSum'+sd),pwgt),    'PFMult'+sd, pcats)
-                    ht.fill((getattr(tree,'PFHtSum'+sd),pwgt),      'PFHt'+sd,   pcats)
-                    ht.fill((getattr(tree,'PFPzSum'+sd)/1.e3,pwgt), 'PFPZ'+sd,   pcats)
-                for mp4 in extra_muons:
-                    ht.fill((mp4.Pt(),pwgt), 'extramupt', pcats)
-                    ht.fill((abs(mp4.Eta()),pwgt), 'extramueta', pcats)
-
-            #proton counting and kinematics
-            for ip in range(3):
-                for irp,rpside in [(0,'%dpos'%ip),(1,'%dneg'%ip)]:
-                    csiColl=pos_protons[ip] if irp==0 else neg_protons[ip]
-                    ht.fill((len(csiColl),pwgt), 'ntk', pcats,rpside)
-                    for csi in csiColl:
-                        ht.fill((csi,pwgt), 'csi', pcats,rpside)                        
-
-            #diproton kinematics
-            if proton_cat<0:
-                ht.fill((0,pwgt), 'ppcount', pcats)
-            else:
-                ht.fill((1,pwgt),                   'ppcount', pcats)
-                ht.fill((ppSystem.M(),pwgt),        'mpp',     pcats)
-                ht.fill((ppSystem.Pz(),pwgt),       'pzpp',    pcats)
-                ht.fill((ppSystem.Rapidity(),pwgt), 'ypp',     pcats)                    
-                mmass=mmassSystem.M()
-                ht.fill((mmass,pwgt), 'mmass_full', pcats)
-                ht.fill((mmass,pwgt), 'mmass_full', pcats, '%d'%proton_cat)
-                if mmass>0:
-                    ht.fill((mmass,pwgt), 'mmass',  pcats)
-                    ht.fill((mmass,pwgt), 'mmass',  pcats, '%d'%proton_cat)
-
-            #signal characteristics in the absense of pileup
-            if isSignal:
-                nopu_proton_cat,nopu_csi_pos,nopu_csi_neg,nopu_ppSystem,nopu_mmassSystem = getDiProtonCategory(ev_pos_protons,ev_neg_protons,boson,ALLOWPIXMULT)
-                if nopu_proton_cat>0:
-                    nopu_mmass = nopu_mmassSystem.M()
-                    ht.fill((nopu_ppSystem.M(),pwgt),  'mpp',         pcats, 'nopu')
-                    ht.fill((nopu_mmass,pwgt),         'mmass_full',  pcats, 'nopu')
-                    ht.fill((nopu_mmass,pwgt),         'mmass_full',  pcats, '%dnopu'%nopu_proton_cat)
-                    if nopu_mmass>0:
-                        ht.fill((nopu_mmass,pwgt), 'mmass',  pcats, 'nopu')
-                        ht.fill((nopu_mmass,pwgt), 'mmass',  pcats, '%dnopu'%nopu_proton_cat)
-
-        if not isData and not isSignal and not isDY : continue
-
-        #save the event summary for the statistical analysis        
-        nMixTries=100 if isData else 1
-        for itry in range(2*nMixTries+1):
-
-            itry_wgt=wgt
+                #pileup related
+                ht.fill((beamXangle,pwgt),            'xangle', pcats)
+                ht.fill((nvtx,pwgt),                  'nvtx',   pcats)
+                ht.fill((rho,pwgt),                   'rho',    pcats)
+                ht.fill((met,pwgt),                   'met',    pcats)
+                ht.fill((mpf,pwgt),                   'mpf',    pcats)
+                ht.fill((njets,pwgt),                 'njets',  pcats)
+                if njets>0: ht.fill((zjb,pwgt),       'zjb',    pcats)
+                if njets>1: ht.fill((zj2b,pwgt),      'zj2b',   pcats)
+                ht.fill((nch,pwgt),                   'nch',    pcats) 
+                #ht.fill((getattr(tree,'rfc_%d'%beamXangle),pwgt), 'rfc',         pcats)
+                ht.fill((PFMultSumHF,pwgt),     'PFMultHF',    pcats)
+                ht.fill((PFHtSumHF,pwgt),       'PFHtHF',      pcats)
+                ht.fill((PFPzSumHF/1.e3,pwgt),  'PFPZHF',      pcats)
+                ht.fill((n_extra_mu,pwgt), 'nextramu', pcats)
+                if isFullSimSignal or not isSignal:
+                    ht.fill((tree.metfilters,pwgt), 'metbits', pcats)
+                    for sd in ['HE','EE','EB']:
+                        ht.fill((getattr(tree,'PFMultSum'+sd),pwgt),    'PFMult'+sd, pcats)
+                        ht.fill((getattr(tree,'PFHtSum'+sd),pwgt),      'PFHt'+sd,   pcats)
+                        ht.fill((getattr(tree,'PFPzSum'+sd)/1.e3,pwgt), 'PFPZ'+sd,   pcats)
+                    for mp4 in extra_muons:
+                        ht.fill((mp4.Pt(),pwgt), 'extramupt', pcats)
+                        ht.fill((abs(mp4.Eta()),pwgt), 'extramueta', pcats)
+
+                #proton counting and kinematics
+                for ip in range(3):
+                    for irp,rpside in [(0,'%dpos'%ip),(1,'%dneg'%ip)]:
+                        csiColl=pos_protons[ip] if irp==0 else neg_protons[ip]
+                        ht.fill((len(csiColl),pwgt), 'ntk', pcats,rpside)
+                        for csi in csiColl:
+                            ht.fill((csi,pwgt), 'csi', pcats,rpside)                        
+
+                #diproton kinematics
+                if proton_cat<0:
+                    ht.fill((0,pwgt), 'ppcount', pcats)
+                else:
+                    ht.fill((1,pwgt),                   'ppcount', pcats)
+                    ht.fill((ppSystem.M(),pwgt),        'mpp',     pcats)
+                    ht.fill((ppSystem.Pz(),pwgt),       'pzpp',    pcats)
+                    ht.fill((ppSystem.Rapidity(),pwgt), 'ypp',     pcats)                    
+                    mmass=mmassSystem.M()
+                    ht.fill((mmass,pwgt), 'mmass_full', pcats)
+                    ht.fill((mmass,pwgt), 'mmass_full', pcats, '%d'%proton_cat)
+                    if mmass>0:
+                        ht.fill((mmass,pwgt), 'mmass',  pcats)
+                        ht.fill((mmass,pwgt), 'mmass',  pcats, '%d'%proton_cat)
+
+                #signal characteristics in the absense of pileup
+                if isSignal:
+                    nopu_proton_cat,nopu_csi_pos,nopu_csi_neg,nopu_ppSystem,nopu_mmassSystem = getDiProtonCategory(ev_pos_protons,ev_neg_protons,boson,ALLOWPIXMULT)
+                    if nopu_proton_cat>0:
+                        nopu_mmass = nopu_mmassSystem.M()
+                        ht.fill((nopu_ppSystem.M(),pwgt),  'mpp',         pcats, 'nopu')
+                        ht.fill((nopu_mmass,pwgt),         'mmass_full',  pcats, 'nopu')
+                        ht.fill((nopu_mmass,pwgt),         'mmass_full',  pcats, '%dnopu'%nopu_proton_cat)
+                        if nopu_mmass>0:
+                            ht.fill((nopu_mmass,pwgt), 'mmass',  pcats, 'nopu')
+                            ht.fill((nopu_mmass,pwgt), 'mmass',  pcats, '%dnopu'%nopu_proton_cat)
+
+            if not isData and not isSignal and not isDY : continue
+
+            #save the event summary for the statistical analysis        
+            nMixTries=100 if isData else 1
+            for itry in range(2*nMixTries+1):
+
+                itry_wgt=wgt
             
-            #nominal 
-            if itry==0:
-                mixType           = 0 
-                i_pos_protons     = copy.deepcopy(pos_protons)
-                i_neg_protons     = copy.deepcopy(neg_protons)
-
-                #shift csi by 1%
-                i_pos_protons_syst=[]
-                i_neg_protons_syst=[]
-                for ialgo in range(3):
-                    i_pos_protons_syst.append( [1.01*x for x in pos_protons[ialgo]] )
-                    i_neg_protons_syst.append( [1.01*x for x in neg_protons[ialgo]] )
+                #nominal 
+                if itry==0:
+                    mixType           = 0 
+                    i_pos_protons     = copy.deepcopy(pos_protons)
+                    i_neg_protons     = copy.deepcopy(neg_protons)
+
+                    #shift csi by 1%
+                    i_pos_protons_syst=[]
+                    i_neg_protons_syst=[]
+                    for ialgo in range(3):
+                        i_pos_protons_syst.append( [1.01*x for x in pos_protons[ialgo]] )
+                        i_neg_protons_syst.append( [1.01*x for x in neg_protons[ialgo]] )
 
-            else:
-                #get a new event to mix
-                i_mixed_pos_protons, i_mixed_neg_protons, i_mixed_pudiscr = evMixTool.getNew(evEra=evEra,
-                                                                                             beamXangle=beamXangle,
-                                                                                             isData=isData,
-                                                                                             validAngles=VALIDLHCXANGLES,
-                                                                                             mixEvCategs=[DIMUONS,EMU])
-
-                #FIXME this is broken in this new version
-                #if MIXEDRPSIG:
-                #    sigCsi=random.choice( MIXEDRPSIG[beamXangle] )
-                #    for mixEvCat in mixed_far_rptks:
-                #        tksPos=mixed_far_rptks[mixEvCat][0]+[sigCsi[0]]
-                #        shuffle(tksPos)
-                #        tksNeg=mixed_far_rptks[mixEvCat][1]+[sigCsi[1]]
-                #        shuffle(tksNeg)
-                #        mixed_far_rptks[mixEvCat]=(tksPos,tksNeg)
-
-                #merge signal protons with pileup protons for first attempt
-                if isSignal and itry==1:
-                    i_mixed_pos_protons, i_mixed_neg_protons = evMixTool.mergeWithMixedEvent(ev_pos_protons, 
-                                                                                             i_mixed_pos_protons,
-                                                                                             ev_neg_protons,
-                                                                                             i_mixed_neg_protons)
-                    if not isFullSimSignal:
-                        n_extra_mu,nvtx,rho,PFMultSumHF,PFHtSumHF,PFPzSumHF,rfc = i_mixed_pudiscr[DIMUONS]
-
-                itry_wgt = wgt/float(nMixTries)
-
-                if itry<=nMixTries or isSignal:
-                    mixType           = 1
-                    if isSignal: mixType=itry
-                    i_pos_protons      = i_mixed_pos_protons[DIMUONS]
-                    i_neg_protons      = i_mixed_neg_protons[DIMUONS]
-                    i_pos_protons_syst = i_mixed_pos_protons[EMU]
-                    i_neg_protons_syst = i_mixed_neg_protons[EMU]
                 else:
-                    mixType            = 2
-                    i_pos_protons      = i_mixed_pos_protons[DIMUONS]
-                    i_neg_protons      = copy.deepcopy(neg_protons)
-                    i_pos_protons_syst = copy.deepcopy(pos_protons)
-                    i_neg_protons_syst = i_mixed_neg_protons[DIMUONS]                   
-
-            i_proton_cat,     i_csi_pos,     i_csi_neg,     i_ppSystem,     i_mmassSystem      = getDiProtonCategory(i_pos_protons,     i_neg_protons,      boson,ALLOWPIXMULT)
-            i_proton_cat_syst,i_csi_pos_syst,i_csi_neg_syst,i_ppSystem_syst,i_mmassSystem_syst = getDiProtonCategory(i_pos_protons_syst,i_neg_protons_syst, boson,ALLOWPIXMULT)
+                    #get a new event to mix
+                    i_mixed_pos_protons, i_mixed_neg_protons, i_mixed_pudiscr = evMixTool.getNew(evEra=evEra,
+                                                                                                 beamXangle=beamXangle,
+                                                                                                 isData=isData,
+                                                                                                 validAngles=VALIDLHCXANGLES,
+                                                                                                 mixEvCategs=[DIMUONS,EMU])
+
+                    #FIXME this is broken in this new version
+                    #if MIXEDRPSIG:
+                    #    sigCsi=random.choice( MIXEDRPSIG[beamXangle] )
+                    #    for mixEvCat in mixed_far_rptks:
+                    #        tksPos=mixed_far_rptks[mixEvCat][0]+[sigCsi[0]]
+                    #        shuffle(tksPos)
+                    #        tksNeg=mixed_far_rptks[mixEvCat][1]+[sigCsi[1]]
+                    #        shuffle(tksNeg)
+                    #        mixed_far_rptks[mixEvCat]=(tksPos,tksNeg)
+
+                    #merge signal protons with pileup protons for first attempt
+                    if isSignal and itry==1:
+                        i_mixed_pos_protons, i_mixed_neg_protons = evMixTool.mergeWithMixedEvent(ev_pos_protons, 
+                                                                                                 i_mixed_pos_protons,
+                                                                                                 ev_neg_protons,
+                                                                                                 i_mixed_neg_protons)
+                        if not isFullSimSignal:
+                            n_extra_mu,nvtx,rho,PFMultSumHF,PFHtSumHF,PFPzSumHF,rfc = i_mixed_pudiscr[DIMUONS]
+
+                    itry_wgt = wgt/float(nMixTries)
+
+                    if itry<=nMixTries or isSignal:
+                        mixType           = 1
+                        if isSignal: mixType=itry
+                        i_pos_protons      = i_mixed_pos_protons[DIMUONS]
+                        i_neg_protons      = i_mixed_neg_protons[DIMUONS]
+                        i_pos_protons_syst = i_mixed_pos_protons[EMU]
+                        i_neg_protons_syst = i_mixed_neg_protons[EMU]
+                    else:
+                        mixType            = 2
+                        i_pos_protons      = i_mixed_pos_protons[DIMUONS]
+                        i_neg_protons      = copy.deepcopy(neg_protons)
+                        i_pos_protons_syst = copy.deepcopy(pos_protons)
+                        i_neg_protons_syst = i_mixed_neg_protons[DIMUONS]                   
+
+                i_proton_cat,     i_csi_pos,     i_csi_neg,     i_ppSystem,     i_mmassSystem      = getDiProtonCategory(i_pos_protons,     i_neg_protons,      boson,ALLOWPIXMULT)
+                i_proton_cat_syst,i_csi_pos_syst,i_csi_neg_syst,i_ppSystem_syst,i_mmassSystem_syst = getDiProtonCategory(i_pos_protons_syst,i_neg_protons_syst, boson,ALLOWPIXMULT)
             
-            #if itry>nMixTries:
-            #    print itry,mixType
-            #    print '\t',i_pos_protons,i_pos_protons_syst
-            #    print '\t--->',i_proton_cat,     i_csi_pos,     i_csi_neg
-            #    print '\t',i_neg_protons,i_neg_protons_syst
-            #    print '\t--->',i_proton_cat_syst,i_csi_pos_syst,i_csi_neg_syst
-
-            passAtLeastOneSelection=(i_proton_cat>0 or i_proton_cat_syst>0)
-
-            #start event summary
-            evSummary.reset()
-            evSummary.sighyp[0]=int(sighyp)
-            if isData:
-                evSummary.run[0]=int(tree.run)
-                evSummary.event[0]=long(tree.event)
-                evSummary.lumi[0]=int(tree.lumi)
-
-            evSummary.era[0]=int(ord(evEra[-1]))            
-            evSummary.cat[0]=int(tree.evcat)
-            evSummary.isOffZ[0]=int(isOffZ)
-            evSummary.wgt[0]=itry_wgt
-            evSummary.xangle[0]=int(beamXangle)
-            evSummary.l1pt[0]=l1p4.Pt()
-            evSummary.l1eta[0]=l1p4.Eta()
-            evSummary.l2pt[0]=l2p4.Pt()
-            evSummary.l2eta[0]=l2p4.Eta()
-            evSummary.bosonm[0]=boson.M()
-            evSummary.bosonpt[0]=boson.Pt()
-            evSummary.bosoneta[0]=boson.Eta()
-            evSummary.bosony[0]=boson.Rapidity()
-            evSummary.acopl[0]=acopl
-            evSummary.costhetacs[0]=costhetacs            
-            evSummary.njets[0]=int(njets)
-            evSummary.mpf[0]=mpf
-            evSummary.zjb[0]=zjb
-            evSummary.zj2b[0]=zj2b
-            evSummary.nch[0]=int(nch)
-            evSummary.nvtx[0]=int(nvtx)
-            evSummary.rho[0]=rho
-            evSummary.PFMultSumHF[0]=int(PFMultSumHF)
-            evSummary.PFHtSumHF[0]=PFHtSumHF
-            evSummary.PFPzSumHF[0]=PFPzSumHF
-            evSummary.rfc[0]=rfc
-            evSummary.gen_pzpp[0]=gen_pzpp
-            evSummary.gen_pzwgtUp[0]=gen_pzwgt[1]
-            evSummary.gen_pzwgtDown[0]=gen_pzwgt[2]
-            evSummary.gencsi1[0]=gen_csiPos
-            evSummary.gencsi2[0]=gen_csiNeg
-
-            #vary boson energy scale
-            if i_ppSystem:
-                boson_up=boson*1.03
-                evSummary.mmissvup[0]= buildMissingMassSystem(i_ppSystem,boson_up).M()
-                boson_dn=boson*0.97
-                evSummary.mmissvdn[0]= buildMissingMassSystem(i_ppSystem,boson_dn).M() 
-
-            evSummary.mixType[0]=mixType
-            evSummary.protonCat[0]=i_proton_cat
-            if i_proton_cat>0:
-                evSummary.csi1   [0]= i_csi_pos
-                evSummary.csi2   [0]= i_csi_neg
-                evSummary.mpp    [0]= i_ppSystem.M()
-                evSummary.ypp    [0]= i_ppSystem.Rapidity()
-                evSummary.pzpp   [0]= i_ppSystem.Pz()
-                evSummary.mmiss  [0]= i_mmassSystem.M()
-                evSummary.ymmiss [0]= i_mmassSystem.Rapidity()
-                evSummary.ppsEff[0]=ppsEff
-                evSummary.ppsEffUnc[0]=ppsEffUnc                
-
-            evSummary.systprotonCat[0]=i_proton_cat_syst
-            if i_proton_cat_syst>0:
-                evSummary.systcsi1   [0]= i_csi_pos_syst
-                evSummary.systcsi2   [0]= i_csi_neg_syst
-                evSummary.systmpp    [0]= i_ppSystem_syst.M()
-                evSummary.systypp    [0]= i_ppSystem_syst.Rapidity()
-                evSummary.systpzpp   [0]= i_ppSystem_syst.Pz()
-                evSummary.systmmiss  [0]= i_mmassSystem_syst.M()
-                evSummary.systymmiss [0]= i_mmassSystem_syst.Rapidity()
-                evSummary.systppsEff[0]=ppsEff
-                evSummary.systppsEffUnc[0]=ppsEffUnc                
-
-
-            #if no selection passes the cuts ignore its summary
-            if not passAtLeastOneSelection: continue
-
-            #for signal update the event weight for ee/mm/photon hypothesis
-            if isData or isDY:
-                tOut.Fill()
-
-            elif isFullSimSignal:
-                origWgt          = evSummary.wgt[0]
-                evSummary.wgt[0] = origWgt*gen_pzwgt[0]/nSignalWgtSum
-                tOut.Fill()
-
-            elif isSignal:
-
-                origWgt=evSummary.wgt[0]
-
-                if isZ:
-                    #add a copy for ee
-                    if not hasEEEBTransition:                        
-                        evSummary.cat[0]=DIELECTRONS
-                        evSummary.wgt[0]=origWgt*gen_pzwgt[0]*mcEff['eez'].Eval(boson.Pt())/nSignalWgtSum
-                        tOut.Fill()
-                
-                    #add a copy for mm
-                    evSummary.cat[0]=DIMUONS
-                    evSummary.wgt[0]=origWgt*gen_pzwgt[0]*mcEff['mmz'].Eval(boson.Pt())/nSignalWgtSum
+                #if itry>nMixTries:
+                #    print itry,mixType
+                #    print '\t',i_pos_protons,i_pos_protons_syst
+                #    print '\t--->',i_proton_cat,     i_csi_pos,     i_csi_neg
+                #    print '\t',i_neg_protons,i_neg_protons_syst
+                #    print '\t--->',i_proton_cat_syst,i_csi_pos_syst,i_csi_neg_syst
+
+                passAtLeastOneSelection=(i_proton_cat>0 or i_proton_cat_syst>0)
+
+                #start event summary
+                evSummary.reset()
+                evSummary.sighyp[0]=int(sighyp)
+                if isData:
+                    evSummary.run[0]=int(tree.run)
+                    evSummary.event[0]=long(tree.event)
+                    evSummary.lumi[0]=int(tree.lumi)
+
+                evSummary.era[0]=int(ord(evEra[-1]))            
+                evSummary.cat[0]=int(tree.evcat)
+                evSummary.isOffZ[0]=int(isOffZ)
+                evSummary.wgt[0]=itry_wgt
+                evSummary.xangle[0]=int(beamXangle)
+                evSummary.l1pt[0]=l1p4.Pt()
+                evSummary.l1eta[0]=l1p4.Eta()
+                evSummary.l2pt[0]=l2p4.Pt()
+                evSummary.l2eta[0]=l2p4.Eta()
+                evSummary.bosonm[0]=boson.M()
+                evSummary.bosonpt[0]=boson.Pt()
+                evSummary.bosoneta[0]=boson.Eta()
+                evSummary.bosony[0]=boson.Rapidity()
+                evSummary.acopl[0]=acopl
+                evSummary.costhetacs[0]=costhetacs            
+                evSummary.njets[0]=int(njets)
+                evSummary.mpf[0]=mpf
+                evSummary.zjb[0]=zjb
+                evSummary.zj2b[0]=zj2b
+                evSummary.nch[0]=int(nch)
+                evSummary.nvtx[0]=int(nvtx)
+                evSummary.rho[0]=rho
+                evSummary.PFMultSumHF[0]=int(PFMultSumHF)
+                evSummary.PFHtSumHF[0]=PFHtSumHF
+                evSummary.PFPzSumHF[0]=PFPzSumHF
+                evSummary.rfc[0]=rfc
+                evSummary.gen_pzpp[0]=gen_pzpp
+                evSummary.gen_pzwgtUp[0]=gen_pzwgt[1]
+                evSummary.gen_pzwgtDown[0]=gen_pzwgt[2]
+                evSummary.gencsi1[0]=gen_csiPos
+                evSummary.gencsi2[0]=gen_csiNeg
+
+                #vary boson energy scale
+                if i_ppSystem:
+                    boson_up=boson*1.03
+                    evSummary.mmissvup[0]= buildMissingMassSystem(i_ppSystem,boson_up).M()
+                    boson_dn=boson*0.97
+                    evSummary.mmissvdn[0]= buildMissingMassSystem(i_ppSystem,boson_dn).M() 
+
+                evSummary.mixType[0]=mixType
+                evSummary.protonCat[0]=i_proton_cat
+                if i_proton_cat>0:
+                    evSummary.csi1   [0]= i_csi_pos
+                    evSummary.csi2   [0]= i_csi_neg
+                    evSummary.mpp    [0]= i_ppSystem.M()
+                    evSummary.ypp    [0]= i_ppSystem.Rapidity()
+                    evSummary.pzpp   [0]= i_ppSystem.Pz()
+                    evSummary.mmiss  [0]= i_mmassSystem.M()
+                    evSummary.ymmiss [0]= i_mmassSystem.Rapidity()
+                    evSummary.ppsEff[0]=ppsEff
+                    evSummary.ppsEffUnc[0]=ppsEffUnc                
+
+                evSummary.systprotonCat[0]=i_proton_cat_syst
+                if i_proton_cat_syst>0:
+                    evSummary.systcsi1   [0]= i_csi_pos_syst
+                    evSummary.systcsi2   [0]= i_csi_neg_syst
+                    evSummary.systmpp    [0]= i_ppSystem_syst.M()
+                    evSummary.systypp    [0]= i_ppSystem_syst.Rapidity()
+                    evSummary.systpzpp   [0]= i_ppSystem_syst.Pz()
+                    evSummary.systmmiss  [0]= i_mmassSystem_syst.M()
+                    evSummary.systymmiss [0]= i_mmassSystem_syst.Rapidity()
+                    evSummary.systppsEff[0]=ppsEff
+                    evSummary.systppsEffUnc[0]=ppsEffUnc                
+
+
+                #if no selection passes the cuts ignore its summary
+                if not passAtLeastOneSelection: continue
+
+                #for signal update the event weight for ee/mm/photon hypothesis
+                if isData or isDY:
                     tOut.Fill()
-                
-                if isA:
-                    #add a copy for the photon
-                    evSummary.cat[0]=SINGLEPHOTON
-                    evSummary.wgt[0]=origWgt*gen_pzwgt[0]*mcEff['a'].Eval(boson.Pt())/nSignalWgtSum
+
+                elif isFullSimSignal:
+                    origWgt          = evSummary.wgt[0]
+                    evSummary.wgt[0] = origWgt*gen_pzwgt[0]/nSignalWgtSum
                     tOut.Fill()
 
+                elif isSignal:
+
+                    origWgt=evSummary.wgt[0]
+
+                    if isZ:
+                        #add a copy for ee
+                        if not hasEEEBTransition:                        
+                            evSummary.cat[0]=DIELECTRONS
+                            evSummary.wgt[0]=origWgt*gen_pzwgt[0]*mcEff['eez'].Eval(boson.Pt())/nSignalWgtSum
+                            tOut.Fill()
+                
+                        #add a copy for mm
+                        evSummary.cat[0]=DIMUONS
+                        evSummary.wgt[0]=origWgt*gen_pzwgt[0]*mcEff['mmz'].Eval(boson.Pt())/nSignalWgtSum
+                        tOut.Fill()
+                
+                    if isA:
+                        #add a copy for the photon
+                        evSummary.cat[0]=SINGLEPHOTON
+                        evSummary.wgt[0]=origWgt*gen_pzwgt[0]*mcEff['a'].Eval(boson.Pt())/nSignalWgtSum
+                        tOut.Fill()
+
     #dump events for the mixing
     nSelRPData=sum([len(rpData[x]) for x in rpData])
     if nSelRPData>0:
@@ -936,9 +974,7 @@ def runAnalysisTasks(opt):
         task_dict[tag].append( os.path.join(opt.input,file_path) )
 
     #parse json file with list of run/lumi sections
-    with open(opt.RPout,'r') as cachefile:        
-        runLumi=json.load(cachefile,  encoding='utf-8', object_pairs_hook=OrderedDict).items()
-        runLumi={int(x[0]):x[1] for x in runLumi}
+    runLumi=getRunLumiIndex(opt.RPout,os.path.join(opt.output,'.runlumiindex.npz'))
 
     global ALLOWPIXMULT
     if opt.allowPix:
@@ -964,12 +1000,15 @@ def runAnalysisTasks(opt):
                 MIXEDRPSIG[a].append( (data.csi1,data.csi2) )
             fIn.Close()
             print '\t',a,'murad has',len(MIXEDRPSIG[a]),'events'
+
+    #convert the PPS efficiency files once, the signal tasks read the arrays from the cache
+    if any([isSignalFile(x)[0] for x in task_dict]) and not opt.ppsEffFile.endswith('.npz'):
+        opt.ppsEffFile=buildPPSEfficiencyCache(opt.ppsEffFile,os.path.join(opt.output,'.ppseffcache.npz'))
     
     #create the tasks and submit them
     import multiprocessing as MP
     pool = MP.Pool(opt.jobs)
     task_list=[]
-    mergeList={}
     for x in task_dict.keys():
         
         isData     = True if 'Data' in x else False
@@ -977,24 +1016,13 @@ def runAnalysisTasks(opt):
         if opt.step==0 and not isData : continue
         runLumiList=runLumi if isData else None
         for f in task_dict[x]:
-            if isSignal:
-                sigOut='%s/Chunks/%s'%(opt.output,os.path.basename(f))
-                mergeList[sigOut]=[]
-                for sighyp in range(16):
-                    fOut=sigOut.replace('.root','_%d.root'%sighyp)
-                    mergeList[sigOut].append(fOut)
-                    task_list.append( (f,fOut,runLumiList,opt.effDir,opt.ppsEffFile,opt.maxEvents,sighyp,opt.mix) )
-            else:
-                fOut='%s/Chunks/%s'%(opt.output,os.path.basename(f))
-                task_list.append( (f,fOut,runLumiList,opt.effDir,opt.ppsEffFile,opt.maxEvents,0,opt.mix) )
+            fOut='%s/Chunks/%s'%(opt.output,os.path.basename(f))
 
-    pool.map(runExclusiveAnalysisPacked,task_list)
+            #signal files are read once for all the 16 signal hypotheses
+            sighyp=list(range(16)) if isSignal else 0
+            task_list.append( (f,fOut,runLumiList,opt.effDir,opt.ppsEffFile,opt.maxEvents,sighyp,opt.mix,opt.engine,opt.chunkSize) )
 
-    #signals need to be merged
-    for fOut,fList in mergeList.items():
-        fListStr=' '.join(fList)
-        os.system('hadd -f -k %s %s'%(fOut,fListStr))
-        os.system('rm %s'%fListStr)
+    pool.map(runExclusiveAnalysisPacked,task_list)
 
 
 
@@ -1015,6 +1043,17 @@ def main():
                       default=-1,
                       type=int,
                       help='# of events to process [default: %default]')
+    parser.add_option('--engine',
+                      dest='engine', 
+                      default='loop',
+                      type='choice',
+                      choices=['loop','columnar'],
+                      help='loop: event-by-event loop; columnar: array-based processing of data and background [default: %default]')
+    parser.add_option('--chunkSize',
+                      dest='chunkSize', 
+                      default=50000,
+                      type=int,
+                      help='# of events read at once by the columnar engine [default: %default]')
     parser.add_option('--allowPix',
                       dest='allowPix', 
                       default='1,2',
@@ -238,40 +238,12 @@ def runTrainJob(url,features,spectators,categs,onlyThis,opt):
     nEntries=len(data['s'])
     print nEntries,'events available at start'
     if opt.RPout:
-        with open(opt.RPout,'r') as cache:
-
-            #read RP out json file
-            runLumi=json.load(cache,  encoding='utf-8', object_pairs_hook=OrderedDict).items()
-            runLumiList={int(x[0]):x[1] for x in runLumi}
-
-            #build a filter
-            filt=[]
-            nFilt=0
-            print 'Filtering out runs in which the RP were out'
-            for i in range(nEntries):
-
-                if i%10000==0 : 
-                    fracDone=int(float(100.*i)/float(nEntries))
-                    fracFilt=int(float(100.*nFilt)/float(nEntries))
-                    sys.stdout.write('\r [ %d/100 ] done [ %d/100 ] to be filtered' %(fracDone,fracFilt))
-
-                run,lumi=int(data['s'][i][1]),int(data['s'][i][2])
-                rpInFlag=True
-                if run in runLumiList:                 
-                    for lran in runLumiList[run]:
-                        if lumi<lran[0]: continue
-                        if lumi>lran[1]: continue
-                        rpInFlag=False
-                        nFilt+=1
-                        break
-            
-                filt.append(rpInFlag)
-
-            #apply filter
-            filt=np.array(filt)
-            for key in data: data[key]=data[key][filt]
-
-            print '%d%% events removed as RP were out of the run'%fracFilt
+        from TopLJets2015.TopAnalysis.RunLumiIndex import getRunLumiIndex
+        runLumiList=getRunLumiIndex(opt.RPout)
+        print 'Filtering out runs in which the RP were out'
+        filt=~runLumiList.mask(data['s'][:,1],data['s'][:,2])
+        for key in data: data[key]=data[key][filt]
+        print '%d%% events removed as RP were out of the run'%int(100.*(nEntries-filt.sum())/max(nEntries,1))
 
     print 'Converted to numpy array' 
 
@@ -6,7 +6,7 @@ import sys
 import os
 from collections import OrderedDict
 from TopLJets2015.TopAnalysis.Plot import fixExtremities
-from TopLJets2015.TopAnalysis.gaussianFilterSmoother import GFSmoother
+from TopLJets2015.TopAnalysis.gaussianFilterSmoother import smoothHistograms
 
 def showVariation(h,varList,warns,output):
     
@@ -191,13 +191,13 @@ def getBinByBinUncertaintiesForSysts(h,hvars,method=2):
     return histos
 
 
-def applySmoothing(h,ntoys=100,sigma=1):
+def applySmoothing(h,ntoys=10000,sigma=1):
 
-    """ applies a Gaussian KDE smoothing to the histogram """
+    """ applies a Gaussian KDE smoothing to the histogram (or list of histograms, which are smoothed at once) """
 
-    print '[applySmoothing] with ',h.GetName(),'toys=',ntoys
-    gfs=GFSmoother(h,ntoys=ntoys,sigma=sigma)
-    h=gfs.smooth
+    hlist=h if isinstance(h,list) else [h]
+    print '[applySmoothing] with ',','.join([x.GetName() for x in hlist]),'toys=',ntoys
+    smoothHistograms(hlist,ntoys=ntoys,sigma=sigma)
     return h
 
 def getUncertaintiesFromProjection(opt,fIn,d,proc_systs,hnom):
@@ -227,7 +227,6 @@ def getUncertaintiesFromProjection(opt,fIn,d,proc_systs,hnom):
             h2d,ybin=allSysts[ slist[0] ]
             varUp=h2d.ProjectionX('varup',ybin,ybin)
             fixExtremities(varUp) #add the overflow as for the main plot
-            if smooth: applySmoothing(varUp)
         except:            
             errors.append('Failed to prepare %s'%slist[0])
             continue
@@ -240,10 +239,10 @@ def getUncertaintiesFromProjection(opt,fIn,d,proc_systs,hnom):
                 h2d,ybin=allSysts[ slist[1] ]
                 varDn=h2d.ProjectionX('vardn',ybin,ybin)
                 fixExtremities(varDn) #add the overflow as for the main plot
-                if smooth: applySmoothing(varDn)
             except:
                 errors.append('Failed to prepare %s'%slist[1])
                 continue
+            if smooth: applySmoothing([varUp,varDn])
 
         #make an envelope if several are available
         elif len(slist)>2:
@@ -252,12 +251,17 @@ def getUncertaintiesFromProjection(opt,fIn,d,proc_systs,hnom):
                 varUp.Reset('ICE')
                 varUp.Add(hnom) 
                 varDn=hnom.Clone('vardn')
-                for s_i in slist:
 
+                #project (and smooth at once) all the variations
+                vartemps=[]
+                for s_i in slist:
                     h2d,ybin=allSysts[ s_i ]
-                    vartemp=h2d.ProjectionX('vartemp',ybin,ybin)
+                    vartemp=h2d.ProjectionX('vartemp%d'%len(vartemps),ybin,ybin)
                     fixExtremities(vartemp) #add the overflow as for the main plot
-                    if smooth: applySmoothing(vartemp)
+                    vartemps.append(vartemp)
+                if smooth: applySmoothing(vartemps)
+
+                for vartemp in vartemps:
 
                     #do max(var_i-nom,var_j-nom) per bin
                     for xbin in range(hnom.GetNbinsX()):
@@ -279,6 +283,9 @@ def getUncertaintiesFromProjection(opt,fIn,d,proc_systs,hnom):
                 errors.append('Failed to prepare %s'%s_i)
                 continue
 
+        #single variation to be mirrored
+        elif smooth:
+            applySmoothing(varUp)
 
         #mirror the shape if down variation is not available yet
         if not varDn:
@@ -356,13 +363,13 @@ def getDirectUncertainties(opt,fIn,d,proc_systs,hnom):
 
                 if not h: continue
                 h.GetName()
-                if smooth: applySmoothing(h)
                 varH.append(h)
         except Exception as e:
             print s_i
             print e
             pass
         if len(varH)==0 : continue
+        if smooth: applySmoothing(varH)
 
         #mirror the shape if only one variation is available
         if len(varH)==1:
@@ -0,0 +1,84 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+ROOT = pytest.importorskip('ROOT')
+root_numpy = pytest.importorskip('root_numpy')
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'../analysis/pps'))
+from CutScanTool import CutScanTool, getCutThresholds
+
+PRESEL='xangle==120 && mixType==1'
+BINS=(20,0,2500)
+
+def getTree(n=3000,seed=1):
+
+    """tree with negative weights, integer variables (ties with the thresholds) and masses beyond the histogram range"""
+
+    rng=np.random.RandomState(seed)
+    arr=np.zeros(n,dtype=[('mmiss',np.float64),('wgt',np.float64),('csi1',np.float64),('csi2',np.float64),
+                          ('bosonpt',np.float64),('nvtx',np.int32),('xangle',np.int32),('mixType',np.int32)])
+    arr['mmiss']=rng.uniform(-200,2800,n)
+    arr['wgt']=rng.normal(1,0.5,n)
+    arr['csi1']=rng.uniform(0.02,0.1,n)
+    arr['csi2']=rng.uniform(0.02,0.1,n)
+    arr['bosonpt']=rng.exponential(50,n)
+    arr['nvtx']=rng.poisson(20,n)
+    arr['xangle']=rng.choice([120,130],n)
+    arr['mixType']=rng.choice([0,1],n)
+    return root_numpy.array2tree(arr)
+
+def getDrawContents(tree,cut):
+
+    """histogram of a single selection with TTree::Draw, as done for each threshold before the scan tool"""
+
+    tree.Draw('mmiss >> (%d,%f,%f)'%BINS,'wgt*(%s && %s)'%(PRESEL,cut),'goff')
+    h=tree.GetHistogram()
+    return np.array([h.GetBinContent(xbin) for xbin in xrange(BINS[0]+2)])
+
+@pytest.fixture(scope='module')
+def tree():
+    return getTree()
+
+@pytest.mark.parametrize('scanVar,op,thresholds',[('TMath::Min(csi1,csi2)','>',[0.05,0.03,0.07]),
+                                                  ('nvtx',                 '>=',[25,15,20]),
+                                                  ('nvtx',                 '<', [20,10,30]),
+                                                  ('nvtx',                 '>', [25,15,20]),
+                                                  ('nvtx',                 '<=',[20,10,30]),
+                                                  ('bosonpt',              '<=',[40,100,60])])
+def test_scan_matches_draw(tree,scanVar,op,thresholds):
+    tool=CutScanTool(tree,'mmiss','wgt',BINS,[scanVar,'bosonpt'],presel=PRESEL)
+    sumw,_=tool.scan([(scanVar,op,thresholds)],[('bosonpt','>',20)])
+    for i,val in enumerate(thresholds):
+        ref=getDrawContents(tree,'%s%s%s && bosonpt>20'%(scanVar,op,val))
+        assert np.allclose(sumw[i],ref,rtol=1e-4,atol=1e-4)
+
+def test_grid_matches_draw(tree):
+    grid=[('TMath::Min(csi1,csi2)','>',[0.04,0.06]),('nvtx','<',[18,22,26])]
+    tool=CutScanTool(tree,'mmiss','wgt',BINS,[x[0] for x in grid],presel=PRESEL)
+    sumw,sumw2=tool.scan(grid)
+    assert sumw.shape==(2,3,BINS[0]+2)
+    for i,csi in enumerate(grid[0][2]):
+        for j,nvtx in enumerate(grid[1][2]):
+            cut='TMath::Min(csi1,csi2)>%f && nvtx<%d'%(csi,nvtx)
+            assert np.allclose(sumw[i,j],getDrawContents(tree,cut),rtol=1e-4,atol=1e-4)
+
+            #the errors of the histogram are the ones of a weighted TTree::Draw
+            h=tool.getHistogram('h_%d_%d'%(i,j),sumw[i,j],sumw2[i,j])
+            tree.Draw('mmiss >> (%d,%f,%f)'%BINS,'wgt*(%s && %s)'%(PRESEL,cut),'goff')
+            href=tree.GetHistogram()
+            href.Sumw2()
+            for xbin in xrange(BINS[0]+2):
+                assert np.allclose(h.GetBinError(xbin),href.GetBinError(xbin),rtol=1e-4,atol=1e-4)
+
+def test_unknown_operator(tree):
+    tool=CutScanTool(tree,'mmiss','wgt',BINS,['nvtx'],presel=PRESEL)
+    with pytest.raises(ValueError):
+        tool.scan([('nvtx','==',[20])])
+
+def test_cut_thresholds():
+    assert getCutThresholds('bosonpt>40 && TMath::Min(csi1,csi2)>=0.035 && nvtx<20')==[('bosonpt','>',40.),
+                                                                                     ('TMath::Min(csi1,csi2)','>=',0.035),
+                                                                                     ('nvtx','<',20.)]
+    with pytest.raises(ValueError):
+        getCutThresholds('bosonpt>40 || nvtx<20')
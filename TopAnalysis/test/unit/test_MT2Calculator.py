@@ -0,0 +1,48 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+ROOT = pytest.importorskip('ROOT')
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'../../scripts'))
+from MT2Calculator import calcMt2, calcMt2Arrays
+
+def getTLV(m,px,py,pz=0.):
+    p4=ROOT.TLorentzVector()
+    p4.SetXYZM(px,py,pz,m)
+    return p4
+
+def getMt2Loop(vis1,vis2,child,rng):
+
+    """MT2 computed one event at a time with calcMt2, the masses are updated to the ones returned by M()"""
+
+    mt2=[]
+    for i in xrange(len(vis1)):
+        p4s=[getTLV(r[0],r[1],r[2],rng.normal(0,50)) for r in (vis1[i],vis2[i],child[i])]
+        vis1[i,0],vis2[i,0],child[i,0]=[p4.M() for p4 in p4s]
+        mt2.append( calcMt2(*p4s) )
+    return np.array(mt2)
+
+def getInputs(n,seed=7):
+    rng=np.random.RandomState(seed)
+    def getArray(masses,sigma):
+        return np.c_[rng.choice(masses,n),rng.normal(0,sigma,n),rng.normal(0,sigma,n)]
+    return getArray([0.,0.000511,0.105,4.8,30.],60),getArray([0.,0.105,4.8,80.],60),getArray([0.,0.,10.],80)
+
+def test_arrays_match_loop():
+    vis1,vis2,child=getInputs(500)
+    ref=getMt2Loop(vis1,vis2,child,np.random.RandomState(8))
+    assert np.allclose(calcMt2Arrays(vis1,vis2,child),ref,rtol=1e-9,atol=1e-9)
+
+def test_edge_cases():
+    #massless and equal-mass visible systems, swapped inputs and no MET
+    vis1=np.array([[0.,30.,0.],[0.,10.,-20.],[4.8,30.,5.],[80.,40.,40.],[0.105,25.,0.],[0.,50.,10.]])
+    vis2=np.array([[0.,-30.,0.],[0.,10.,-20.],[4.8,-20.,5.],[0.,-40.,10.],[0.105,0.,25.],[0.,-50.,-10.]])
+    child=np.array([[0.,0.,0.],[0.,-20.,40.],[0.,-10.,-10.],[0.,0.,-50.],[10.,-25.,-25.],[0.,0.,0.]])
+    ref=getMt2Loop(vis1,vis2,child,np.random.RandomState(9))
+    assert np.allclose(calcMt2Arrays(vis1,vis2,child),ref,rtol=1e-9,atol=1e-9)
+    assert np.allclose(calcMt2Arrays(vis2,vis1,child),ref,rtol=1e-9,atol=1e-9)
+
+def test_chunks():
+    vis1,vis2,child=getInputs(1000,seed=10)
+    assert np.array_equal(calcMt2Arrays(vis1,vis2,child,chunkSize=64),calcMt2Arrays(vis1,vis2,child))
@@ -0,0 +1,99 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+ROOT = pytest.importorskip('ROOT')
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'../analysis/pps'))
+from PPSEfficiencyReader import PPSEfficiencyReader, getHistoArrays
+
+ERAS=['2017B','2017F']
+XANGLES=[120,150]
+EDGES=np.array([0.02,0.03,0.045,0.06,0.1,0.2])
+
+def getPPSEfficiencyLoop(allEffs,era,xangle,xi,rp,applyMultiTrack=False):
+
+    """look-up with TH1::FindBin, as done before the histograms were converted to arrays"""
+
+    sector=45 if rp<100 else 56
+    eff,effUnc=1.0,0.0
+    if applyMultiTrack:
+        eff *= allEffs['h%dmultitrackeff_%s_avg_RP%d'%(sector,era,rp)].GetBinContent(1)
+    raddam=allEffs['h%d_%s_%d_1D'%(sector,era,xangle)]
+    raddamUnc=allEffs['h%derrors_%s_%d_1D'%(sector,era,xangle)]
+    ibin=raddam.FindBin(xi)
+    ieff=raddam.GetBinContent(ibin)
+    if ieff>0:
+        eff    *= ieff
+        effUnc += (raddamUnc.GetBinError(ibin)/ieff)**2
+    return eff,eff*np.sqrt(effUnc)
+
+def getEfficiencyHistos(seed=1):
+
+    """efficiency histograms with variable bins, filled under/overflows and an empty bin"""
+
+    rng=np.random.RandomState(seed)
+    allEffs={}
+    for sector,rp in [(45,3),(56,103)]:
+        for era in ERAS:
+            h=ROOT.TH1F('h%dmultitrackeff_%s_avg_RP%d'%(sector,era,rp),'',1,0,1)
+            h.SetDirectory(0)
+            h.SetBinContent(1,rng.uniform(0.8,1))
+            allEffs[h.GetName()]=h
+            for xangle in XANGLES:
+                for pfix in ['','errors']:
+                    h=ROOT.TH1F('h%d%s_%s_%d_1D'%(sector,pfix,era,xangle),'',len(EDGES)-1,EDGES)
+                    h.SetDirectory(0)
+                    for xbin in xrange(len(EDGES)+1):
+                        h.SetBinContent(xbin,rng.uniform(0.5,1))
+                        h.SetBinError(xbin,rng.uniform(0.01,0.1))
+                    h.SetBinContent(3,0.)
+                    allEffs[h.GetName()]=h
+    return allEffs
+
+@pytest.fixture
+def reader(tmpdir):
+    allEffs=getEfficiencyHistos()
+    arrays={}
+    for hname,h in allEffs.items():
+        edges,contents,errors=getHistoArrays(h)
+        arrays[hname+'_edges']=edges
+        arrays[hname+'_contents']=contents
+        arrays[hname+'_errors']=errors
+    cacheUrl=str(tmpdir.join('ppseff.npz'))
+    with open(cacheUrl,'wb') as cache:
+        np.savez(cache,**arrays)
+    return PPSEfficiencyReader(cacheUrl),allEffs
+
+def getXiValues(seed=2):
+
+    """random xi values, the bin edges and values outside the histogram range"""
+
+    return np.concatenate([np.random.RandomState(seed).uniform(0.,0.25,200),EDGES,[0.,0.01,0.25]])
+
+@pytest.mark.parametrize('rp,applyMultiTrack',[(3,False),(103,True)])
+def test_single_lookup_matches_findbin(reader,rp,applyMultiTrack):
+    reader,allEffs=reader
+    for era in ERAS:
+        for xangle in XANGLES:
+            for xi in getXiValues():
+                ref=getPPSEfficiencyLoop(allEffs,era,xangle,xi,rp,applyMultiTrack)
+                assert np.allclose(reader.getPPSEfficiency(era,xangle,xi,rp,applyMultiTrack=applyMultiTrack),ref,rtol=1e-6)
+
+@pytest.mark.parametrize('rp,applyMultiTrack',[(3,False),(103,True)])
+def test_array_lookup_matches_findbin(reader,rp,applyMultiTrack):
+    reader,allEffs=reader
+    rng=np.random.RandomState(3)
+    xis=getXiValues()
+    eras=rng.choice(ERAS,len(xis))
+    xangles=rng.choice(XANGLES,len(xis))
+    eff,effUnc=reader.getPPSEfficiencyArrays(eras,xangles,xis,rp,applyMultiTrack=applyMultiTrack)
+    ref=np.array([getPPSEfficiencyLoop(allEffs,era,xangle,xi,rp,applyMultiTrack) for era,xangle,xi in zip(eras,xangles,xis)])
+    assert np.allclose(eff,ref[:,0],rtol=1e-6)
+    assert np.allclose(effUnc,ref[:,1],rtol=1e-6)
+
+def test_pixels_have_full_efficiency(reader):
+    reader,_=reader
+    eff,effUnc=reader.getPPSEfficiencyArrays(ERAS,XANGLES,[0.05,0.07],3,isMulti=False)
+    assert np.array_equal(eff,[1.,1.]) and np.array_equal(effUnc,[0.,0.])
+    assert reader.getPPSEfficiency(ERAS[0],XANGLES[0],0.05,3,isMulti=False)==(1.,0.)
@@ -0,0 +1,148 @@
+import math
+import pytest
+import numpy as np
+
+ROOT = pytest.importorskip('ROOT')
+from TopLJets2015.TopAnalysis.Plot import *
+
+#
+# per-bin implementations which were replaced by the array helpers, used as reference
+#
+
+def fixExtremitiesLoop(h):
+    fbin  = h.GetBinContent(0) + h.GetBinContent(1)
+    fbine = math.sqrt(h.GetBinError(0)**2 + h.GetBinError(1)**2)
+    h.SetBinContent(1,fbin)
+    h.SetBinError(1,fbine)
+    h.SetBinContent(0,0)
+    h.SetBinError(0,0)
+    nbins = h.GetNbinsX()
+    fbin  = h.GetBinContent(nbins) + h.GetBinContent(nbins+1)
+    fbine = math.sqrt(h.GetBinError(nbins)**2 + h.GetBinError(nbins+1)**2)
+    h.SetBinContent(nbins,fbin)
+    h.SetBinError(nbins,fbine)
+    h.SetBinContent(nbins+1,0)
+    h.SetBinError(nbins+1,0)
+
+def divideByBinWidthLoop(h):
+    for xbin in xrange(1,h.GetNbinsX()+1):
+        wid=h.GetXaxis().GetBinWidth(xbin)
+        h.SetBinContent(xbin,h.GetBinContent(xbin)/wid)
+        h.SetBinError(xbin,h.GetBinError(xbin)/wid)
+
+def getSystUncertaintiesLoop(nominal,systs):
+    nbins=len(nominal)-2
+    results=[]
+    for shape in [False,True]:
+        up,down=[0.]*(nbins+2),[0.]*(nbins+2)
+        for syst in systs:
+            sf=1.
+            if shape and sum(syst[1:-1])>0: sf=sum(nominal[1:-1])/sum(syst[1:-1])
+            for xbin in xrange(1,nbins+1):
+                diff=sf*syst[xbin]-nominal[xbin]
+                if diff>0: up[xbin]=math.sqrt(up[xbin]**2+diff**2)
+                else:      down[xbin]=math.sqrt(down[xbin]**2+diff**2)
+        results += [up,down]
+    return results
+
+def getBinValues(h):
+    return [h.GetBinContent(xbin) for xbin in xrange(h.GetNbinsX()+2)],[h.GetBinError(xbin) for xbin in xrange(h.GetNbinsX()+2)]
+
+def makeHisto(cls='TH1D',weighted=True,variableBins=False,seed=1):
+    rng=np.random.RandomState(seed)
+    if variableBins:
+        h=getattr(ROOT,cls)('h_%s_%d'%(cls,seed),'',5,np.array([0.,1.,3.,4.5,7.,10.]))
+    else:
+        h=getattr(ROOT,cls)('h_%s_%d'%(cls,seed),'',5,0.,10.)
+    h.SetDirectory(0)
+    for x in rng.uniform(-2,12,200):
+        if weighted: h.Fill(x,rng.uniform(0.5,1.5))
+        else:        h.Fill(x)
+    return h
+
+#
+# tests
+#
+
+@pytest.mark.parametrize('cls,weighted,variableBins',[('TH1D',True,False),('TH1F',True,True),('TH1D',False,True)])
+def test_histo_helpers_match_loops(cls,weighted,variableBins):
+    h=makeHisto(cls,weighted,variableBins)
+    href=h.Clone('href')
+    fixExtremities(h)
+    fixExtremitiesLoop(href)
+    divideByBinWidth(h)
+    divideByBinWidthLoop(href)
+    for a,b in zip(getBinValues(h),getBinValues(href)):
+        assert np.allclose(a,b,rtol=1e-6)
+    assert h.GetEntries()==makeHisto(cls,weighted,variableBins).GetEntries()
+
+def test_histo_contents_roundtrip():
+    h=makeHisto()
+    contents,sumw2=getHistoContents(h)
+    setHistoContents(h,2*contents,4*sumw2)
+    c,e=getBinValues(h)
+    assert np.allclose(c,2*contents) and np.allclose(e,2*np.sqrt(sumw2))
+
+def test_reset_nan_bins():
+    h=ROOT.TH2D('h2nan','',4,0,4,3,0,3)
+    h.SetDirectory(0)
+    for x in xrange(6):
+        for y in xrange(5):
+            h.SetBinContent(x,y,x+y)
+            h.SetBinError(x,y,1.)
+    h.SetBinContent(2,1,float('nan'))
+    resetNaNBins(h)
+    assert h.GetBinContent(2,1)==0. and h.GetBinError(2,1)==0.
+    assert h.GetBinContent(3,1)==4. and h.GetBinError(3,1)==1.
+
+def test_syst_uncertainties_match_loop():
+    rng=np.random.RandomState(3)
+    nominal=np.concatenate([[0.],rng.uniform(1,5,8),[0.]])
+    systs=np.concatenate([np.zeros((20,1)),rng.uniform(0.5,6,(20,8)),np.zeros((20,1))],axis=1)
+    systs[3]=0.    #zero integral, not normalized in the shape-only variant
+    systs[4]=nominal
+    for a,b in zip(getSystUncertainties(nominal,systs),getSystUncertaintiesLoop(nominal,systs)):
+        assert np.allclose(a[1:-1],b[1:-1],rtol=1e-12,atol=1e-12)
+
+def test_syst_matrix_matches_projections():
+
+    #weights with a NaN bin, an empty and a negative variation
+    nx,ny=5,6
+    rng=np.random.RandomState(4)
+    h2=ROOT.TH2D('h2','',nx,0,10,ny,0,ny)
+    h2.SetDirectory(0)
+    for xbin in xrange(nx+2):
+        for ybin in xrange(1,ny+1):
+            h2.SetBinContent(xbin,ybin,rng.uniform(0,3))
+            h2.SetBinError(xbin,ybin,0.1)
+    h2.SetBinContent(2,2,float('nan'))
+    for xbin in xrange(nx+2):
+        h2.SetBinContent(xbin,4,0.)
+        h2.SetBinContent(xbin,5,-1.)
+
+    #reference: one projection per weight as done before in plotter.py
+    ref=[]
+    for ybin in xrange(1,ny+1):
+        for xbin in xrange(0,nx+2):
+            if math.isnan(h2.GetBinContent(xbin,ybin)):
+                h2.SetBinContent(xbin,ybin,0)
+                h2.SetBinError(xbin,ybin,0)
+        px=h2.ProjectionX('_px%d'%ybin,ybin,ybin)
+        if px.Integral()<=0: continue
+        px.Scale(2.)
+        fixExtremitiesLoop(px)
+        divideByBinWidthLoop(px)
+        ref.append(getBinValues(px)[0])
+
+    h2.SetBinContent(2,2,float('nan'))
+    resetNaNBins(h2)
+    h2.Scale(2.)
+    p=Plot('test_syst')
+    p.add(h2,title='t#bar{t}',color=1,isData=False,spImpose=False,isSyst=True,doDivideByBinWidth=True)
+    assert np.allclose(p.getSystMatrix(),ref)
+
+    #a different number of weights can't be added to the same matrix
+    h2alt=ROOT.TH2D('h2alt','',nx,0,10,ny+1,0,ny+1)
+    h2alt.SetDirectory(0)
+    with pytest.raises(ValueError):
+        p.addSystMatrix(h2alt,'t#bar{t}')
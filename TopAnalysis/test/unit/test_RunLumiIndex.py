@@ -0,0 +1,79 @@
+import os
+import json
+import pytest
+import numpy as np
+
+from TopLJets2015.TopAnalysis.RunLumiIndex import RunLumiIndex, getRunLumiIndex
+
+def isInRunLumiLoop(run,lumi,runLumi):
+
+    """scan of the lumi ranges of the run, as done per event before the index"""
+
+    if not run in runLumi: return False
+    for lran in runLumi[run]:
+        if lumi>=lran[0] and lumi<=lran[1]:
+            return True
+    return False
+
+def getRunLumi(seed=1):
+
+    """ranges with overlaps, contiguous ranges and single lumi sections"""
+
+    rng=np.random.RandomState(seed)
+    runLumi={}
+    for run in rng.choice(np.arange(297000,297100),20,replace=False):
+        ranges=[]
+        for i in xrange(rng.randint(1,6)):
+            first=int(rng.randint(1,200))
+            ranges.append([first,first+int(rng.randint(0,30))])
+        ranges.append([ranges[0][1]+1,ranges[0][1]+5])
+        runLumi[int(run)]=ranges
+    return runLumi
+
+def getQueries(runLumi,seed=2):
+
+    """random run/lumi sections plus the edges of all the ranges"""
+
+    rng=np.random.RandomState(seed)
+    runs=list(rng.randint(296990,297110,2000))
+    lumis=list(rng.randint(0,260,2000))
+    for run in runLumi:
+        for first,last in runLumi[run]:
+            for lumi in [first-1,first,last,last+1]:
+                runs.append(run)
+                lumis.append(lumi)
+    return np.array(runs),np.array(lumis)
+
+def test_index_matches_loop():
+    runLumi=getRunLumi()
+    index=RunLumiIndex(runLumi)
+    runs,lumis=getQueries(runLumi)
+    ref=np.array([isInRunLumiLoop(run,lumi,runLumi) for run,lumi in zip(runs,lumis)])
+    assert ref.any() and not ref.all()
+    assert np.array_equal(index.mask(runs,lumis),ref)
+    assert [index.contains(run,lumi) for run,lumi in zip(runs,lumis)]==list(ref)
+    assert all([index.hasRun(run)==(run in runLumi) for run in runs])
+
+def test_empty_index():
+    index=RunLumiIndex({})
+    assert len(index)==0
+    assert not index.contains(297050,1)
+    assert not index.mask([297050,297051],[1,2]).any()
+
+def test_json_and_cache(tmpdir):
+    runLumi=getRunLumi(seed=3)
+    url=str(tmpdir.join('runlumi.json'))
+    with open(url,'w') as f:
+        json.dump(dict([(str(run),ranges) for run,ranges in runLumi.items()]),f)
+    cacheUrl=str(tmpdir.join('runlumi.npz'))
+    runs,lumis=getQueries(runLumi,seed=4)
+    ref=np.array([isInRunLumiLoop(run,lumi,runLumi) for run,lumi in zip(runs,lumis)])
+
+    #the second call reads the index from the cache
+    for i in xrange(2):
+        index=getRunLumiIndex(url,cacheUrl)
+        assert os.path.isfile(cacheUrl)
+        assert np.array_equal(index.mask(runs,lumis),ref)
+
+    #a cache built for a different json is not used
+    assert RunLumiIndex.load(cacheUrl,tag='another json') is None
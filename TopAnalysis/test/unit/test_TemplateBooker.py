@@ -0,0 +1,91 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+ROOT = pytest.importorskip('ROOT')
+root_numpy = pytest.importorskip('root_numpy')
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'../analysis/pps'))
+from generateBinnedWorkspace import TemplateBooker, getBookingPreselection
+
+PRESEL='bosonpt>50 && protonCat==1 && csi1>0.04 && csi2>0.04'
+CATEGS=['nvtx<20','nvtx>=20']
+
+def getTree(n=2500,seed=1):
+
+    """tree with nominal and systematic proton variables which pass the preselection independently"""
+
+    rng=np.random.RandomState(seed)
+    cols=['wgt','mmiss','systmmiss','csi1','csi2','systcsi1','systcsi2','bosonpt']
+    arr=np.zeros(n,dtype=[(c,np.float64) for c in cols]+[(c,np.int32) for c in ['protonCat','systprotonCat','mixType','nvtx']])
+    arr['wgt']=rng.normal(1,0.3,n)
+    arr['mmiss']=rng.uniform(-100,2600,n)
+    arr['systmmiss']=arr['mmiss']+rng.normal(0,50,n)
+    for c in ['csi1','csi2']:
+        arr[c]=rng.uniform(0.02,0.1,n)
+        arr['syst'+c]=arr[c]+rng.normal(0,0.01,n)
+    arr['bosonpt']=rng.exponential(80,n)
+    arr['protonCat']=rng.choice([1,2],n)
+    arr['systprotonCat']=np.where(rng.uniform(size=n)<0.2,3-arr['protonCat'],arr['protonCat'])
+    arr['mixType']=rng.choice([0,1,2],n)
+    arr['nvtx']=rng.poisson(20,n)
+    return root_numpy.array2tree(arr)
+
+def bookTemplates(booker):
+
+    """observed and background templates booked as in fillBackgroundTemplates"""
+
+    for icat,categCut in enumerate(CATEGS):
+        categCut='%s && %s'%(categCut,PRESEL)
+        booker.book('data_obs_%d'%icat,'mmiss','{0} && mmiss>0 && mixType==0'.format(categCut),50,0,2500)
+        for name,mixType,pfix in [('bkg_%d'%icat,1,''),('bkg_%d_bkgShape'%icat,1,'syst'),
+                                  ('bkg_%d_bkgShapeSingleDiffUp'%icat,2,''),('bkg_%d_bkgShapeSingleDiffDown'%icat,2,'syst')]:
+            templCuts=categCut.replace('csi1',pfix+'csi1').replace('csi2',pfix+'csi2')
+            if pfix=='syst': templCuts=templCuts.replace('protonCat','systprotonCat')
+            booker.book(name,pfix+'mmiss','wgt*({0} && {1}mmiss>0 && mixType=={2})'.format(templCuts,pfix,mixType),50,0,2500)
+
+def getDrawnTemplates(tree,booker):
+
+    """the booked templates filled with one TTree::Draw each, over all the entries"""
+
+    ROOT.gROOT.cd()
+    drawn=[]
+    for h,var,wgt in booker.templates:
+        href=h.Clone(h.GetName()+'_ref')
+        href.Reset('ICE')
+        href.SetDirectory(ROOT.gROOT)
+        tree.Draw('{0}>>{1}'.format(var,href.GetName()),wgt,'goff')
+        drawn.append( ([href.GetBinContent(xbin) for xbin in xrange(href.GetNbinsX()+2)],
+                       [href.GetBinError(xbin) for xbin in xrange(href.GetNbinsX()+2)]) )
+        href.Delete()
+    return drawn
+
+def getTemplates(booker):
+    return [([h.GetBinContent(xbin) for xbin in xrange(h.GetNbinsX()+2)],
+             [h.GetBinError(xbin) for xbin in xrange(h.GetNbinsX()+2)]) for h,_,_ in booker.templates]
+
+def test_templates_match_draw():
+    tree=getTree()
+
+    #blocks smaller than the tree, the last one partially filled
+    booker=TemplateBooker(tree,presel=getBookingPreselection(PRESEL),step=700)
+    bookTemplates(booker)
+    booker.fill()
+    for (sumw,err),(sumwRef,errRef) in zip(getTemplates(booker),getDrawnTemplates(tree,booker)):
+        assert np.allclose(sumw,sumwRef,rtol=1e-4,atol=1e-4)
+        assert np.allclose(err,errRef,rtol=1e-4,atol=1e-4)
+    assert booker.compareWithDraw()==0
+
+def test_nominal_preselection_drops_syst_events():
+    #reading only the events passing the nominal proton cuts loses events of the systematic templates
+    tree=getTree()
+    booker=TemplateBooker(tree,presel=PRESEL)
+    bookTemplates(booker)
+    booker.fill()
+    failed=[h.GetName() for (h,_,_),(sumw,_),(sumwRef,_) in zip(booker.templates,getTemplates(booker),getDrawnTemplates(tree,booker))
+            if not np.allclose(sumw,sumwRef,rtol=1e-4,atol=1e-4)]
+    assert len(failed)>0 and all(['bkgShape' in name for name in failed])
+
+def test_booking_preselection():
+    assert getBookingPreselection('bosonpt>50')=='bosonpt>50'
+    assert getBookingPreselection('protonCat==1 && csi1>0.04')=='(protonCat==1 && csi1>0.04) || (systprotonCat==1 && systcsi1>0.04)'
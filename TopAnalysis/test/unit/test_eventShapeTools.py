@@ -0,0 +1,43 @@
+import pytest
+import numpy as np
+
+ROOT = pytest.importorskip('ROOT')
+from TopLJets2015.TopAnalysis.eventShapeTools import EventShapeTool
+
+def getEventShapes(p3,offsets,r=2):
+
+    """event shapes computed one event at a time with analyseNewEvent, re-using the same tool as in an event loop"""
+
+    shapes=[]
+    est=EventShapeTool()
+    for i in xrange(len(offsets)-1):
+        p4s=[]
+        for px,py,pz in p3[offsets[i]:offsets[i+1]]:
+            p4=ROOT.TLorentzVector()
+            p4.SetXYZM(px,py,pz,0.)
+            p4s.append(p4)
+        est.analyseNewEvent(p4s,r)
+        shapes.append( (est.sphericity,est.aplanarity,est.C,est.D) )
+    return np.array(shapes).T
+
+def getBatch(counts,seed=1):
+    rng=np.random.RandomState(seed)
+    offsets=np.concatenate([[0],np.cumsum(counts)])
+    return rng.normal(0,50,(offsets[-1],3)),offsets
+
+@pytest.mark.parametrize('r',[2,1])
+def test_batch_matches_single_events(r):
+    p3,offsets=getBatch(np.random.RandomState(2).poisson(5,200))
+    assert np.allclose(EventShapeTool().analyseEvents(p3,offsets,r),getEventShapes(p3,offsets,r),atol=1e-10)
+
+def test_empty_and_single_particle_events():
+    #empty events at the start, middle and end of the batch
+    p3,offsets=getBatch([0,0,3,1,0,4,2,0,0])
+    assert np.allclose(EventShapeTool().analyseEvents(p3,offsets),getEventShapes(p3,offsets),atol=1e-10)
+
+def test_trailing_empty_events():
+    p3=np.eye(3)
+    single=EventShapeTool().analyseEvents(p3,[0,3])
+    padded=EventShapeTool().analyseEvents(p3,[0,3,3,3])
+    assert np.allclose(np.array(padded)[:,0],np.array(single)[:,0])
+    assert np.allclose(np.array(padded)[:,1:],0.)
@@ -0,0 +1,93 @@
+import math
+import pytest
+import numpy as np
+
+ROOT = pytest.importorskip('ROOT')
+from TopLJets2015.TopAnalysis import nuSolutions
+
+def boost(p,beta):
+    b2=np.dot(beta,beta)
+    gamma=1./math.sqrt(1-b2)
+    bp=np.dot(beta,p[:3])
+    return np.concatenate([p[:3]+((gamma-1)/b2*bp+gamma*p[3])*beta,[gamma*(p[3]+bp)]])
+
+def decay(rng,P,m1,m2):
+    M=math.sqrt(P[3]**2-np.dot(P[:3],P[:3]))
+    pst=math.sqrt((M**2-(m1+m2)**2)*(M**2-(m1-m2)**2))/(2*M)
+    u=rng.normal(size=3)
+    u/=np.linalg.norm(u)
+    p1=np.concatenate([pst*u,[math.sqrt(pst**2+m1**2)]])
+    p2=np.concatenate([-pst*u,[math.sqrt(pst**2+m2**2)]])
+    return boost(p1,P[:3]/P[3]),boost(p2,P[:3]/P[3])
+
+def getDileptonEvents(n=100,seed=3):
+
+    """ttbar dilepton decays as (N,4) arrays of (px,py,pz,E), half of the events with a smeared MET"""
+
+    rng=np.random.RandomState(seed)
+    b,b_,l,l_,met=[],[],[],[],[]
+    for i in xrange(n):
+        nus=[]
+        for bList,lList in [(b,l),(b_,l_)]:
+            p=rng.normal(0,100,3)
+            top=np.concatenate([p,[math.sqrt(np.dot(p,p)+nuSolutions.mT**2)]])
+            bq,W=decay(rng,top,4.8,nuSolutions.mW)
+            lep,nu=decay(rng,W,0.105,0.)
+            bList.append(bq)
+            lList.append(lep)
+            nus.append(nu)
+        met.append( nus[0][:2]+nus[1][:2]+(rng.normal(0,20,2) if i%2 else 0.) )
+    return [np.array(x) for x in (b,b_,l,l_,met)]
+
+def toLV(p):
+    return ROOT.Math.PxPyPzEVector(*p)
+
+def test_double_neutrino_solutions():
+    b,b_,l,l_,met=getDileptonEvents()
+    batch=nuSolutions.doubleNeutrinoSolutionsBatch((b,b_),(l,l_),met)
+    nunu=batch.nunu_s
+    for i in xrange(len(b)):
+        try:
+            ref=nuSolutions.doubleNeutrinoSolutions((toLV(b[i]),toLV(b_[i])),(toLV(l[i]),toLV(l_[i])),tuple(met[i])).nunu_s
+        except np.linalg.LinAlgError:
+            assert not batch.mask[i].any()
+            continue
+        sols=[nunu[i,k] for k in xrange(4) if batch.mask[i,k]]
+        assert len(sols)==len(ref)
+
+        #the leastsq fallback only converges to ftol=5e-5, round-off in the inputs moves its minimum
+        tol=dict(rtol=1e-3,atol=0.1) if batch.fallback[i] else dict(rtol=1e-6,atol=1e-6)
+
+        #the order of the solutions on the same line is not meaningful
+        for nu,nu_ in ref:
+            assert any([np.allclose(nu,s[0],**tol) and np.allclose(nu_,s[1],**tol) for s in sols])
+
+def test_single_neutrino_solution():
+    b,_,l,_,met=getDileptonEvents()
+    sigma2=np.array([[100.,0.],[0.,100.]])
+    batch=nuSolutions.singleNeutrinoSolutionBatch(b,l,met,sigma2)
+    nu=batch.nu
+    for i in xrange(len(b)):
+        try:
+            ref=nuSolutions.singleNeutrinoSolution(toLV(b[i]),toLV(l[i]),tuple(met[i]),sigma2)
+            chi2,refNu=ref.chi2,ref.nu
+        except (np.linalg.LinAlgError,IndexError):
+            assert not batch.valid[i]
+            continue
+        assert batch.valid[i]
+        assert np.allclose(chi2,batch.chi2[i],rtol=1e-6,atol=1e-6)
+        assert np.allclose(refNu,nu[i],rtol=1e-6,atol=1e-6)
+
+def test_degenerate_events_are_masked():
+    #a b jet collinear with the lepton has no solution
+    b,b_,l,l_,met=getDileptonEvents(6)
+    refDouble=nuSolutions.doubleNeutrinoSolutionsBatch((b,b_),(l,l_),met)
+    refSingle=nuSolutions.singleNeutrinoSolutionBatch(b,l,met,np.eye(2)*100.)
+    b[2]=l[2]
+    double=nuSolutions.doubleNeutrinoSolutionsBatch((b,b_),(l,l_),met)
+    single=nuSolutions.singleNeutrinoSolutionBatch(b,l,met,np.eye(2)*100.)
+    assert not double.mask[2].any() and not single.valid[2]
+    others=np.arange(len(b))!=2
+    assert (double.mask[others]==refDouble.mask[others]).all()
+    assert np.allclose(double.nunu_s[others][double.mask[others]],refDouble.nunu_s[others][refDouble.mask[others]])
+    assert np.allclose(single.nu[others],refSingle.nu[others])